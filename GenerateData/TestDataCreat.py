@@ -1,17 +1,22 @@
 import pandas as pd
-import random
 from faker import Faker
 from datetime import datetime
 from dbhelp import engine  # 你自己的封装
 from tqdm import tqdm  # 进度条展示（可选）
-import uuid
+from batch_controller import AdaptiveBatchController
+from job_metrics import JobMetrics, stage
+from seeded_rows import SeededRows
+import argparse
 
 fake = Faker("zh_CN")
 
+# 指定 seed 时使用固定的创建时间，保证同一 seed 生成的数据完全相同
+SEEDED_TIMESTAMP = 1735689600000  # 2025-01-01 00:00:00 UTC
 
-def generate_device_row(i):
-    timestamp = int(datetime.now().timestamp() * 1000)
-    uid = str(uuid.uuid4())  # 同一个ID用于两张表
+
+def generate_device_row(i, seeded, timestamp=None):
+    timestamp = timestamp or int(datetime.now().timestamp() * 1000)
+    uid = str(seeded.uuid(i, "device"))  # 同一个ID用于两张表
 
     device = {
         "id": uid,
@@ -37,7 +42,7 @@ def generate_device_row(i):
     }
 
     asset_bind = {
-        "id": str(uuid.uuid4()),  # asset_bind自己的ID
+        "id": str(seeded.uuid(i, "asset_bind")),  # asset_bind自己的ID
         "target_type": "org",
         "target_id": "1f4c4a03-9a10-4a84-b561-01be1b73c09a",
         "target_key": "77fed374bc13008dadbe7e3d18d3d8d6",
@@ -62,22 +67,46 @@ asset_bind_columns = [
     "id", "target_type", "target_id", "target_key", "asset_type", "asset_id", "relation", "permission", "update_time"
 ]
 
-# 分批插入
-batch_size = 5000
-total = 1000000 # 百万
 
-for start in tqdm(range(0, total, batch_size)):
-    device_rows = []
-    bind_rows = []
+def main(total=1000000, seed=None):
+    # 分批插入：批大小从 5000 起按提交耗时自适应调整（行内容只由 seed 和行号决定，与批大小无关）
+    controller = AdaptiveBatchController(initial=5000, max_size=50000, target_latency=2.0, name="设备档案写入")
+    seeded = SeededRows(seed)
+    timestamp = SEEDED_TIMESTAMP if seed is not None else None
+
+    pbar = tqdm(total=total)
+    start = 0
+    while start < total:
+        end = min(start + controller.size, total)
+        device_rows = []
+        bind_rows = []
+
+        with stage("generate"):
+            for i in range(start, end):
+                device, asset_bind = generate_device_row(i, seeded, timestamp)
+                device_rows.append(device)
+                bind_rows.append(asset_bind)
+
+            df_device = pd.DataFrame(device_rows, columns=device_columns)
+            df_bind = pd.DataFrame(bind_rows, columns=asset_bind_columns)
+
+        # 插入两张表（同一事务，计时包含提交）
+        with controller.measure(end - start), engine.begin() as conn:
+            df_device.to_sql("dev_device_instance", con=conn, if_exists="append", index=False)
+            df_bind.to_sql("s_dimension_assets_bind", con=conn, if_exists="append", index=False)
+
+        pbar.update(end - start)
+        start = end
+
+    pbar.close()
+    print(controller.summary())
 
-    for i in range(start, min(start + batch_size, total)):
-        device, asset_bind = generate_device_row(i)
-        device_rows.append(device)
-        bind_rows.append(asset_bind)
 
-    df_device = pd.DataFrame(device_rows, columns=device_columns)
-    df_bind = pd.DataFrame(bind_rows, columns=asset_bind_columns)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量生成设备档案与资产绑定测试数据")
+    parser.add_argument("--count", type=int, default=1000000, help="生成条数")
+    parser.add_argument("--seed", type=int, help="随机种子，相同 seed 生成完全相同的数据")
+    args = parser.parse_args()
 
-    # 插入两张表
-    df_device.to_sql("dev_device_instance", con=engine, if_exists="append", index=False)
-    df_bind.to_sql("s_dimension_assets_bind", con=engine, if_exists="append", index=False)
+    with JobMetrics("test_data"):
+        main(total=args.count, seed=args.seed)
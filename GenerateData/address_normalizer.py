@@ -0,0 +1,78 @@
+import logging
+import re
+import sys
+import time
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# === 预编译的规范化规则 ===
+_PUNCT_RE = re.compile(r"[^\w\s]")
+_SPACE_RE = re.compile(r"\s+")
+
+# 缩写统一为全称（去标点、转小写之后按整词替换），如 "Al Safa Dist." 与 "Al Safa District" 归一
+ABBREVIATIONS = {
+    "dist": "district",
+}
+_ABBR_RE = re.compile(r"\b(" + "|".join(map(re.escape, ABBREVIATIONS)) + r")\b")
+
+
+def _expand(match):
+    return ABBREVIATIONS[match.group(1)]
+
+
+@lru_cache(maxsize=None)
+def _clean(s):
+    s = _PUNCT_RE.sub("", s.lower())
+    s = _ABBR_RE.sub(_expand, s)
+    return sys.intern(_SPACE_RE.sub(" ", s).strip())
+
+
+def clean_cache_info():
+    """clean_string 缓存命中统计（hits / misses / currsize）"""
+    return _clean.cache_info()
+
+
+def clean_string(s):
+    """小写、去标点、缩写展开、合并空白；非字符串返回空串。结果缓存并驻留（intern）"""
+    if not isinstance(s, str):
+        return ""
+    return _clean(s)
+
+
+def normalize_series(series):
+    """
+    向量化规范化一列地址：先对去重后的取值走 str 访问器流水线，再按编码映射回原列
+    与 clean_string 结果一致，非字符串（None/NaN/数字）得到空串
+    """
+    codes, uniques = pd.factorize(series)
+    values = pd.Series(uniques, dtype=object)
+    is_str = values.map(type).eq(str)
+    cleaned = (values.where(is_str, "").astype(str)
+               .str.lower()
+               .str.replace(_PUNCT_RE, "", regex=True)
+               .str.replace(_ABBR_RE, _expand, regex=True)
+               .str.replace(_SPACE_RE, " ", regex=True)
+               .str.strip())
+    lookup = np.array([sys.intern(v) for v in cleaned.tolist()] + [""], dtype=object)  # 末位对应 NaN 的编码 -1
+    return pd.Series(lookup[codes], index=series.index, dtype=object)
+
+
+def build_geo_index(geo_df):
+    """
+    由 GeoAdministrativeUnitsnew.csv 构建 {省: {市: {区: [(lat, lon), ...]}}}，名称均为规范化后的形式
+    """
+    start_time = time.time()
+    provinces = normalize_series(geo_df['Region'])
+    cities = normalize_series(geo_df['City'])
+    districts = normalize_series(geo_df['district'])
+
+    geo_index = {}
+    for province, city, district, lat, lon in zip(provinces, cities, districts,
+                                                  geo_df['latitude'], geo_df['longitude']):
+        geo_index.setdefault(province, {}).setdefault(city, {}).setdefault(district, []).append((lat, lon))
+
+    logger.info(f"🌳 地址索引构建完成 | 耗时: {time.time() - start_time:.2f}s")
+    return geo_index
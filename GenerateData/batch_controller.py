@@ -0,0 +1,156 @@
+import logging
+import random
+import time
+from contextlib import contextmanager
+import job_metrics
+
+logger = logging.getLogger(__name__)
+
+# 锁等待超时 / 死锁 / 拿不到锁（MySQL 错误码、PostgreSQL SQLSTATE）
+LOCK_ERROR_CODES = {1205, 1213}
+LOCK_SQLSTATES = {"40P01", "55P03"}
+# 可重试：锁相关 + PostgreSQL 序列化失败
+RETRYABLE_SQLSTATES = LOCK_SQLSTATES | {"40001"}
+
+
+def _error_code(exc):
+    """取出 DBAPI 异常的 (pgcode, MySQL 错误码)，兼容 SQLAlchemy 包装"""
+    orig = getattr(exc, "orig", exc)
+    args = getattr(orig, "args", ())
+    return getattr(orig, "pgcode", None), args[0] if args else None
+
+
+def is_lock_error(exc):
+    """判断异常是否为锁超时或死锁"""
+    pgcode, mysql_code = _error_code(exc)
+    if pgcode in LOCK_SQLSTATES or mysql_code in LOCK_ERROR_CODES:
+        return True
+    message = str(exc).lower()
+    return "lock wait timeout" in message or "deadlock" in message or "lock timeout" in message
+
+
+def is_retryable_error(exc):
+    """锁超时、死锁、序列化失败可以原样重试；数据错误、约束冲突等重试也不会成功"""
+    pgcode, _ = _error_code(exc)
+    return is_lock_error(exc) or pgcode in RETRYABLE_SQLSTATES or "could not serialize access" in str(exc)
+
+
+def backoff_delay(attempt, base=1.0, cap=30.0):
+    """第 attempt 次（从 1 开始）失败后的退避秒数：指数增长并加随机抖动，避免多个任务同时重试"""
+    delay = min(base * 2 ** (attempt - 1), cap)
+    return random.uniform(delay / 2, delay)
+
+
+class AdaptiveBatchController:
+    """
+    根据提交耗时自动调整批大小，替代写死的 batch_size 与固定 sleep
+
+    - 提交耗时低于 target_latency：批大小按 growth 倍增长，直到 max_size
+    - 超过 target_latency：按 目标/实际 的比例缩小
+    - 超过 target_latency * spike_factor（延迟尖刺）或锁超时/死锁：批大小减半，并在下一批前退避等待
+    - 正常情况下不 sleep，只有数据库表现出压力时才让出时间
+
+    用法:
+        controller = AdaptiveBatchController(initial=100)
+        for batch in controller.split(records):
+            with controller.measure(len(batch)):
+                conn.execute(update_sql, batch)
+                conn.commit()
+    """
+
+    def __init__(self, initial=100, min_size=10, max_size=10000, target_latency=0.5,
+                 growth=1.25, spike_factor=3.0, backoff_base=1.0, max_backoff=30.0, name="批量写入"):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self.growth = growth
+        self.spike_factor = spike_factor
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self.name = name
+
+        self._size = float(min(max(initial, min_size), max_size))
+        self._cooldown = 0.0
+        self._errors = 0
+        self.batches = 0
+        self.rows = 0
+        self.busy_time = 0.0
+
+    @property
+    def size(self):
+        return int(self._size)
+
+    def _resize(self, size):
+        self._size = float(min(max(size, self.min_size), self.max_size))
+
+    def record(self, rows, latency):
+        """记录一次成功提交的行数与耗时（秒），调整下一批的大小"""
+        self._errors = 0
+        self.batches += 1
+        self.rows += rows
+        self.busy_time += latency
+        job_metrics.add_time("db_write", latency)
+        job_metrics.count("rows_written", rows)
+
+        if latency > self.target_latency * self.spike_factor:
+            self._resize(self._size / 2)
+            self._cooldown = min(latency - self.target_latency, self.max_backoff)
+            logger.warning(f"⚠️ {self.name} 提交耗时 {latency:.2f}s 超出目标，批大小降至 {self.size}，"
+                           f"暂停 {self._cooldown:.2f}s")
+        elif latency > self.target_latency:
+            self._resize(self._size * self.target_latency / latency)
+        elif rows >= self.size:
+            # 只有满批才说明当前批大小已被验证，尾批不参与增长
+            self._resize(self._size * self.growth)
+        job_metrics.gauge("batch_size", self.size)
+        job_metrics.tick()
+
+    def record_error(self, exc):
+        """
+        记录一次失败的提交：锁超时/死锁时批大小减半；可重试的错误在下一批前按指数（带抖动）退避，
+        数据错误等不代表数据库有压力，不退避
+        :return: bool - 是否为锁相关错误
+        """
+        self._errors += 1
+        job_metrics.count("write_errors")
+        lock_error = is_lock_error(exc)
+        if lock_error:
+            self._resize(self._size / 2)
+        if is_retryable_error(exc):
+            self._cooldown = backoff_delay(self._errors, self.backoff_base, self.max_backoff)
+        return lock_error
+
+    def pause(self):
+        """需要退避时等待，否则立即返回"""
+        if self._cooldown > 0:
+            time.sleep(self._cooldown)
+            job_metrics.add_time("backoff", self._cooldown)
+            self._cooldown = 0.0
+
+    @contextmanager
+    def measure(self, rows):
+        """
+        统计 with 块（执行 + 提交）的耗时；块内抛出的异常会计入 record_error 后继续抛出
+        进入前先执行必要的退避等待
+        """
+        self.pause()
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.record_error(e)
+            raise
+        self.record(rows, time.perf_counter() - start)
+
+    def split(self, items):
+        """按当前批大小依次切分 list / DataFrame，每取一批都使用最新的批大小"""
+        sliceable = getattr(items, "iloc", items)
+        start = 0
+        while start < len(items):
+            size = self.size
+            yield sliceable[start:start + size]
+            start += size
+
+    def summary(self):
+        rate = self.rows / self.busy_time if self.busy_time else 0.0
+        return f"{self.name}: {self.batches} 批 / {self.rows} 条，当前批大小 {self.size}，写入速度 {rate:.0f} 条/秒"
@@ -0,0 +1,69 @@
+import logging
+import time
+from batch_controller import is_retryable_error, backoff_delay
+import job_metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _attempt(write_fn, segment, controller, max_retries, base_delay, max_delay):
+    """
+    写入一段数据：只对可重试的错误（锁超时、死锁、序列化失败）退避重试
+    :return: None 表示成功，否则为最后一次的异常
+    """
+    for attempt in range(1, max_retries + 1):
+        try:
+            if controller is None:
+                write_fn(segment)
+            else:
+                # 退避等待由 controller.measure 在下一次进入时完成
+                with controller.measure(len(segment)):
+                    write_fn(segment)
+            return None
+        except Exception as e:
+            if not is_retryable_error(e) or attempt == max_retries:
+                return e
+            logger.warning(f"⚠️ {len(segment)} 条写入遇到可重试错误，第 {attempt} 次重试: {e}")
+            job_metrics.count("retries")
+            if controller is None:
+                time.sleep(backoff_delay(attempt, base_delay, max_delay))
+
+
+def write_with_bisect(write_fn, rows, controller=None, max_retries=3, base_delay=0.5, max_delay=10.0):
+    """
+    批量写入，失败时对半拆分定位出错的行，其余行仍按批写入
+
+    - write_fn(rows) 需在一个事务内完成写入（失败时整体回滚），rows 为 list 或 DataFrame
+    - 每段先按可重试错误退避重试；重试用尽仍是可重试错误时整段记为失败，不再拆分
+      （锁冲突 / 死锁与具体哪一行无关，拆分只会成倍放大对已经争用的表的写入）
+    - 不可重试的错误才拆成两半分别写入，直到单行；单行仍失败即为真正的坏数据
+    - 失败的行连同错误一起返回，由调用方记录
+    - 传入 AdaptiveBatchController 时，每次提交计入其延迟统计，退避也交给它
+
+    :return: (成功写入的行数, [(坏行, 异常), ...])
+    """
+    written = 0
+    failed = []
+    sliceable = getattr(rows, "iloc", rows)
+    stack = [(0, len(rows))]
+    while stack:
+        start, end = stack.pop()
+        segment = sliceable[start:end]
+        error = _attempt(write_fn, segment, controller, max_retries, base_delay, max_delay)
+        if error is None:
+            written += end - start
+        elif end - start == 1 or is_retryable_error(error):
+            if end - start > 1:
+                logger.warning(f"⚠️ {end - start} 条重试 {max_retries} 次仍失败，整段记为失败: {error}")
+            failed.extend((row, error) for row in (segment if isinstance(segment, list)
+                                                   else (segment.iloc[i] for i in range(len(segment)))))
+        else:
+            mid = (start + end) // 2
+            # 先处理前半段，保持写入顺序
+            stack.append((mid, end))
+            stack.append((start, mid))
+
+    if failed:
+        job_metrics.count("rows_failed", len(failed))
+        logger.warning(f"⚠️ {len(rows)} 条中有 {len(failed)} 条写入失败，其余 {written} 条已写入")
+    return written, failed
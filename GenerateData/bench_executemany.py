@@ -0,0 +1,112 @@
+"""
+executemany 快速路径基准：对比 dbhelp 中 fast_executemany 关闭 / 开启时的批量插入、批量更新吞吐（条/秒）
+
+本地容器示例:
+    docker run -d --name bench-pg -e POSTGRES_PASSWORD=p@ssw0rd. -p 5432:5432 postgres:16
+    docker run -d --name bench-mysql -e MYSQL_ROOT_PASSWORD=p@ssw0rd. -e MYSQL_DATABASE=bench -p 3306:3306 mysql:8
+
+    python bench_executemany.py --type postgresql --host 127.0.0.1 --port 5432 --user postgres --database postgres
+    python bench_executemany.py --type mysql --host 127.0.0.1 --port 3306 --user root --database bench
+    python bench_executemany.py --config DB_CONFIG4      # 使用 dbhelp 中已有的配置（会在该库建临时表 bench_executemany）
+"""
+import argparse
+import logging
+import random
+import time
+import uuid
+from sqlalchemy import text
+import dbhelp
+from dbhelp import get_engine, bulk_insert
+
+# === 日志 ===
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BENCH_TABLE = "bench_executemany"
+BATCH_SIZE = 5000
+
+
+def build_rows(total):
+    return [{
+        "id": uuid.uuid4().hex,
+        "device_name": f"bench_{i}",
+        "install_latitude": round(random.uniform(16, 32), 6),
+        "install_longitude": round(random.uniform(35, 55), 6),
+    } for i in range(total)]
+
+
+def reset_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {BENCH_TABLE}"))
+        conn.execute(text(f"""
+            CREATE TABLE {BENCH_TABLE} (
+                id                VARCHAR(32) PRIMARY KEY,
+                device_name       VARCHAR(64),
+                install_latitude  DOUBLE PRECISION,
+                install_longitude DOUBLE PRECISION
+            )
+        """))
+
+
+def timed_batches(engine, rows, write_fn):
+    """按 BATCH_SIZE 分批写入（每批一个事务），返回 条/秒"""
+    start_time = time.time()
+    for i in range(0, len(rows), BATCH_SIZE):
+        with engine.begin() as conn:
+            write_fn(conn, rows[i:i + BATCH_SIZE])
+    return len(rows) / max(time.time() - start_time, 0.001)
+
+
+def run_case(config, rows, fast):
+    engine = get_engine(config, fast_executemany=fast)
+    reset_table(engine)
+
+    insert_rate = timed_batches(engine, rows, lambda conn, batch: bulk_insert(conn, BENCH_TABLE, batch))
+
+    update_sql = text(f"""
+        UPDATE {BENCH_TABLE}
+        SET install_latitude = :install_latitude, install_longitude = :install_longitude
+        WHERE id = :id
+    """)
+    moved = [{**r, "install_latitude": r["install_latitude"] + 0.001} for r in rows]
+    update_rate = timed_batches(engine, moved, lambda conn, batch: conn.execute(update_sql, batch))
+
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {BENCH_TABLE}"))
+    engine.dispose()
+    return insert_rate, update_rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="executemany 快速路径基准")
+    parser.add_argument("--config", help="dbhelp 中的配置名，如 DB_CONFIG4；不指定则使用下列连接参数")
+    parser.add_argument("--type", default="postgresql", choices=["postgresql", "mysql"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5432)
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default="p@ssw0rd.")
+    parser.add_argument("--database", default="postgres")
+    parser.add_argument("--rows", type=int, default=100000)
+    args = parser.parse_args()
+
+    if args.config:
+        config = getattr(dbhelp, args.config)
+    else:
+        config = {"type": args.type, "user": args.user, "password": args.password,
+                  "host": args.host, "port": args.port, "database": args.database}
+
+    rows = build_rows(args.rows)
+    logger.info(f"🚀 {config['type']}@{config['host']}:{config['port']} | {args.rows} 条 | 每批 {BATCH_SIZE}")
+
+    results = {}
+    for fast in (False, True):
+        results[fast] = run_case(config, rows, fast)
+        label = "开启" if fast else "关闭"
+        logger.info(f"快速路径{label}: 插入 {results[fast][0]:.0f} 条/秒 | 更新 {results[fast][1]:.0f} 条/秒")
+
+    (slow_insert, slow_update), (fast_insert, fast_update) = results[False], results[True]
+    logger.info(f"📊 提升倍数: 插入 x{fast_insert / slow_insert:.2f} | 更新 x{fast_update / slow_update:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+"""
+写入策略基准：在本地 PostgreSQL / MySQL 容器中造一张 dev_device_instance 同构表，
+依次运行仓库里用过的几种写法，输出可直接对比的表格（同时写入 bench_write_strategies.csv）
+
+指标:
+    rows_per_sec      吞吐（条/秒）
+    p50_ms / p99_ms   单批（单事务）提交延迟
+    lock_waits        MySQL 为 Innodb_row_lock_waits 增量；PostgreSQL 为每 100ms 采样 pg_locks 中未获得锁的等待数之和
+    log_mb            PostgreSQL WAL（pg_current_wal_lsn 差值）/ MySQL binlog（SHOW BINARY LOGS 文件大小差值）
+    background_p99_ms 同时运行的"生产流量"（单行更新）的 p99 延迟，衡量对线上的影响
+
+用法:
+    python bench_write_strategies.py                                   # 启动 postgres:16 与 mysql:8.0 容器，跑完后删除
+    python bench_write_strategies.py --db postgresql --rows 200000 --batch-size 1000
+    python bench_write_strategies.py --config DB_CONFIG4 --no-docker   # 使用 dbhelp 中已有的库（仅创建/删除 bench_ 前缀的表）
+"""
+import argparse
+import logging
+import random
+import subprocess
+import threading
+import time
+import uuid
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+import dbhelp
+from dbhelp import get_engine, bulk_insert
+
+# === 日志 ===
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# === 运行配置 ===
+BENCH_TABLE = "bench_dev_device_instance"
+RESULT_FILE = "bench_write_strategies.csv"
+BENCH_PASSWORD = "p@ssw0rd."
+
+CONTAINERS = {
+    "postgresql": {
+        "image": "postgres:16",
+        "name": "generatedata-bench-pg",
+        "port": 55432,
+        "inner_port": 5432,
+        "env": {"POSTGRES_PASSWORD": BENCH_PASSWORD},
+        "config": {"type": "postgresql", "user": "postgres", "password": BENCH_PASSWORD,
+                   "host": "127.0.0.1", "port": 55432, "database": "postgres"},
+    },
+    "mysql": {
+        "image": "mysql:8.0",
+        "name": "generatedata-bench-mysql",
+        "port": 53306,
+        "inner_port": 3306,
+        "env": {"MYSQL_ROOT_PASSWORD": BENCH_PASSWORD, "MYSQL_DATABASE": "bench"},
+        "config": {"type": "mysql", "user": "root", "password": BENCH_PASSWORD,
+                   "host": "127.0.0.1", "port": 53306, "database": "bench"},
+    },
+}
+
+
+# === 容器管理 ===
+def start_container(db_type, timeout=120):
+    spec = CONTAINERS[db_type]
+    subprocess.run(["docker", "rm", "-f", spec["name"]], capture_output=True)
+    cmd = ["docker", "run", "-d", "--name", spec["name"], "-p", f"{spec['port']}:{spec['inner_port']}"]
+    for key, value in spec["env"].items():
+        cmd += ["-e", f"{key}={value}"]
+    subprocess.run(cmd + [spec["image"]], check=True, capture_output=True)
+    logger.info(f"🐳 已启动容器 {spec['name']} ({spec['image']})，等待就绪...")
+
+    engine = get_engine(spec["config"])
+    deadline = time.time() + timeout
+    while True:
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            return spec["config"]
+        except Exception:
+            if time.time() > deadline:
+                raise
+            time.sleep(2)
+
+
+def stop_container(db_type):
+    subprocess.run(["docker", "rm", "-f", CONTAINERS[db_type]["name"]], capture_output=True)
+
+
+# === 造数 ===
+def build_rows(total):
+    rows = []
+    for i in range(total):
+        region_id = random.randint(1, 5000)
+        rows.append({
+            "id": uuid.uuid4().hex,
+            "device_name": f"bench_{i}",
+            "province_id": region_id // 500,
+            "city_id": region_id // 50,
+            "region_id": region_id,
+            "region_name": f"District {region_id}",
+            "install_latitude": round(random.uniform(16, 32), 6),
+            "install_longitude": round(random.uniform(35, 55), 6),
+        })
+    return rows
+
+
+def seed_table(engine, rows, batch_size=5000):
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {BENCH_TABLE}"))
+        conn.execute(text(f"""
+            CREATE TABLE {BENCH_TABLE} (
+                id                VARCHAR(32) PRIMARY KEY,
+                device_name       VARCHAR(64),
+                province_id       BIGINT,
+                city_id           BIGINT,
+                region_id         BIGINT,
+                region_name       VARCHAR(128),
+                install_latitude  DOUBLE PRECISION,
+                install_longitude DOUBLE PRECISION
+            )
+        """))
+    for i in range(0, len(rows), batch_size):
+        with engine.begin() as conn:
+            bulk_insert(conn, BENCH_TABLE, rows[i:i + batch_size])
+
+
+def make_updates(rows):
+    """每行换一个区域与坐标，作为各策略的更新内容"""
+    updates = []
+    for row in rows:
+        region_id = random.randint(1, 5000)
+        updates.append({
+            "id": row["id"],
+            "region_id": region_id,
+            "region_name": f"District {region_id}'s",  # 带引号，检验拼接 SQL 的转义
+            "install_latitude": round(random.uniform(16, 32), 6),
+            "install_longitude": round(random.uniform(35, 55), 6),
+        })
+    return updates
+
+
+# === 写入策略（每个函数处理一批，在一个事务内完成）===
+UPDATE_SQL = text(f"""
+    UPDATE {BENCH_TABLE}
+    SET region_id = :region_id,
+        region_name = :region_name,
+        install_latitude = :install_latitude,
+        install_longitude = :install_longitude
+    WHERE id = :id
+""")
+
+
+def update_executemany(conn, batch, db_type):
+    """ultra_safe_batch_update：同一语句 executemany"""
+    conn.execute(UPDATE_SQL, batch)
+
+
+def _quote(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def update_case(conn, batch, db_type):
+    """batch_update_mysql：CASE WHEN 拼接为一条 UPDATE"""
+    def build_case(field):
+        return "CASE id\n" + "\n".join(
+            f"WHEN {_quote(r['id'])} THEN {_quote(r[field]) if field == 'region_name' else r[field]}"
+            for r in batch) + "\nEND"
+
+    conn.execute(text(f"""
+        UPDATE {BENCH_TABLE}
+        SET region_id = {build_case('region_id')},
+            region_name = {build_case('region_name')},
+            install_latitude = {build_case('install_latitude')},
+            install_longitude = {build_case('install_longitude')}
+        WHERE id IN ({", ".join(_quote(r['id']) for r in batch)})
+    """.replace(":", r"\:")))  # 值已内联，转义冒号避免被 text() 当作绑定参数
+
+
+def update_values(conn, batch, db_type):
+    """区域信息匹配 bulk_update：VALUES 派生表 JOIN 更新"""
+    params = {}
+    for i, r in enumerate(batch):
+        params.update({f"id_{i}": r["id"], f"r_{i}": r["region_id"], f"n_{i}": r["region_name"],
+                       f"lat_{i}": r["install_latitude"], f"lon_{i}": r["install_longitude"]})
+
+    if db_type == "postgresql":
+        values = ", ".join(
+            f"(:id_{i}, CAST(:r_{i} AS BIGINT), :n_{i}, "
+            f"CAST(:lat_{i} AS DOUBLE PRECISION), CAST(:lon_{i} AS DOUBLE PRECISION))"
+            for i in range(len(batch)))
+        conn.execute(text(f"""
+            UPDATE {BENCH_TABLE} AS t
+            SET region_id = v.region_id,
+                region_name = v.region_name,
+                install_latitude = v.lat,
+                install_longitude = v.lon
+            FROM (VALUES {values}) AS v(id, region_id, region_name, lat, lon)
+            WHERE t.id = v.id
+        """), params)
+    else:
+        # MySQL 8.0.19+ 表值构造器，列名为 column_0, column_1 ...
+        values = ", ".join(f"ROW(:id_{i}, :r_{i}, :n_{i}, :lat_{i}, :lon_{i})" for i in range(len(batch)))
+        conn.execute(text(f"""
+            UPDATE {BENCH_TABLE} AS t
+            JOIN (VALUES {values}) AS v ON t.id = v.column_0
+            SET t.region_id = v.column_1,
+                t.region_name = v.column_2,
+                t.install_latitude = v.column_3,
+                t.install_longitude = v.column_4
+        """), params)
+
+
+def insert_text_executemany(conn, batch, db_type):
+    """新增设备报装（原写法）：text() 拼接 INSERT + executemany"""
+    cols = ", ".join(batch[0].keys())
+    vals = ", ".join(f":{k}" for k in batch[0].keys())
+    conn.execute(text(f"INSERT INTO {BENCH_TABLE} ({cols}) VALUES ({vals})"), batch)
+
+
+def insert_bulk(conn, batch, db_type):
+    """dbhelp.bulk_insert：Core insert()，走 insertmanyvalues / 驱动多行 INSERT"""
+    bulk_insert(conn, BENCH_TABLE, batch)
+
+
+def insert_to_sql(conn, batch, db_type):
+    """TestDataCreat：DataFrame.to_sql"""
+    pd.DataFrame(batch).to_sql(BENCH_TABLE, con=conn, if_exists="append", index=False)
+
+
+# 名称: (函数, 是否逐行单事务, 是否插入)
+STRATEGIES = {
+    "single_row_txn": (update_executemany, True, False),   # ultra_safe_single_update_fixed
+    "executemany_batch": (update_executemany, False, False),
+    "case_update": (update_case, False, False),
+    "values_update": (update_values, False, False),
+    "insert_text_executemany": (insert_text_executemany, False, True),
+    "insert_bulk": (insert_bulk, False, True),
+    "insert_to_sql": (insert_to_sql, False, True),
+}
+
+
+# === 数据库侧指标 ===
+def log_position(conn, db_type):
+    """当前 WAL / binlog 位置（字节），不可用时返回 None"""
+    try:
+        if db_type == "postgresql":
+            return conn.execute(text("SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), '0/0')")).scalar()
+        return sum(int(row[1]) for row in conn.execute(text("SHOW BINARY LOGS")).fetchall())
+    except Exception as e:
+        logger.warning(f"⚠️ 无法读取日志位置: {e}")
+        conn.rollback()
+        return None
+
+
+def mysql_lock_waits(conn):
+    row = conn.execute(text("SHOW GLOBAL STATUS LIKE 'Innodb_row_lock_waits'")).fetchone()
+    return int(row[1]) if row else 0
+
+
+class LockWaitSampler(threading.Thread):
+    """PostgreSQL 没有累计锁等待计数，后台每 interval 秒采样一次未获得锁的数量"""
+
+    def __init__(self, engine, interval=0.1):
+        super().__init__(daemon=True)
+        self.engine = engine
+        self.interval = interval
+        self.waits = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        with self.engine.connect() as conn:
+            while not self._stop_event.is_set():
+                self.waits += conn.execute(text("SELECT COUNT(*) FROM pg_locks WHERE NOT granted")).scalar()
+                conn.rollback()
+                self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class BackgroundTraffic(threading.Thread):
+    """模拟生产流量：持续随机更新单行（每行一个事务），记录延迟"""
+
+    def __init__(self, engine, ids, interval=0.005):
+        super().__init__(daemon=True)
+        self.engine = engine
+        self.ids = ids
+        self.interval = interval
+        self.latencies = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        sql = text(f"UPDATE {BENCH_TABLE} SET device_name = :name WHERE id = :id")
+        while not self._stop_event.is_set():
+            start = time.perf_counter()
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(sql, {"name": f"bg_{random.randint(0, 1 << 20)}", "id": random.choice(self.ids)})
+            except Exception as e:
+                logger.debug(f"后台流量失败: {e}")
+            self.latencies.append(time.perf_counter() - start)
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+# === 运行单个策略 ===
+def run_strategy(engine, db_type, name, rows, updates, batch_size, background):
+    write_fn, per_row, is_insert = STRATEGIES[name]
+
+    if is_insert:
+        seed_table(engine, [])
+        data = rows
+    else:
+        seed_table(engine, rows)
+        data = updates
+    batches = [[r] for r in data] if per_row else [data[i:i + batch_size] for i in range(0, len(data), batch_size)]
+
+    with engine.connect() as stats_conn:
+        log_start = log_position(stats_conn, db_type)
+        waits_start = mysql_lock_waits(stats_conn) if db_type == "mysql" else 0
+        stats_conn.rollback()
+
+    sampler = LockWaitSampler(engine) if db_type == "postgresql" else None
+    traffic = BackgroundTraffic(engine, [r["id"] for r in rows]) if background and not is_insert else None
+    for worker in (sampler, traffic):
+        if worker:
+            worker.start()
+
+    latencies = []
+    start_time = time.perf_counter()
+    for batch in batches:
+        batch_start = time.perf_counter()
+        with engine.begin() as conn:
+            write_fn(conn, batch, db_type)
+        latencies.append(time.perf_counter() - batch_start)
+    duration = time.perf_counter() - start_time
+
+    for worker in (sampler, traffic):
+        if worker:
+            worker.stop()
+
+    with engine.connect() as stats_conn:
+        log_end = log_position(stats_conn, db_type)
+        lock_waits = mysql_lock_waits(stats_conn) - waits_start if db_type == "mysql" else sampler.waits
+        stats_conn.rollback()
+
+    latencies_ms = np.array(latencies) * 1000
+    result = {
+        "db": db_type,
+        "strategy": name,
+        "rows": len(data),
+        "batch_size": 1 if per_row else batch_size,
+        "rows_per_sec": round(len(data) / max(duration, 1e-6)),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 2),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 2),
+        "lock_waits": lock_waits,
+        "log_mb": round((log_end - log_start) / 1024 / 1024, 2) if None not in (log_start, log_end) else None,
+        "background_p99_ms": (round(float(np.percentile(np.array(traffic.latencies) * 1000, 99)), 2)
+                              if traffic and traffic.latencies else None),
+    }
+    logger.info(f"📊 {db_type} | {name}: {result['rows_per_sec']} 条/秒 | "
+                f"p50 {result['p50_ms']}ms | p99 {result['p99_ms']}ms")
+    return result
+
+
+def run_suite(config, rows, batch_size, strategies, background):
+    db_type = config["type"]
+    engine = get_engine(config)
+    updates = make_updates(rows)
+    results = []
+    try:
+        for name in strategies:
+            # 逐行单事务太慢，只取前 1/10 的数据
+            data_rows = rows[:max(1, len(rows) // 10)] if STRATEGIES[name][1] else rows
+            data_updates = updates[:len(data_rows)]
+            results.append(run_strategy(engine, db_type, name, data_rows, data_updates, batch_size, background))
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {BENCH_TABLE}"))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GenerateData 写入策略基准")
+    parser.add_argument("--db", choices=["postgresql", "mysql", "all"], default="all")
+    parser.add_argument("--config", help="dbhelp 中的配置名（配合 --no-docker 使用已有数据库）")
+    parser.add_argument("--no-docker", action="store_true", help="不启动容器")
+    parser.add_argument("--rows", type=int, default=100000, help="dev_device_instance 造数规模")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--strategies", default=",".join(STRATEGIES), help="逗号分隔的策略名")
+    parser.add_argument("--no-background", action="store_true", help="不模拟并发的生产流量")
+    parser.add_argument("--keep-containers", action="store_true")
+    args = parser.parse_args()
+
+    strategies = [s.strip() for s in args.strategies.split(",") if s.strip()]
+    unknown = set(strategies) - set(STRATEGIES)
+    if unknown:
+        parser.error(f"未知策略: {', '.join(sorted(unknown))}")
+
+    if args.config:
+        targets = [(getattr(dbhelp, args.config), False)]
+    else:
+        db_types = ["postgresql", "mysql"] if args.db == "all" else [args.db]
+        targets = [(CONTAINERS[t]["config"], not args.no_docker) for t in db_types]
+
+    rows = build_rows(args.rows)
+    results = []
+    for config, use_docker in targets:
+        db_type = config["type"]
+        if use_docker:
+            config = start_container(db_type)
+        try:
+            results += run_suite(config, rows, args.batch_size, strategies, not args.no_background)
+        finally:
+            get_engine(config).dispose()
+            if use_docker and not args.keep_containers:
+                stop_container(db_type)
+
+    df = pd.DataFrame(results)
+    df.to_csv(RESULT_FILE, index=False)
+    print(df.to_string(index=False))
+    logger.info(f"📄 结果已写入: {RESULT_FILE}")
+
+
+if __name__ == "__main__":
+    main()
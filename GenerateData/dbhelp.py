@@ -1,8 +1,7 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, table, column
+import os
 import urllib.parse
-import sys
-
-print("🔄 正在连接到数据库...")
+import threading
 
 
 # === 数据库配置 ===
@@ -43,27 +42,154 @@ DB_CONFIG4 = {
     "database": "hes",
 }
 
+# 默认配置名，可用环境变量 GENERATEDATA_DB_CONFIG=DB_CONFIG2 切换（generatedata --config 也通过它传给各脚本）
+DB_CONFIG_ENV = "GENERATEDATA_DB_CONFIG"
+DEFAULT_CONFIG_NAME = "DB_CONFIG4"
 
-# === 构造数据库引擎 ===
-def get_engine(config=DB_CONFIG4):
+
+def resolve_config(name=None):
+    """按名称取本模块中的 DB_CONFIG*，未指定时使用环境变量 GENERATEDATA_DB_CONFIG，再退回 DB_CONFIG4"""
+    name = name or os.environ.get(DB_CONFIG_ENV) or DEFAULT_CONFIG_NAME
+    config = globals().get(name)
+    if not name.startswith("DB_CONFIG") or not isinstance(config, dict):
+        raise ValueError(f"❌ 未知的数据库配置: {name}")
+    return config
+
+
+# === 连接池默认配置 ===
+# 单个 DB_CONFIG 中同名键（如 "pool_size": 20）可覆盖默认值
+POOL_SETTINGS = {
+    "pool_size": 5,            # 常驻连接数，多进程/多线程任务按并发数调大
+    "max_overflow": 10,        # 超出 pool_size 后允许临时创建的连接数
+    "pool_timeout": 30,        # 等待空闲连接的秒数
+    "pool_recycle": 1800,      # 连接最长存活秒数，避免被服务端超时断开
+    "pool_pre_ping": True,     # 取连接前探活
+    "query_cache_size": 500,   # SQLAlchemy 编译语句缓存条数
+}
+
+# 默认驱动，可在 DB_CONFIG 中用 "driver" 指定（如 PostgreSQL 使用 "psycopg" 即 psycopg3）
+DEFAULT_DRIVERS = {
+    "mysql": "pymysql",
+    "postgresql": "psycopg2",
+}
+
+# psycopg3 服务端预编译：同一语句执行达到该次数后自动 PREPARE，None 表示关闭
+DEFAULT_PREPARE_THRESHOLD = 5
+
+# executemany 快速路径，DB_CONFIG 中 "fast_executemany": False 可关闭（基准对比时使用），同名键可覆盖各项取值
+# - psycopg2：text() 语句的 executemany 按页经 psycopg2.extras.execute_batch 合并发送，
+#             Core insert() 走 insertmanyvalues（多行 VALUES）
+# - pymysql：驱动自身会把 INSERT ... VALUES 的 executemany 改写为多行 INSERT，UPDATE 仍逐条执行
+FAST_EXECUTEMANY_SETTINGS = {
+    "psycopg2": {
+        "executemany_mode": "values_plus_batch",
+        "executemany_batch_page_size": 500,
+        "insertmanyvalues_page_size": 1000,
+    },
+    "default": {
+        "insertmanyvalues_page_size": 1000,
+    },
+}
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def build_url(config):
     db_type = config.get("type", "mysql").lower()
+    driver = config.get("driver", DEFAULT_DRIVERS.get(db_type))
     password = urllib.parse.quote_plus(config["password"])
 
     if db_type == "mysql":
-        conn_str = (
-            f"mysql+pymysql://{config['user']}:{password}"
+        return (
+            f"mysql+{driver}://{config['user']}:{password}"
             f"@{config['host']}:{config['port']}/{config['database']}"
             f"?charset=utf8mb4"
         )
     elif db_type == "postgresql":
-        conn_str = (
-            f"postgresql+psycopg2://{config['user']}:{password}"
+        return (
+            f"postgresql+{driver}://{config['user']}:{password}"
             f"@{config['host']}:{config['port']}/{config['database']}"
         )
-    else:
-        raise ValueError(f"❌ 不支持的数据库类型: {db_type}")
+    raise ValueError(f"❌ 不支持的数据库类型: {db_type}")
+
+
+def _engine_options(config, overrides):
+    options = {key: config.get(key, default) for key, default in POOL_SETTINGS.items()}
+
+    overrides = dict(overrides)
+    if overrides.pop("fast_executemany", config.get("fast_executemany", True)):
+        db_type = config.get("type", "mysql").lower()
+        driver = config.get("driver", DEFAULT_DRIVERS.get(db_type))
+        fast = FAST_EXECUTEMANY_SETTINGS.get(driver, FAST_EXECUTEMANY_SETTINGS["default"])
+        options.update({key: config.get(key, value) for key, value in fast.items()})
+    options.update(overrides)
+
+    connect_args = dict(options.pop("connect_args", {}))
+    if config.get("driver") == "psycopg":
+        threshold = config.get("prepare_threshold", DEFAULT_PREPARE_THRESHOLD)
+        connect_args.setdefault("prepare_threshold", threshold)
+    if connect_args:
+        options["connect_args"] = connect_args
+    return options
+
+
+# === 构造数据库引擎 ===
+def get_engine(config=DB_CONFIG4, **overrides):
+    """
+    按配置惰性创建并缓存引擎：同一配置（及相同 overrides）在进程内共享同一个连接池
+    创建引擎不会建立连接，第一次执行 SQL 时才连接数据库
+    overrides 直接传给 create_engine，如 get_engine(DB_CONFIG, pool_size=32, max_overflow=0)；
+    fast_executemany=False 关闭 executemany 快速路径
+    """
+    key = (tuple(sorted((k, str(v)) for k, v in config.items())),
+           tuple(sorted((k, str(v)) for k, v in overrides.items())))
+    engine = _engines.get(key)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(key)
+            if engine is None:
+                engine = create_engine(build_url(config), echo=False, **_engine_options(config, overrides))
+                _engines[key] = engine
+    return engine
+
+
+def dispose_engines():
+    """关闭所有缓存引擎的连接池（fork 出子进程后在子进程中调用，避免复用父进程的连接；match_pool 的子进程初始化时调用）"""
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose(close=False)
+        _engines.clear()
+
+
+# === 流式读取 ===
+def stream_mappings(conn, query, params=None, batch_size=10000):
+    """
+    使用服务端游标流式读取查询结果（逐条产出 RowMapping）
+    结果集不会一次性加载到客户端内存，首批数据到达即可开始处理
+    注意：读取期间 conn 被游标占用，写操作请使用另一个连接
+    """
+    result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(query, params or {})
+    yield from result.mappings()
+
+
+def count_rows(conn, query, params=None):
+    """统计查询结果行数（用于进度条），不传输数据"""
+    return conn.execute(text(f"SELECT COUNT(*) FROM ({query.text}) AS t"), params or {}).scalar()
+
 
-    return create_engine(conn_str, echo=False, pool_pre_ping=True)
+# === 批量写入 ===
+def bulk_insert(conn, table_name, rows):
+    """
+    批量插入 list[dict]（各行键相同）
+    使用 Core insert() 而不是 text() 拼接的 INSERT：psycopg2 下走 insertmanyvalues 多行 VALUES，
+    pymysql 下由驱动改写为多行 INSERT
+    """
+    if not rows:
+        return 0
+    target = table(table_name, *[column(name) for name in rows[0]])
+    conn.execute(target.insert(), rows)
+    return len(rows)
 
 
 # === 测试数据库连接 ===
@@ -78,7 +204,8 @@ def check_db_connection(engine):
         return False
 
 
-# === 启动连接测试 ===
-engine = get_engine(DB_CONFIG4)
-if not check_db_connection(engine):
-    sys.exit("❌ 程序终止，数据库无法连接")
+# === 默认引擎（首次访问 dbhelp.engine 时才创建，配置见 resolve_config）===
+def __getattr__(name):
+    if name == "engine":
+        return get_engine(resolve_config())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,122 @@
+import logging
+import os
+import time
+from datetime import datetime
+import pandas as pd
+from batch_retry import write_with_bisect
+
+logger = logging.getLogger(__name__)
+
+# 死信文件附加的元数据列，重放时去掉
+ERROR_COLUMN = "_error"
+FAILED_AT_COLUMN = "_failed_at"
+META_COLUMNS = (ERROR_COLUMN, FAILED_AT_COLUMN)
+
+
+class DeadLetterSink:
+    """
+    失败记录（死信）缓冲写入：每次运行只写一个文件，攒够 flush_rows 条或距上次写盘超过
+    flush_interval 秒时批量追加，结束时（close / with 块退出）写完剩余记录
+
+    - fmt="csv"：追加写入，首批写表头
+    - fmt="parquet"：需要 pyarrow，所有列按字符串存储，保证多批次 schema 一致
+    - 列以第一条记录为准，之后记录缺少的列留空、多出的列忽略
+
+    用法:
+        with DeadLetterSink("生成表档案数据") as sink:
+            sink.add(record, error)
+    """
+
+    def __init__(self, job, fmt="csv", path=None, flush_rows=500, flush_interval=10.0):
+        if fmt not in ("csv", "parquet"):
+            raise ValueError(f"❌ 不支持的死信文件格式: {fmt}")
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.path = path or f"failed_{job}_{timestamp}.{fmt}"
+        self.fmt = fmt
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+
+        self.columns = None
+        self.count = 0
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._parquet_writer = None
+
+    def add(self, record, error=None):
+        """记录一条失败数据（dict 或 pandas.Series）及其错误信息"""
+        record = dict(record)
+        if self.columns is None:
+            self.columns = [c for c in record if c not in META_COLUMNS] + list(META_COLUMNS)
+        record[ERROR_COLUMN] = "" if error is None else str(error)
+        record[FAILED_AT_COLUMN] = datetime.now().isoformat(timespec="seconds")
+        self._buffer.append(record)
+        self.count += 1
+
+        if len(self._buffer) >= self.flush_rows or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        df = pd.DataFrame(self._buffer, columns=self.columns, dtype=object)  # object 列避免整数因空值变成浮点
+        self._buffer.clear()
+
+        if self.fmt == "csv":
+            header = not os.path.exists(self.path)
+            df.to_csv(self.path, mode="a", header=header, index=False)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(df.astype("string"), preserve_index=False)
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(self.path, table.schema)
+            self._parquet_writer.write_table(table)
+
+    def close(self):
+        self.flush()
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+        if self.count:
+            logger.info(f"📄 {self.count} 条失败记录已保存到: {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def load_dead_letters(path):
+    """读取死信文件，返回去掉元数据列的 list[dict]，空值为 None"""
+    if path.endswith(".parquet"):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path, dtype=str, keep_default_na=False, na_values=[""])
+    df = df.drop(columns=[c for c in META_COLUMNS if c in df.columns]).astype(object)
+    return df.where(df.notna(), None).to_dict("records")
+
+
+def replay_dead_letters(path, write_fn, controller=None, sink=None):
+    """
+    将死信文件中的记录按批量更新路径重新写入（write_fn 同 write_with_bisect）
+    仍然失败的记录写入 sink（若提供）
+    :return: (成功写入的行数, 仍失败的行数)
+    """
+    records = load_dead_letters(path)
+    logger.info(f"🔁 从 {path} 读取到 {len(records)} 条失败记录，开始重放")
+
+    batches = controller.split(records) if controller else [records]
+    written, failed_count = 0, 0
+    for batch in batches:
+        ok, failed = write_with_bisect(write_fn, batch, controller=controller)
+        written += ok
+        failed_count += len(failed)
+        if sink is not None:
+            for record, error in failed:
+                sink.add(record, error)
+
+    logger.info(f"✅ 重放完成: 成功 {written} 条，仍失败 {failed_count} 条")
+    return written, failed_count
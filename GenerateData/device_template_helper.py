@@ -0,0 +1,214 @@
+import logging
+import random
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+
+# === 模板行抽样 ===
+def _estimate_row_count(conn, table):
+    """从统计信息读取估算行数（不扫表），失败返回 None"""
+    dialect = conn.dialect.name
+    try:
+        if dialect == "postgresql":
+            count = conn.execute(
+                text("SELECT reltuples::BIGINT FROM pg_class WHERE oid = to_regclass(:table)"),
+                {"table": table}
+            ).scalar()
+        elif dialect == "mysql":
+            count = conn.execute(
+                text("SELECT TABLE_ROWS FROM information_schema.TABLES "
+                     "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table"),
+                {"table": table}
+            ).scalar()
+        else:
+            return None
+    except Exception as e:
+        logger.warning(f"⚠️ 读取 {table} 估算行数失败: {e}")
+        return None
+    return int(count) if count and count > 0 else None
+
+
+def _probe_by_key(conn, table, key, columns="*", count=1):
+    """
+    随机主键探测：通过索引取最小/最大主键，在区间内随机 count 个值，每个值用 key >= probe 命中一行（结果按主键去重）
+    适用于定长数字字符串主键（如 0000012345），其它主键退化为按索引取首行
+    """
+    low = conn.execute(text(f"SELECT {key} FROM {table} ORDER BY {key} LIMIT 1")).scalar()
+    high = conn.execute(text(f"SELECT {key} FROM {table} ORDER BY {key} DESC LIMIT 1")).scalar()
+    if low is None:
+        return []
+
+    low_s, high_s = str(low), str(high)
+    numeric = low_s.isdigit() and high_s.isdigit() and len(low_s) == len(high_s)
+    rows = {}
+    for _ in range(count if numeric else 1):
+        probe = str(random.randint(int(low_s), int(high_s))).zfill(len(low_s)) if numeric else low
+        row = conn.execute(
+            text(f"SELECT {columns} FROM {table} WHERE {key} >= :probe ORDER BY {key} LIMIT 1"),
+            {"probe": probe}
+        ).mappings().first()
+        if row is not None:
+            rows.setdefault(row[key], row)
+    return list(rows.values())
+
+
+def _table_sample(conn, table, columns, expected_rows, limit):
+    """PostgreSQL TABLESAMPLE SYSTEM：按估算行数只读取期望 expected_rows 行的数据页，统计信息缺失时返回空列表"""
+    estimated = _estimate_row_count(conn, table)
+    if not estimated:
+        return []
+    # 最低 0.0001%，最高 100%
+    percent = min(100.0, max(0.0001, expected_rows * 100.0 / estimated))
+    return conn.execute(
+        text(f"SELECT {columns} FROM {table} TABLESAMPLE SYSTEM ({percent:.6f}) LIMIT {int(limit)}")
+    ).mappings().all()
+
+
+def sample_template_row(conn, table="dev_device_instance", key="id", sample_rows=100):
+    """
+    随机抽取一条模板行，替代 ORDER BY RANDOM() LIMIT 1 的全表排序
+    PostgreSQL 使用 TABLESAMPLE SYSTEM 按估算行数只读取少量数据页；
+    其它数据库（或抽样为空时）使用随机主键探测
+    """
+    if conn.dialect.name == "postgresql":
+        rows = _table_sample(conn, table, "*", sample_rows, 1)
+        if rows:
+            return rows[0]
+        logger.info("TABLESAMPLE 未抽到数据，改用随机主键探测")
+
+    rows = _probe_by_key(conn, table, key)
+    return rows[0] if rows else None
+
+
+def sample_rows(conn, table="dev_device_instance", columns="*", n=1000, key="id"):
+    """
+    随机抽取约 n 行（不做全表排序），用于预估等需要代表性样本的场景
+    PostgreSQL 使用 TABLESAMPLE SYSTEM（按 2 倍期望抽样后截取 n 行）；
+    其它数据库（或抽样为空时）做 n 次随机主键探测，结果可能少于 n 行；columns 需包含 key
+    """
+    if conn.dialect.name == "postgresql":
+        rows = _table_sample(conn, table, columns, n * 2, n)
+        if rows:
+            return rows
+        logger.info("TABLESAMPLE 未抽到数据，改用随机主键探测")
+    return _probe_by_key(conn, table, key, columns, n)
+
+
+# === 序列式 ID 分配 ===
+# 各数据库中"只由数字组成"的条件
+DIGITS_ONLY = {
+    "postgresql": "{key} ~ '^[0-9]+$'",
+    "mysql": "{key} REGEXP '^[0-9]+$'",
+}
+DIGITS_ONLY_DEFAULT = "{key} <> '' AND {key} NOT GLOB '*[^0-9]*'"
+
+
+class BlockIdAllocator:
+    """
+    定长数字字符串 ID 分配器（如 0000012345）
+    - 初始最大值沿主键索引倒序读取第一条 长度为 id_length 的纯数字 ID（定长数字串的字典序即数值序），
+      不做全表 CAST；其它长度 / 格式的主键（UUID 等）不参与
+    - PostgreSQL 下使用 INCREMENT BY block_size 的序列按块预留，多进程/多次运行互不冲突
+      序列已存在时沿用其实际步长（pg_sequence.seqincrement）作为块大小，与其它运行的 block_size 无关
+      序列 {table}_{key}_alloc_seq 会保留在库中，供之后的运行继续分配；不再需要时调用 drop_sequence()
+      序列在单独的连接上创建并提交，不会提交调用方连接上未完成的事务
+    - 其它数据库按块在进程内缓存分配
+    """
+
+    def __init__(self, conn, table="dev_device_instance", key="id", id_length=None,
+                 block_size=10000, sequence_name=None):
+        self.conn = conn
+        self.table = table
+        self.key = key
+        self.block_size = block_size
+        self.id_length = id_length
+        self.sequence_name = sequence_name or f"{table}_{key}_alloc_seq"
+        self.use_sequence = conn.dialect.name == "postgresql"
+        self.increment = block_size  # 每次 nextval 预留的 ID 数，序列已存在时以其实际步长为准
+
+        self._next = 0
+        self._block_end = 0  # 当前块可分配的上界（不含）
+        self._initialized = False
+
+    def current_max_id(self):
+        """
+        当前最大的定长数字 ID：沿主键索引倒序取第一条长度为 id_length 的纯数字主键，找到即停止
+        上界 '9'*N 让索引扫描从数字主键处开始，跳过排在后面的字母开头主键
+        未指定 id_length 时取倒序第一条纯数字主键的长度（建议由调用方按模板行传入）
+        """
+        digits_only = DIGITS_ONLY.get(self.conn.dialect.name, DIGITS_ONLY_DEFAULT).format(key=self.key)
+
+        if self.id_length is None:
+            top = self.conn.execute(
+                text(f"SELECT {self.key} FROM {self.table} WHERE {digits_only} ORDER BY {self.key} DESC LIMIT 1")
+            ).scalar()
+            if top is None:
+                return 0
+            self.id_length = len(str(top))
+
+        max_id = self.conn.execute(
+            text(f"SELECT {self.key} FROM {self.table} "
+                 f"WHERE {self.key} <= :upper AND LENGTH({self.key}) = :length AND {digits_only} "
+                 f"ORDER BY {self.key} DESC LIMIT 1"),
+            {"upper": "9" * self.id_length, "length": self.id_length}
+        ).scalar()
+        return int(max_id) if max_id is not None else 0
+
+    def _init_sequence(self, max_id):
+        seq = self.sequence_name
+        with self.conn.engine.begin() as ddl:
+            ddl.execute(text(
+                f"CREATE SEQUENCE IF NOT EXISTS {seq} INCREMENT BY {self.block_size} MINVALUE 0 START WITH 0"
+            ))
+            # IF NOT EXISTS 不会修改已有序列的步长：按实际步长推进和划分块，避免落入其它运行已预留的块
+            self.increment = int(ddl.execute(
+                text("SELECT seqincrement FROM pg_sequence WHERE seqrelid = to_regclass(:seq)"), {"seq": seq}
+            ).scalar())
+            if self.increment != self.block_size:
+                logger.info(f"序列 {seq} 已存在，步长为 {self.increment}（本次 block_size={self.block_size}），按序列步长分块")
+            # 序列落后于表中最大 ID 时向前推进（例如有其它程序直接写入）
+            ddl.execute(
+                text(f"SELECT setval('{seq}', GREATEST(:max_id, "
+                     f"(SELECT last_value FROM {seq}) + CASE WHEN (SELECT is_called FROM {seq}) "
+                     f"THEN :increment ELSE 0 END), false)"),
+                {"max_id": max_id + 1, "increment": self.increment}
+            )
+
+    def drop_sequence(self):
+        """删除 PostgreSQL 下保留的分配序列（之后的运行会按表中最大 ID 重新创建）"""
+        if not self.use_sequence:
+            return
+        with self.conn.engine.begin() as ddl:
+            ddl.execute(text(f"DROP SEQUENCE IF EXISTS {self.sequence_name}"))
+        self._initialized = False
+        self._next = self._block_end = 0
+        logger.info(f"已删除 ID 分配序列 {self.sequence_name}")
+
+    def _reserve_block(self):
+        if not self._initialized:
+            max_id = self.current_max_id()
+            logger.info(f"当前最大 ID: {max_id}")
+            if self.use_sequence:
+                self._init_sequence(max_id)
+            else:
+                self._next = self._block_end = max_id + 1
+            self._initialized = True
+
+        if self.use_sequence:
+            start = self.conn.execute(text(f"SELECT nextval('{self.sequence_name}')")).scalar()
+            self._next, self._block_end = int(start), int(start) + self.increment
+        else:
+            self._next, self._block_end = self._block_end, self._block_end + self.block_size
+
+    def next_id(self):
+        """分配一个新 ID（零填充字符串）"""
+        if self._next >= self._block_end:
+            self._reserve_block()
+        value = self._next
+        self._next += 1
+        return str(value).zfill(self.id_length)
+
+    def allocate(self, count):
+        """一次分配 count 个连续或分块连续的 ID"""
+        return [self.next_id() for _ in range(count)]
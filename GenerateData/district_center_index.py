@@ -0,0 +1,178 @@
+import logging
+import time
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEG_LAT = 110.574
+
+_KEY_SHIFT = np.int64(1 << 32)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """向量化球面距离（公里）"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+class DistrictCenterIndex:
+    """
+    区县中心点的网格索引：根据坐标批量反查最近的区县中心（GeoAdministrativeUnitsnew.csv）
+
+    - 以平均纬度做等距投影（公里），按 cell_km 划分网格（类似 geohash 分桶）
+    - 每个出现过查询点的网格预先裁剪出"可能成为最近点"的中心：
+      取所有中心到网格的最远距离的最小值作为上界，只保留到网格最近距离不超过该上界的中心，
+      该网格内任意查询点的最近中心必在其中，结果与暴力搜索一致
+    - 候选列表按网格缓存，查询只需在少量候选中向量化比较
+    """
+
+    def __init__(self, centers_df, lat_col="latitude", lon_col="longitude", cell_km=10.0):
+        centers_df = centers_df.dropna(subset=[lat_col, lon_col]).reset_index(drop=True)
+        self.centers = centers_df
+        self.lat = centers_df[lat_col].to_numpy(dtype=np.float64)
+        self.lon = centers_df[lon_col].to_numpy(dtype=np.float64)
+        self.cell_km = cell_km
+
+        self.kx = 111.320 * np.cos(np.radians(self.lat.mean())) if len(self.lat) else 111.320
+        self.x, self.y = self._project(self.lat, self.lon)
+        self._cell_candidates = {}
+
+        logger.info(f"🧭 区县中心网格索引: {len(self.lat)} 个中心, 网格边长 {cell_km:.0f}km")
+
+    @classmethod
+    def from_csv(cls, path="GeoAdministrativeUnitsnew.csv", **kwargs):
+        return cls(pd.read_csv(path), **kwargs)
+
+    def _project(self, lat, lon):
+        return np.asarray(lon, dtype=np.float64) * self.kx, np.asarray(lat, dtype=np.float64) * KM_PER_DEG_LAT
+
+    def _brute_force(self, x, y, chunk=2000):
+        idx = np.empty(len(x), dtype=np.int64)
+        for i in range(0, len(x), chunk):
+            d2 = (x[i:i + chunk, None] - self.x) ** 2 + (y[i:i + chunk, None] - self.y) ** 2
+            idx[i:i + chunk] = d2.argmin(axis=1)
+        return idx
+
+    def _build_cells(self, keys, cx, cy, chunk=256):
+        """为尚未缓存的网格 (cx, cy) 计算候选中心"""
+        for i in range(0, len(keys), chunk):
+            part = keys[i:i + chunk]
+            x0 = cx[i:i + chunk, None] * self.cell_km
+            y0 = cy[i:i + chunk, None] * self.cell_km
+            x1, y1 = x0 + self.cell_km, y0 + self.cell_km
+
+            # 中心到网格矩形的最近距离、最远距离
+            dx = np.maximum(np.maximum(x0 - self.x, self.x - x1), 0)
+            dy = np.maximum(np.maximum(y0 - self.y, self.y - y1), 0)
+            near = dx ** 2 + dy ** 2
+            far = (np.maximum((self.x - x0) ** 2, (self.x - x1) ** 2)
+                   + np.maximum((self.y - y0) ** 2, (self.y - y1) ** 2))
+            bound = far.min(axis=1, keepdims=True)
+
+            for key, mask in zip(part, near <= bound):
+                self._cell_candidates[int(key)] = np.flatnonzero(mask)
+
+    def _query_chunk(self, x, y):
+        cx, cy = np.floor(x / self.cell_km), np.floor(y / self.cell_km)
+        keys = cx.astype(np.int64) * _KEY_SHIFT + cy.astype(np.int64)
+        unique_keys, first_seen, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        missing = np.array([k not in self._cell_candidates for k in unique_keys.tolist()], dtype=bool)
+        if missing.any():
+            rows = first_seen[missing]
+            self._build_cells(unique_keys[missing], cx[rows], cy[rows])
+
+        # 各网格候选拼成一维数组，再按查询点展开为 (查询点, 候选中心) 对
+        cell_lists = [self._cell_candidates[k] for k in unique_keys.tolist()]
+        cell_counts = np.array([len(c) for c in cell_lists], dtype=np.int64)
+        cell_offsets = np.cumsum(cell_counts) - cell_counts
+        flat = np.concatenate(cell_lists)
+
+        counts = cell_counts[inverse]
+        starts = np.cumsum(counts) - counts
+        point = np.repeat(np.arange(len(x)), counts)
+        within = np.arange(len(point)) - np.repeat(starts, counts)
+        center = flat[np.repeat(cell_offsets[inverse], counts) + within]
+
+        d2 = (x[point] - self.x[center]) ** 2 + (y[point] - self.y[center]) ** 2
+        best = np.minimum.reduceat(d2, starts)
+        hit = np.flatnonzero(d2 == np.repeat(best, counts))
+        first = hit[np.unique(point[hit], return_index=True)[1]]
+        return center[first]
+
+    def query(self, lat, lon, chunk=50_000):
+        """
+        批量查询最近的区县中心
+        :return: (中心点下标数组, 球面距离公里数组)；输入坐标为 NaN 的位置下标为 -1、距离为 NaN
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        idx = np.full(len(lat), -1, dtype=np.int64)
+        dist = np.full(len(lat), np.nan)
+        if not len(self.lat):
+            return idx, dist
+
+        ok = np.flatnonzero(~(np.isnan(lat) | np.isnan(lon)))
+        x, y = self._project(lat[ok], lon[ok])
+        for i in range(0, len(ok), chunk):
+            rows = ok[i:i + chunk]
+            found = self._query_chunk(x[i:i + chunk], y[i:i + chunk])
+            idx[rows] = found
+            dist[rows] = haversine_km(lat[rows], lon[rows], self.lat[found], self.lon[found])
+        return idx, dist
+
+    def lookup(self, df, lat_col="install_latitude", lon_col="install_longitude",
+               columns=("Region", "City", "district")):
+        """
+        为 DataFrame 的每行坐标附上最近区县中心的名称与距离，返回新的 DataFrame（行序、索引不变）
+        """
+        idx, dist = self.query(pd.to_numeric(df[lat_col], errors="coerce").to_numpy(),
+                               pd.to_numeric(df[lon_col], errors="coerce").to_numpy())
+        matched = self.centers.reindex(idx)[list(columns)]
+        matched.index = df.index
+        result = df.copy()
+        for col in columns:
+            result[f"nearest_{col.lower()}"] = matched[col]
+        result["nearest_distance_km"] = dist
+        return result
+
+
+# === 校验 dev_device_instance 安装坐标 ===
+def main(max_distance_km=50.0, chunk_size=200000, output_file="device_coordinate_outliers.csv"):
+    from sqlalchemy import text
+    from dbhelp import engine
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    index = DistrictCenterIndex.from_csv()
+    start_time = time.time()
+    total, outliers, missing = 0, 0, 0
+    header = True
+
+    query = text("SELECT id, install_latitude, install_longitude FROM dev_device_instance")
+    # 服务端游标按 chunk_size 分批取数（pd.read_sql 的 chunksize 仍会先把整个结果集拉到客户端）
+    with engine.connect() as conn:
+        result_set = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(query)
+        columns = list(result_set.keys())
+        for rows in result_set.partitions(chunk_size):
+            result = index.lookup(pd.DataFrame(rows, columns=columns))
+            total += len(result)
+            missing += int(result["nearest_distance_km"].isna().sum())
+
+            bad = result[result["nearest_distance_km"] > max_distance_km]
+            if not bad.empty:
+                bad.to_csv(output_file, mode="w" if header else "a", header=header, index=False)
+                header = False
+                outliers += len(bad)
+            logger.info(f"已校验 {total} 条 | 缺失坐标 {missing} | 超出 {max_distance_km}km: {outliers}")
+
+    duration = time.time() - start_time
+    logger.info(f"✅ 校验完成，共 {total} 条，耗时 {duration:.2f} 秒 ({total / max(duration, 0.001):.0f} 条/秒)")
+    if outliers:
+        logger.info(f"📄 超出距离阈值的设备已写入: {output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""
+GenerateData 统一命令行入口：选中子命令后才加载对应脚本，--help 不导入 pandas、不连接数据库
+
+    python generatedata.py --help
+    python generatedata.py seed-devices --count 4000000 --batch-size 5000
+    python generatedata.py match-coords --workers 8 --config DB_CONFIG2
+    python generatedata.py reset-report-coords --limit 100000 --dry-run     # 只打印执行计划
+    python generatedata.py assign-locations --estimate 2000                  # 回滚事务中试跑样本，预估全表开销
+    python generatedata.py region-snapshot                                   # 导出区域快照，之后读取区域表不再连库
+
+- 通用参数：--config（dbhelp 中的配置名）、--workers、--batch-size、--dry-run、--estimate
+- --estimate 只对提供预估入口的任务可用（见 job_estimate.py），不写指标文件、不提交任何修改
+- --config 通过环境变量 GENERATEDATA_DB_CONFIG 传给脚本，多进程匹配的子进程同样生效
+- 任务不支持的通用参数（如 seed-devices --workers）直接报错，避免误以为已生效
+- 每个任务在 JobMetrics 中执行，指标 / 死信 / 明细文件写在 GenerateData 目录下
+- 区域信息和中心点坐标进行匹配.py（自带连接配置）暂未接入
+"""
+import argparse
+import importlib.util
+import logging
+import os
+import sys
+
+logger = logging.getLogger("generatedata")
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 与 dbhelp.DB_CONFIG_ENV 一致（此处不导入 dbhelp，避免 --help 时加载 SQLAlchemy）
+DB_CONFIG_ENV = "GENERATEDATA_DB_CONFIG"
+
+# === 任务定义 ===
+# script: 脚本文件；entry: 入口函数；metrics: JobMetrics 任务名（与脚本单独运行时一致）
+# shared: 支持的通用参数（config 表示入口函数接受 config 字典）；arguments: 任务自身的参数
+# estimate: 预估入口函数（可选），参数为 sample_size 与 config
+# batch_size_help: --batch-size 在该任务中含义不同时的说明（可选，默认为每批写入条数）
+JOBS = {
+    "seed-devices": {
+        "script": "新增设备报装.py",
+        "entry": "main",
+        "metrics": "seed_devices",
+        "help": "批量新增设备档案（随机区域与坐标）",
+        "shared": {"batch_size", "config"},
+        "arguments": [
+            (("--count",), {"type": int, "default": 1000000, "dest": "add_count", "help": "新增设备数量"}),
+            (("--seed",), {"type": int, "help": "随机种子，相同 seed 生成相同的区域、地址与坐标"}),
+        ],
+    },
+    "seed-test-data": {
+        "script": "TestDataCreat.py",
+        "entry": "main",
+        "metrics": "test_data",
+        "help": "批量生成设备档案与资产绑定测试数据",
+        "shared": set(),
+        "arguments": [
+            (("--count",), {"type": int, "default": 1000000, "dest": "total", "help": "生成条数"}),
+            (("--seed",), {"type": int, "help": "随机种子，相同 seed 生成完全相同的数据"}),
+        ],
+    },
+    "assign-regions": {
+        "script": "生成表档案数据2.0.py",
+        "entry": "main",
+        "metrics": "device_region",
+        "help": "为系统创建的设备档案随机分配省 / 市 / 区",
+        "shared": set(),
+        "arguments": [],
+    },
+    "replay-regions": {
+        "script": "生成表档案数据2.0.py",
+        "entry": "replay_failed",
+        "metrics": "device_region_replay",
+        "help": "重放 assign-regions 的死信文件",
+        "shared": set(),
+        "arguments": [
+            (("path",), {"type": os.path.abspath, "help": "死信文件（failed_device_region_*.csv / .parquet）"}),
+        ],
+    },
+    "assign-locations": {
+        "script": "给档案数据生成位置和坐标.py",
+        "entry": "main",
+        "estimate": "estimate",
+        "metrics": "assign_device_locations",
+        "help": "为全部设备档案重新生成区域、地址与安装坐标",
+        "shared": {"batch_size", "config"},
+        "batch_size_help": "每页读取的设备数（按 id 分页）；回写批大小自适应，与此无关",
+        "arguments": [],
+    },
+    "replay-locations": {
+        "script": "给档案数据生成位置和坐标.py",
+        "entry": "replay_failed",
+        "metrics": "assign_device_locations_replay",
+        "help": "重放 assign-locations 的死信文件",
+        "shared": {"config"},
+        "arguments": [
+            (("path",), {"type": os.path.abspath, "help": "死信文件（failed_assign_device_locations_*.csv / .parquet）"}),
+        ],
+    },
+    "match-coords": {
+        "script": "省市匹配坐标.py",
+        "entry": "main",
+        "metrics": "match_meter_coords",
+        "help": "按省市区名称匹配坐标，回写 dev_meter_id 及关联表",
+        "shared": {"workers", "batch_size"},
+        "arguments": [],
+    },
+    "sync-coords": {
+        "script": "只同步单表的坐标.py",
+        "entry": "main",
+        "metrics": "sync_meter_coords",
+        "help": "按省市区名称匹配坐标，只回写 dev_meter_id",
+        "shared": {"workers", "batch_size"},
+        "arguments": [],
+    },
+    "reset-report-coords": {
+        "script": "重置上报表中的坐标信息.py",
+        "entry": "main",
+        "metrics": "reset_report_coords",
+        "help": "重新匹配设备坐标并同步到上报表",
+        "shared": {"batch_size"},
+        "arguments": [
+            (("--limit",), {"type": int, "default": 100000, "help": "最多处理的设备数，0 表示不限"}),
+            (("--incremental",), {"action": "store_true", "help": "只处理上次同步后地址有变化的设备"}),
+        ],
+    },
+    "sync-worker": {
+        "script": "坐标实时同步.py",
+        "entry": "main",
+        "metrics": "coord_sync_worker",
+        "help": "常驻进程：地址变化后实时同步三张表的坐标",
+        "shared": {"batch_size"},
+        "batch_size_help": "每个小批最多处理的变更设备数",
+        "arguments": [
+            (("--install",), {"action": "store_true", "dest": "install_capture",
+                              "help": "安装变更捕获（触发器 / updated_at 列）后再启动"}),
+            (("--max-delay",), {"type": float, "default": 1.0, "help": "PostgreSQL：小批最长等待秒数"}),
+            (("--poll-interval",), {"type": float, "default": 1.0, "help": "MySQL：没有新变更时的轮询间隔秒数"}),
+            (("--overlap",), {"type": float, "default": 60, "dest": "overlap_seconds",
+                              "help": "MySQL：每轮回看的秒数，执行到提交超过该时长的事务会被漏掉"}),
+        ],
+    },
+    "report-coords": {
+        "script": "根据区域中心坐标生成坐标.py",
+        "entry": "main",
+        "metrics": "report_from_region_center",
+        "help": "按设备地址匹配区域中心坐标，写入最新上报记录",
+        "shared": {"workers"},
+        "arguments": [],
+    },
+    "region-snapshot": {
+        "script": "region_snapshot.py",
+        "entry": "export",
+        "metrics": "region_snapshot",
+        "help": "导出 alabo_region 本地快照，各脚本启动时直接读取，不再查询区域表",
+        "shared": {"config"},
+        "arguments": [
+            (("--path",), {"type": os.path.abspath, "help": "快照目录（默认 GenerateData/region_snapshot）"}),
+        ],
+    },
+    "backfill-telemetry": {
+        "script": "生成上报历史数据.py",
+        "entry": "generate_dev_messages",
+        "metrics": "backfill_telemetry",
+        "help": "为单个设备补齐按天的历史上报数据（dev_message）",
+        "shared": set(),
+        "arguments": [
+            (("--device-id",), {"default": "2025042800002", "help": "设备 ID"}),
+            (("--days",), {"type": int, "default": 90, "help": "补齐最近多少天"}),
+        ],
+    },
+}
+
+
+BATCH_SIZE_HELP = "每批写入条数（自适应批大小时为初始值）"
+
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--config", metavar="NAME",
+                        help="dbhelp 中的数据库配置名，如 DB_CONFIG2（默认 DB_CONFIG4，或脚本自身指定的配置）")
+    common.add_argument("--workers", type=int, help="并行匹配进程数（1 表示在主进程内顺序执行）")
+    common.add_argument("--dry-run", action="store_true", help="只打印执行计划，不加载脚本、不连接数据库")
+    common.add_argument("--estimate", type=int, nargs="?", const=1000, metavar="SAMPLE",
+                        help="在回滚的事务中试跑 SAMPLE 行（默认 1000），预估全表耗时、WAL 量与锁占用")
+
+    parser = argparse.ArgumentParser(prog="generatedata", description="GenerateData 数据生成任务")
+    subparsers = parser.add_subparsers(dest="command", metavar="<job>", required=True)
+    for name, job in JOBS.items():
+        sub = subparsers.add_parser(name, parents=[common], help=job["help"], description=job["help"])
+        # --batch-size 的含义因任务而异，不放在公共参数中
+        sub.add_argument("--batch-size", type=int, help=job.get("batch_size_help", BATCH_SIZE_HELP))
+        for flags, options in job["arguments"]:
+            sub.add_argument(*flags, **options)
+    return parser
+
+
+def job_kwargs(parser, job, args):
+    """收集传给入口函数的参数：未指定的通用参数沿用脚本默认值"""
+    kwargs = {}
+    for name in ("workers", "batch_size"):
+        value = getattr(args, name)
+        if value is None:
+            continue
+        if name not in job["shared"]:
+            parser.error(f"{args.command} 不支持 --{name.replace('_', '-')}")
+        kwargs[name] = value
+    for flags, options in job["arguments"]:
+        dest = options.get("dest") or flags[0].lstrip("-").replace("-", "_")
+        kwargs[dest] = getattr(args, dest)
+    return kwargs
+
+
+def load_script(filename):
+    """
+    按路径加载任务脚本，模块名取文件名（其中的 . 替换为 _）
+    脚本目录需在 sys.path 中，多进程匹配的子进程可按同名重新导入匹配函数
+    """
+    name = os.path.splitext(filename)[0].replace(".", "_")
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SCRIPT_DIR, filename))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def print_plan(args, job, kwargs, config):
+    logger.info(f"📝 执行计划: {args.command} -> {job['script']}:{job['entry']}")
+    if config:
+        logger.info(f"  数据库: {args.config} ({config['type']}://{config['user']}@{config['host']}:"
+                    f"{config['port']}/{config['database']})")
+    else:
+        logger.info("  数据库: 脚本默认配置")
+    for key, value in kwargs.items():
+        logger.info(f"  {key:<12}: {value}")
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    job = JOBS[args.command]
+    kwargs = job_kwargs(parser, job, args)
+    if args.estimate is not None and "estimate" not in job:
+        parser.error(f"{args.command} 不支持 --estimate")
+    if SCRIPT_DIR not in sys.path:
+        sys.path.insert(0, SCRIPT_DIR)
+
+    config = None
+    if args.config:
+        import dbhelp
+
+        try:
+            config = dbhelp.resolve_config(args.config)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.dry_run:
+        print_plan(args, job, kwargs, config)
+        return 0
+
+    # 脚本按相对路径读取 GeoAdministrativeUnitsnew.csv
+    os.chdir(SCRIPT_DIR)
+    if config:
+        os.environ[DB_CONFIG_ENV] = args.config
+        if "config" in job["shared"]:
+            kwargs["config"] = config
+
+    module = load_script(job["script"])
+    if args.estimate is not None:
+        report = getattr(module, job["estimate"])(sample_size=args.estimate, config=config)
+        return 0 if report else 1
+
+    from job_metrics import JobMetrics
+
+    with JobMetrics(job["metrics"]):
+        result = getattr(module, job["entry"])(**kwargs)
+    return 1 if result is False else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
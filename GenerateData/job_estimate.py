@@ -0,0 +1,197 @@
+"""
+执行前预估：在一个最终回滚的事务里对一小段样本跑完整流程，按全表行数外推耗时、WAL 量与锁占用
+
+    with SampleEstimator(conn, "assign_device_locations", total_rows=total) as estimator:
+        with estimator.stage("db_read"):
+            devices = ...                      # 读取样本
+        estimator.sample_rows = len(devices)
+        with estimator.stage("generate"):
+            records = ...
+        with estimator.stage("write", rows_per_txn=10000):    # 正式执行时每个事务写入的行数
+            conn.execute(update_sql, records)
+    # 退出 with 块时采集 WAL / 锁信息并回滚，输出预估报告（estimator.report）
+
+- 耗时：各阶段 每行耗时 × 总行数；样本事务不提交，不含提交（fsync）耗时
+- WAL：PostgreSQL 取 pg_current_wal_insert_lsn 差值；MySQL 取 InnoDB redo LSN 差值（全局值，并发写入会计入）
+- 锁：PostgreSQL 取本事务写入的行数（pg_stat_xact_user_tables）与持有的表级锁；MySQL 取 innodb_trx 中的行锁数
+  rows_per_txn 为正式执行时单个事务覆盖的行数，据此估算每个事务锁住的行数与持锁时长
+"""
+import logging
+import time
+from contextlib import contextmanager
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+
+# === 数据库探针 ===
+def _pg_wal_lsn(conn):
+    return conn.execute(text("SELECT pg_current_wal_insert_lsn()")).scalar()
+
+
+def _pg_wal_bytes(conn, start):
+    return int(conn.execute(text("SELECT pg_wal_lsn_diff(pg_current_wal_insert_lsn(), :start)"),
+                            {"start": start}).scalar())
+
+
+def _pg_locks(conn):
+    rows = conn.execute(text("""
+        SELECT COALESCE(SUM(n_tup_ins + n_tup_upd + n_tup_del), 0) FROM pg_stat_xact_user_tables
+    """)).scalar()
+    relation_locks = conn.execute(text("""
+        SELECT c.relname, l.mode
+        FROM pg_locks l JOIN pg_class c ON c.oid = l.relation
+        WHERE l.pid = pg_backend_pid() AND l.granted AND c.relkind = 'r'
+          AND c.relnamespace <> 'pg_catalog'::regnamespace
+    """)).fetchall()
+    return int(rows), [f"{name}:{mode}" for name, mode in relation_locks]
+
+
+def _mysql_lsn(conn):
+    try:
+        return int(conn.execute(text(
+            "SELECT `COUNT` FROM information_schema.INNODB_METRICS WHERE NAME = 'log_lsn_current'")).scalar())
+    except Exception:
+        # 旧版本没有该计数器时，退回已写入 redo 文件的字节数（未刷盘的部分不计入）
+        return int(conn.execute(text("SHOW GLOBAL STATUS LIKE 'Innodb_os_log_written'")).fetchone()[1])
+
+
+def _mysql_wal_bytes(conn, start):
+    return _mysql_lsn(conn) - start
+
+
+def _mysql_locks(conn):
+    row = conn.execute(text("""
+        SELECT trx_rows_locked, trx_lock_structs
+        FROM information_schema.innodb_trx
+        WHERE trx_mysql_thread_id = CONNECTION_ID()
+    """)).fetchone()
+    if row is None:
+        return 0, []
+    return int(row[0]), [f"lock_structs:{row[1]}"]
+
+
+PROBES = {
+    "postgresql": (_pg_wal_lsn, _pg_wal_bytes, _pg_locks),
+    "mysql": (_mysql_lsn, _mysql_wal_bytes, _mysql_locks),
+}
+
+
+def estimate_table_rows(conn, table_name):
+    """读取统计信息中的表行数（不做全表 COUNT），统计信息缺失时退回 COUNT(*)"""
+    dialect = conn.dialect.name
+    if dialect == "postgresql":
+        rows = conn.execute(text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:t)"),
+                            {"t": table_name}).scalar()
+    elif dialect == "mysql":
+        rows = conn.execute(text("""
+            SELECT table_rows FROM information_schema.tables
+            WHERE table_schema = DATABASE() AND table_name = :t
+        """), {"t": table_name}).scalar()
+    else:
+        rows = None
+    if rows is None or rows <= 0:
+        rows = conn.execute(text(f"SELECT COUNT(*) FROM {table_name}")).scalar()
+    return int(rows)
+
+
+def _fmt_seconds(seconds):
+    if seconds >= 3600:
+        return f"{seconds / 3600:.1f} 小时"
+    if seconds >= 60:
+        return f"{seconds / 60:.1f} 分钟"
+    return f"{seconds:.1f} 秒"
+
+
+def _fmt_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+class SampleEstimator:
+    def __init__(self, conn, job, total_rows):
+        dialect = conn.dialect.name
+        if dialect not in PROBES:
+            raise ValueError(f"❌ 不支持预估的数据库类型: {dialect}")
+        self.conn = conn
+        self.job = job
+        self.total_rows = total_rows
+        self.sample_rows = 0
+        self.stages = {}
+        self.report = None
+        self._lsn, self._wal_bytes, self._locks = PROBES[dialect]
+        self._start_lsn = None
+
+    @contextmanager
+    def stage(self, name, rows_per_txn=None):
+        """
+        统计样本上某一阶段的耗时
+        rows_per_txn: 正式执行时该阶段单个事务覆盖的行数（如全表 UPDATE 为总行数），不写库的阶段不填
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds, _ = self.stages.get(name, (0.0, None))
+            self.stages[name] = (seconds + time.perf_counter() - start, rows_per_txn)
+
+    def __enter__(self):
+        # 丢弃连接上可能残留的事务，样本从一个新事务开始，结束时整体回滚
+        self.conn.rollback()
+        self._start_lsn = self._lsn(self.conn)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                wal_bytes = self._wal_bytes(self.conn, self._start_lsn)
+                rows_locked, relation_locks = self._locks(self.conn)
+        finally:
+            self.conn.rollback()
+            logger.info("↩️ 样本事务已回滚，未提交任何修改")
+        if exc_type is None:
+            self.report = self._project(wal_bytes, rows_locked, relation_locks)
+            self._log(self.report)
+
+    def _project(self, wal_bytes, rows_locked, relation_locks):
+        sample = max(self.sample_rows, 1)
+        scale = self.total_rows / sample
+        stages = {}
+        for name, (seconds, rows_per_txn) in self.stages.items():
+            per_row = seconds / sample
+            stage = {"sample_s": round(seconds, 3), "per_row_ms": round(per_row * 1000, 4),
+                     "projected_s": round(per_row * self.total_rows, 1)}
+            if rows_per_txn:
+                rows_per_txn = min(rows_per_txn, self.total_rows)
+                stage["rows_locked_per_txn"] = rows_per_txn
+                stage["lock_hold_s"] = round(per_row * rows_per_txn, 2)
+            stages[name] = stage
+        return {
+            "job": self.job,
+            "sample_rows": self.sample_rows,
+            "total_rows": self.total_rows,
+            "stages": stages,
+            "projected_s": round(sum(s["projected_s"] for s in stages.values()), 1),
+            "sample_wal_bytes": wal_bytes,
+            "projected_wal_bytes": int(wal_bytes * scale),
+            "sample_rows_locked": rows_locked,
+            "projected_rows_locked": int(rows_locked * scale),
+            "relation_locks": relation_locks,
+        }
+
+    def _log(self, report):
+        logger.info(f"📐 {report['job']} 预估（样本 {report['sample_rows']} 行 / 全表约 {report['total_rows']} 行）")
+        for name, stage in report["stages"].items():
+            line = (f"  ⏱️ {name:<10}: {stage['per_row_ms']:.3f} ms/行 | 样本 {stage['sample_s']:.2f}s"
+                    f" -> 预计 {_fmt_seconds(stage['projected_s'])}")
+            if "lock_hold_s" in stage:
+                line += f" | 每个事务锁 {stage['rows_locked_per_txn']} 行约 {_fmt_seconds(stage['lock_hold_s'])}"
+            logger.info(line)
+        logger.info(f"  ⏳ 预计总耗时: {_fmt_seconds(report['projected_s'])}（不含提交耗时）")
+        logger.info(f"  📝 WAL/redo: 样本 {_fmt_bytes(report['sample_wal_bytes'])}"
+                    f" -> 预计 {_fmt_bytes(report['projected_wal_bytes'])}")
+        logger.info(f"  🔒 行锁（按写入行次）: 样本 {report['sample_rows_locked']} -> 全程累计约 {report['projected_rows_locked']}"
+                    f" | 表级锁: {', '.join(report['relation_locks']) or '-'}")
@@ -0,0 +1,179 @@
+"""
+任务级吞吐统计与性能剖析
+
+    with JobMetrics("省市匹配坐标") as metrics:
+        with metrics.stage("match"):
+            ...
+        metrics.count("rows_matched")
+        metrics.tick()            # 距上次输出超过 interval 秒时写一行 JSON 快照
+
+- 分阶段计时（generate / match / serialize / db_write ...）与计数（rows_written、retries、cache_hits ...）
+- 周期性 JSON 行写入 metrics_<job>_<时间>.jsonl，结束时写入 final 汇总并打印到日志
+- 公共模块（批大小控制、重试）通过模块级 stage() / count() 上报，没有活动任务时不做任何事；
+  timed() 包装迭代器，统计流式读取 / 等待匹配结果的时间
+- 环境变量 GENERATEDATA_PROFILE=1（或指定 .prof 路径）开启 cProfile，结果可用 snakeviz / pstats 查看；
+  py-spy 可直接附加到日志中打印的 pid：py-spy record --pid <pid> -o profile.svg
+"""
+import cProfile
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+PROFILE_ENV = "GENERATEDATA_PROFILE"
+
+_active = None
+
+
+class JobMetrics:
+    def __init__(self, job, interval=10.0, path=None):
+        self.job = job
+        self.interval = interval
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.path = path or f"metrics_{job}_{timestamp}.jsonl"
+        self.timestamp = timestamp
+
+        self.stages = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self._start = None
+        self._last_emit = None
+        self._file = None
+        self._profiler = None
+        self._profile_path = None
+        self._previous = None
+
+    # === 采集 ===
+    @contextmanager
+    def stage(self, name):
+        """累计 with 块耗时到阶段 name（可嵌套，嵌套阶段的时间会同时计入外层）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] += time.perf_counter() - start
+
+    def add_time(self, name, seconds):
+        self.stages[name] += seconds
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def gauge(self, name, value):
+        """记录瞬时值（如当前批大小、缓存命中数），快照中取最新值"""
+        self.gauges[name] = value
+
+    # === 输出 ===
+    def snapshot(self, final=False):
+        elapsed = time.perf_counter() - self._start
+        return {
+            "ts": datetime.now().isoformat(timespec="seconds"),
+            "job": self.job,
+            "final": final,
+            "elapsed_s": round(elapsed, 3),
+            "stages_s": {k: round(v, 3) for k, v in self.stages.items()},
+            "counters": dict(self.counters),
+            "rates_per_s": {k: round(v / elapsed, 1) for k, v in self.counters.items()} if elapsed > 0 else {},
+            "gauges": dict(self.gauges),
+        }
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        self._file.flush()
+
+    def tick(self):
+        """距上次输出超过 interval 秒时写一行快照，可在循环中频繁调用"""
+        now = time.perf_counter()
+        if now - self._last_emit >= self.interval:
+            self._last_emit = now
+            self._write(self.snapshot())
+
+    def summary(self):
+        record = self.snapshot(final=True)
+        self._write(record)
+
+        elapsed = record["elapsed_s"]
+        logger.info(f"📈 {self.job} 性能统计（总耗时 {elapsed:.2f}s）")
+        for name, seconds in sorted(self.stages.items(), key=lambda kv: -kv[1]):
+            logger.info(f"  ⏱️ {name:<16}: {seconds:8.2f}s ({seconds / max(elapsed, 1e-9) * 100:5.1f}%)")
+        for name, value in self.counters.items():
+            logger.info(f"  🔢 {name:<16}: {value} ({record['rates_per_s'].get(name, 0)}/s)")
+        logger.info(f"  📄 指标明细: {self.path}")
+        return record
+
+    # === 生命周期 ===
+    def __enter__(self):
+        global _active
+        self._start = self._last_emit = time.perf_counter()
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._previous, _active = _active, self
+
+        profile = os.environ.get(PROFILE_ENV)
+        if profile:
+            self._profile_path = profile if profile.endswith(".prof") else f"profile_{self.job}_{self.timestamp}.prof"
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        logger.info(f"📊 {self.job} 开始统计 | pid={os.getpid()}"
+                    + (f" | cProfile -> {self._profile_path}" if self._profiler else ""))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        global _active
+        if self._profiler:
+            self._profiler.disable()
+            self._profiler.dump_stats(self._profile_path)
+            logger.info(f"🔬 cProfile 结果已保存: {self._profile_path}")
+        try:
+            self.summary()
+        finally:
+            self._file.close()
+            _active = self._previous
+
+
+# === 模块级上报（没有活动任务时为空操作）===
+@contextmanager
+def stage(name):
+    if _active is None:
+        yield
+    else:
+        with _active.stage(name):
+            yield
+
+
+def add_time(name, seconds):
+    if _active is not None:
+        _active.add_time(name, seconds)
+
+
+def count(name, n=1):
+    if _active is not None:
+        _active.count(name, n)
+
+
+def gauge(name, value):
+    if _active is not None:
+        _active.gauge(name, value)
+
+
+def tick():
+    if _active is not None:
+        _active.tick()
+
+
+def timed(iterable, name):
+    """逐条产出 iterable 的元素，把等待下一条的时间（如流式读库、等待子进程匹配结果）计入阶段 name"""
+    it = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(it)
+        except StopIteration:
+            add_time(name, time.perf_counter() - start)
+            return
+        add_time(name, time.perf_counter() - start)
+        yield item
@@ -0,0 +1,59 @@
+import itertools
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# === 子进程全局状态（由 initializer 在每个进程中设置一次）===
+_worker_fn = None
+_worker_context = None
+
+
+def _init_worker(match_fn, context):
+    global _worker_fn, _worker_context
+    # fork 出的子进程不复用父进程连接池中的连接（dispose(close=False) 不会关闭父进程仍在使用的连接）
+    from dbhelp import dispose_engines
+    dispose_engines()
+    _worker_fn = match_fn
+    _worker_context = context
+
+
+def _match_chunk(rows):
+    return [_worker_fn(row, _worker_context) for row in rows]
+
+
+def _chunked(rows, chunk_size):
+    it = iter(rows)
+    while True:
+        chunk = list(itertools.islice(it, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def parallel_match(rows, match_fn, context, workers=None, chunk_size=500, max_pending=None):
+    """
+    多进程执行 CPU 密集的匹配，按输入顺序逐条产出 match_fn(row, context) 的结果
+
+    - context（如地址索引）通过 initializer 在每个子进程只传输一次，不随每个分块重复序列化
+    - rows 可以是列表或流式迭代器，按 chunk_size 分块下发，最多同时挂起 max_pending 个分块，内存保持平稳
+    - match_fn 必须是模块级函数，rows 中的元素必须可 pickle（如 dict）
+    - workers <= 1 时在当前进程内顺序执行，便于调试
+
+    数据库写入应由调用方在主进程完成
+    """
+    workers = os.cpu_count() if workers is None else workers
+    if workers <= 1:
+        for row in rows:
+            yield match_fn(row, context)
+        return
+
+    max_pending = max_pending or workers * 2
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(match_fn, context)) as pool:
+        pending = deque()
+        for chunk in _chunked(rows, chunk_size):
+            pending.append(pool.submit(_match_chunk, chunk))
+            if len(pending) >= max_pending:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
@@ -1,8 +1,10 @@
 import logging
 import time
+import numpy as np
 import pandas as pd
 from sqlalchemy import text
 from dbhelp import get_engine, DB_CONFIG5
+from region_point_helper import assign_region_points
 
 # === 日志配置 ===
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -33,6 +35,13 @@ def main(batch_size=5000):  # 涉及空间运算，批次建议缩小一点点
             logger.error("❌ 未找到市级区域数据")
             return
 
+        # 地址、ID 按城市预先算好，分配时只需按下标取值
+        city_ids = df_region['city_id'].astype('int64').to_numpy()
+        province_ids = df_region['province_id'].astype('int64').to_numpy()
+        city_addresses = (df_region['province_name'].fillna('').astype(str)
+                          .str.cat(df_region['city_name'].fillna('').astype(str), sep=' ')).to_numpy()
+        rng = np.random.default_rng()
+
         # 2️⃣ 准备设备数据
         total_devices = conn.execute(text("SELECT COUNT(*) FROM dev_device_instance")).scalar()
         logger.info(f"📦 总设备数: {total_devices}")
@@ -40,29 +49,8 @@ def main(batch_size=5000):  # 涉及空间运算，批次建议缩小一点点
         offset = 0
         batch_index = 1
 
-        # 核心 SQL：使用 PostGIS 在指定 region_id 的 geom 范围内生成 1 个随机点
-        # ST_GeneratePoints 生成的是 MultiPoint，所以用 (ST_Dump).geom 转为 Point
-        # 然后用 ST_X 和 ST_Y 提取经纬度
-        update_sql = text("""
-            UPDATE dev_device_instance
-            SET 
-                province_id = :province_id,
-                city_id = :city_id,
-                region_id = :city_id,
-                install_address = :address,
-                address = :address,
-                -- ST_GeneratePoints 返回 MultiPoint，必须用 ST_GeometryN 提取出其中的 Point
-                install_longitude = ST_X(ST_GeometryN(sub.random_pt, 1)),
-                install_latitude = ST_Y(ST_GeometryN(sub.random_pt, 1))
-            FROM (
-                SELECT 
-                    ST_GeneratePoints(geom, 1) as random_pt, 
-                    region_id 
-                FROM alabo_region
-            ) AS sub
-            WHERE dev_device_instance.id = :device_id
-            AND sub.region_id = :city_id
-        """)
+        # 核心思路：先为整批设备分配城市，再按城市各调用一次 ST_GeneratePoints(geom, k)
+        # 生成恰好 k 个点写入临时表，最后一次 JOIN 回写，PostGIS 开销只与设备数相关
 
         while offset < total_devices:
             batch_start_time = time.time()
@@ -75,28 +63,20 @@ def main(batch_size=5000):  # 涉及空间运算，批次建议缩小一点点
             if not devices:
                 break
 
-            update_params = []
-            for dev in devices:
-                # 随机分配一个市
-                target_city = df_region.sample(1).iloc[0]
-                full_address = f"{target_city['province_name']} {target_city['city_name']}"
-
-                update_params.append({
-                    "province_id": int(target_city['province_id']),
-                    "city_id": int(target_city['city_id']),
-                    "address": full_address,
-                    "device_id": dev[0]
-                })
+            # 一次 NumPy 调用为整批设备随机分配城市
+            picks = rng.integers(0, len(df_region), size=len(devices))
+            assignments = [
+                {"device_id": str(dev[0]), "province_id": int(p), "city_id": int(c), "address": a}
+                for dev, p, c, a in zip(devices, province_ids[picks], city_ids[picks], city_addresses[picks])
+            ]
 
             # 执行批量更新
             try:
-                # 注意：由于使用了 FROM 语句，SQLAlchemy 的 executemany 可能在某些驱动下表现不同
-                # 这里我们分小块提交事务
-                conn.execute(update_sql, update_params)
+                updated = assign_region_points(conn, assignments)
                 conn.commit()
 
                 duration = time.time() - batch_start_time
-                logger.info(f"✅ 第 {batch_index} 批处理完成 ({len(update_params)}条), 耗时 {duration:.2f}s")
+                logger.info(f"✅ 第 {batch_index} 批处理完成 ({updated}/{len(assignments)}条), 耗时 {duration:.2f}s")
             except Exception as e:
                 logger.error(f"❌ 更新批次 {batch_index} 失败: {e}")
                 conn.rollback()
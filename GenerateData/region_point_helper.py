@@ -0,0 +1,91 @@
+import logging
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+ASSIGN_STAGING_TABLE = "tmp_region_point_assign"
+POINT_STAGING_TABLE = "tmp_region_point_pool"
+
+
+def _prepare_staging(conn):
+    """创建（会话级）临时表并清空，同一连接多批次复用"""
+    conn.execute(text(f"""
+        CREATE TEMP TABLE IF NOT EXISTS {ASSIGN_STAGING_TABLE} (
+            device_id   TEXT PRIMARY KEY,
+            province_id BIGINT,
+            city_id     BIGINT,
+            address     TEXT,
+            rn          INTEGER
+        )
+    """))
+    conn.execute(text(f"""
+        CREATE TEMP TABLE IF NOT EXISTS {POINT_STAGING_TABLE} (
+            city_id BIGINT,
+            rn      INTEGER,
+            lon     DOUBLE PRECISION,
+            lat     DOUBLE PRECISION,
+            PRIMARY KEY (city_id, rn)
+        )
+    """))
+    conn.execute(text(f"TRUNCATE {ASSIGN_STAGING_TABLE}, {POINT_STAGING_TABLE}"))
+
+
+def assign_region_points(conn, assignments, target_table="dev_device_instance", region_table="alabo_region"):
+    """
+    按城市批量生成随机点并回写设备坐标（PostgreSQL + PostGIS）
+    每个城市只调用一次 ST_GeneratePoints(geom, k)，k 为本批分配到该城市的设备数，
+    生成的点落入临时表后与设备按 (city_id, 序号) 一次 JOIN 更新
+
+    :param assignments: list[dict] - 每项包含 device_id, province_id, city_id, address
+    :return: int - 实际更新的行数（所在城市无 geom 的设备不会被更新）
+    """
+    if not assignments:
+        return 0
+
+    # 每个城市内给设备编号 1..k，对应 ST_Dump 输出的 path[1]
+    city_seq = {}
+    rows = []
+    for item in assignments:
+        rn = city_seq.get(item["city_id"], 0) + 1
+        city_seq[item["city_id"]] = rn
+        rows.append({**item, "rn": rn})
+
+    _prepare_staging(conn)
+    conn.execute(text(f"""
+        INSERT INTO {ASSIGN_STAGING_TABLE} (device_id, province_id, city_id, address, rn)
+        VALUES (:device_id, :province_id, :city_id, :address, :rn)
+    """), rows)
+
+    # 每个城市一次 ST_GeneratePoints，点数恰好等于设备数
+    conn.execute(text(f"""
+        INSERT INTO {POINT_STAGING_TABLE} (city_id, rn, lon, lat)
+        SELECT c.city_id, d.path[1], ST_X(d.geom), ST_Y(d.geom)
+        FROM (
+            SELECT city_id, COUNT(*)::INTEGER AS k
+            FROM {ASSIGN_STAGING_TABLE}
+            GROUP BY city_id
+        ) AS c
+        JOIN {region_table} r ON r.region_id = c.city_id
+        CROSS JOIN LATERAL ST_Dump(ST_GeneratePoints(r.geom, c.k)) AS d
+        WHERE r.geom IS NOT NULL
+    """))
+
+    result = conn.execute(text(f"""
+        UPDATE {target_table} AS t
+        SET
+            province_id = a.province_id,
+            city_id = a.city_id,
+            region_id = a.city_id,
+            install_address = a.address,
+            address = a.address,
+            install_longitude = p.lon,
+            install_latitude = p.lat
+        FROM {ASSIGN_STAGING_TABLE} a
+        JOIN {POINT_STAGING_TABLE} p ON p.city_id = a.city_id AND p.rn = a.rn
+        WHERE t.id = a.device_id
+    """))
+
+    missing = len(rows) - result.rowcount
+    if missing > 0:
+        logger.warning(f"⚠️ {missing} 台设备所在城市无 geom 或设备不存在，未更新坐标")
+    return result.rowcount
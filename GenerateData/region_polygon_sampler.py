@@ -0,0 +1,224 @@
+import logging
+import struct
+import numpy as np
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# 单次点在多边形判断的 点数 × 边数 上限，控制内存占用
+_PIP_CELLS = 4_000_000
+
+_WKB_POLYGON = 3
+_WKB_MULTIPOLYGON = 6
+_WKB_GEOMETRYCOLLECTION = 7
+
+
+# === WKB 解析（支持 WKB / EWKB / ISO Z、M）===
+def _read_header(buf, offset):
+    byte_order = buf[offset]
+    endian = "<" if byte_order == 1 else ">"
+    (geom_type,) = struct.unpack_from(endian + "I", buf, offset + 1)
+    offset += 5
+
+    # EWKB 标志位
+    has_z = bool(geom_type & 0x80000000)
+    has_m = bool(geom_type & 0x40000000)
+    if geom_type & 0x20000000:
+        offset += 4  # 跳过 SRID
+    geom_type &= 0x0FFFFFFF
+
+    # ISO WKB: 1000+ 为 Z，2000+ 为 M，3000+ 为 ZM
+    iso_dims, geom_type = divmod(geom_type, 1000)
+    has_z = has_z or iso_dims in (1, 3)
+    has_m = has_m or iso_dims in (2, 3)
+    return endian, geom_type, 2 + has_z + has_m, offset
+
+
+def _read_polygon(buf, offset, endian, ndims):
+    (ring_count,) = struct.unpack_from(endian + "I", buf, offset)
+    offset += 4
+    rings = []
+    dtype = np.dtype(np.float64).newbyteorder(endian)
+    for _ in range(ring_count):
+        (point_count,) = struct.unpack_from(endian + "I", buf, offset)
+        offset += 4
+        coords = np.frombuffer(buf, dtype=dtype, count=point_count * ndims, offset=offset)
+        rings.append(coords.reshape(point_count, ndims)[:, :2].astype(np.float64))
+        offset += point_count * ndims * 8
+    return rings, offset
+
+
+def _read_geometry(buf, offset, polygons):
+    endian, geom_type, ndims, offset = _read_header(buf, offset)
+    if geom_type == _WKB_POLYGON:
+        rings, offset = _read_polygon(buf, offset, endian, ndims)
+        if rings:
+            polygons.append(rings)
+    elif geom_type in (_WKB_MULTIPOLYGON, _WKB_GEOMETRYCOLLECTION):
+        (count,) = struct.unpack_from(endian + "I", buf, offset)
+        offset += 4
+        for _ in range(count):
+            offset = _read_geometry(buf, offset, polygons)
+    else:
+        raise ValueError(f"不支持的几何类型: {geom_type}")
+    return offset
+
+
+def parse_wkb_polygons(data):
+    """
+    解析 Polygon / MultiPolygon 的 WKB，返回 [polygon, ...]
+    每个 polygon 为 [外环, 内环...]，环是 (N, 2) 的 (lon, lat) 数组
+    """
+    polygons = []
+    _read_geometry(bytes(data), 0, polygons)
+    return polygons
+
+
+# === 几何预处理 ===
+def _ring_area(ring):
+    x, y = ring[:, 0], ring[:, 1]
+    return 0.5 * abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+
+class _PolygonPart:
+    """单个多边形（含洞）的边数组与包围盒，按奇偶规则判断点是否在内部"""
+
+    def __init__(self, rings):
+        starts, ends = [], []
+        for ring in rings:
+            starts.append(ring)
+            ends.append(np.roll(ring, -1, axis=0))
+        starts, ends = np.concatenate(starts), np.concatenate(ends)
+
+        self.x1, self.y1 = starts[:, 0], starts[:, 1]
+        self.x2, self.y2 = ends[:, 0], ends[:, 1]
+        outer = rings[0]
+        self.min_x, self.min_y = outer.min(axis=0)
+        self.max_x, self.max_y = outer.max(axis=0)
+        self.area = max(0.0, _ring_area(outer) - sum(_ring_area(r) for r in rings[1:]))
+        bbox_area = (self.max_x - self.min_x) * (self.max_y - self.min_y)
+        self.fill_ratio = self.area / bbox_area if bbox_area > 0 else 0.0
+
+    def contains(self, x, y):
+        inside = np.zeros(len(x), dtype=bool)
+        step = max(1, _PIP_CELLS // max(1, len(self.x1)))
+        for i in range(0, len(x), step):
+            px = x[i:i + step, None]
+            py = y[i:i + step, None]
+            straddle = (self.y1 > py) != (self.y2 > py)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                cross_x = self.x1 + (py - self.y1) * (self.x2 - self.x1) / (self.y2 - self.y1)
+            crossings = np.count_nonzero(straddle & (px < cross_x), axis=1)
+            inside[i:i + step] = (crossings & 1).astype(bool)
+        return inside
+
+    def sample(self, n, rng):
+        """包围盒内均匀撒点并拒绝落在多边形外的点，直到凑够 n 个"""
+        out_x = np.empty(n)
+        out_y = np.empty(n)
+        filled = 0
+        ratio = max(self.fill_ratio, 0.01)
+        while filled < n:
+            need = n - filled
+            batch = int(need / ratio * 1.2) + 16
+            x = rng.uniform(self.min_x, self.max_x, batch)
+            y = rng.uniform(self.min_y, self.max_y, batch)
+            mask = self.contains(x, y)
+            hit = min(need, int(mask.sum()))
+            out_x[filled:filled + hit] = x[mask][:hit]
+            out_y[filled:filled + hit] = y[mask][:hit]
+            filled += hit
+        return out_x, out_y
+
+
+class _RegionShape:
+    """一个区域的所有多边形，按面积加权分配采样点数"""
+
+    def __init__(self, polygons):
+        self.parts = [_PolygonPart(rings) for rings in polygons]
+        self.parts = [p for p in self.parts if p.area > 0]
+        areas = np.array([p.area for p in self.parts])
+        self.weights = areas / areas.sum() if len(areas) else areas
+
+    def sample(self, n, rng):
+        counts = rng.multinomial(n, self.weights)
+        xs, ys = [], []
+        for part, count in zip(self.parts, counts):
+            if count:
+                x, y = part.sample(int(count), rng)
+                xs.append(x)
+                ys.append(y)
+        x, y = np.concatenate(xs), np.concatenate(ys)
+        # 多个多边形按顺序拼接，打乱以免同一批设备按多边形聚集
+        order = rng.permutation(n)
+        return x[order], y[order]
+
+
+# === 对外接口 ===
+class RegionPolygonSampler:
+    """
+    离线区域多边形采样器：一次性加载 alabo_region 的边界（WKB），
+    在进程内用 NumPy 生成严格落在区域边界内的随机坐标，不依赖 PostGIS 逐行计算
+
+    用法:
+        sampler = RegionPolygonSampler.from_db(conn)
+        lat, lon = sampler.sample_many(region_ids)   # 无边界的区域返回 NaN，由调用方兜底
+    """
+
+    def __init__(self, shapes):
+        self.shapes = shapes
+
+    @classmethod
+    def from_wkb_rows(cls, rows):
+        """rows: 可迭代的 (region_id, wkb_bytes)"""
+        shapes = {}
+        for region_id, wkb in rows:
+            if wkb is None:
+                continue
+            try:
+                shape = _RegionShape(parse_wkb_polygons(wkb))
+            except (ValueError, struct.error) as e:
+                logger.warning(f"⚠️ region_id={region_id} 边界解析失败，跳过: {e}")
+                continue
+            if shape.parts:
+                shapes[int(region_id)] = shape
+        logger.info(f"🗺️ 已加载 {len(shapes)} 个区域边界")
+        return cls(shapes)
+
+    @classmethod
+    def from_db(cls, conn, region_table="alabo_region", geom_column="geom"):
+        rows = conn.execute(text(
+            f"SELECT region_id, ST_AsBinary({geom_column}) FROM {region_table} WHERE {geom_column} IS NOT NULL "
+            f"ORDER BY region_id"
+        )).fetchall()
+        return cls.from_wkb_rows(rows)
+
+    def __contains__(self, region_id):
+        return int(region_id) in self.shapes
+
+    def sample(self, region_id, n, rng=None):
+        """在指定区域内生成 n 个随机点，返回 (lat 数组, lon 数组)"""
+        rng = rng or np.random.default_rng()
+        x, y = self.shapes[int(region_id)].sample(n, rng)
+        return y, x
+
+    def sample_many(self, region_ids, rng=None, decimals=6):
+        """
+        为每个 region_id 生成一个落在其边界内的点（同一区域的点一次性生成）
+        :return: (lat 数组, lon 数组)，没有边界数据的区域对应位置为 NaN
+        """
+        rng = rng or np.random.default_rng()
+        region_ids = np.asarray(region_ids, dtype=np.int64)
+        lat = np.full(len(region_ids), np.nan)
+        lon = np.full(len(region_ids), np.nan)
+
+        unique_ids, inverse, counts = np.unique(region_ids, return_inverse=True, return_counts=True)
+        groups = np.split(np.argsort(inverse, kind="stable"), np.cumsum(counts)[:-1])
+        for region_id, idx in zip(unique_ids, groups):
+            shape = self.shapes.get(int(region_id))
+            if shape is None:
+                continue
+            x, y = shape.sample(len(idx), rng)
+            lat[idx], lon[idx] = y, x
+
+        return np.round(lat, decimals), np.round(lon, decimals)
@@ -0,0 +1,257 @@
+"""
+alabo_region 本地快照：导出一次，之后各脚本启动时直接内存映射读取，不再查询区域表
+
+    python region_snapshot.py                     # 从默认库导出到 GenerateData/region_snapshot/
+    python region_snapshot.py --config DB_CONFIG  # 指定 dbhelp 配置
+
+    df_region = load_regions(conn)                # 有可用快照时读快照，否则查库；两种来源列类型一致
+    sampler = load_polygon_sampler(conn)          # 区域边界同样优先取快照
+
+快照目录（每列一个 .npy，np.load(mmap_mode="r") 按需读取）:
+    meta.json                         快照版本、导出时间、来源库、行数、内容哈希
+    region_id.npy / parent_id.npy     int64
+    level.npy                         int8，统一为 1 省 / 2 市 / 3 区（0 未识别），库中 1 / '1' / 'province' 均可
+    name_en.npy                       定长 unicode
+    latitude.npy / longitude.npy      float64，缺失为 NaN
+    geom_region_id.npy / geom_wkb.npy / geom_offsets.npy
+                                      库中有 geom 列时：WKB 按顺序拼接为 uint8，第 i 个为 wkb[offsets[i]:offsets[i+1]]
+
+- 快照记录来源库（类型://主机:端口/库名），传入的连接指向其它库时不使用快照
+- 环境变量 GENERATEDATA_REGION_SNAPSHOT 可指定快照目录，设为 off 则始终查库
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_ENV = "GENERATEDATA_REGION_SNAPSHOT"
+DEFAULT_SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "region_snapshot")
+
+# === 区域层级编码 ===
+LEVEL_PROVINCE = 1
+LEVEL_CITY = 2
+LEVEL_AREA = 3
+LEVEL_CODES = {
+    "1": LEVEL_PROVINCE, "province": LEVEL_PROVINCE,
+    "2": LEVEL_CITY, "city": LEVEL_CITY,
+    "3": LEVEL_AREA, "area": LEVEL_AREA, "district": LEVEL_AREA,
+}
+
+COLUMNS = ("region_id", "parent_id", "level", "name_en", "latitude", "longitude")
+GEOM_FILES = ("geom_region_id", "geom_wkb", "geom_offsets")
+
+
+def normalize_level(value):
+    """1 / '1' / 'province' -> 1，依此类推；无法识别返回 0"""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return 0
+    return LEVEL_CODES.get(str(value).strip().lower(), 0)
+
+
+def snapshot_dir(path=None):
+    """快照目录：参数 > 环境变量 > 默认目录（环境变量为 off 时取默认目录，仅用于导出）"""
+    env = os.environ.get(SNAPSHOT_ENV, "")
+    return path or (env if env and env.lower() != "off" else DEFAULT_SNAPSHOT_DIR)
+
+
+def _source_of(conn):
+    url = conn.engine.url
+    return f"{url.get_backend_name()}://{url.host}:{url.port}/{url.database}"
+
+
+# === 从数据库读取 ===
+def _fetch_frame(conn):
+    df = pd.DataFrame(conn.execute(text(
+        "SELECT region_id, parent_id, name_en, level, latitude, longitude FROM alabo_region ORDER BY region_id"
+    )).mappings().all(), columns=["region_id", "parent_id", "name_en", "level", "latitude", "longitude"])
+    return normalize_frame(df)
+
+
+def normalize_frame(df):
+    """统一列类型：id 为 int64，level 为 1/2/3 编码，坐标为 float64"""
+    return pd.DataFrame({
+        "region_id": pd.to_numeric(df["region_id"]).astype("int64"),
+        "parent_id": pd.to_numeric(df["parent_id"], errors="coerce").fillna(0).astype("int64"),
+        "name_en": df["name_en"].astype(object).where(df["name_en"].notna(), None).astype(object),
+        "level": df["level"].map(normalize_level).astype("int8"),
+        "latitude": pd.to_numeric(df["latitude"], errors="coerce").astype("float64"),
+        "longitude": pd.to_numeric(df["longitude"], errors="coerce").astype("float64"),
+    })
+
+
+def _fetch_wkb_rows(conn):
+    """读取区域边界 WKB，库中没有 geom 列或没有 PostGIS 时返回空列表"""
+    try:
+        return conn.execute(text(
+            "SELECT region_id, ST_AsBinary(geom) FROM alabo_region WHERE geom IS NOT NULL ORDER BY region_id"
+        )).fetchall()
+    except Exception as e:
+        conn.rollback()
+        logger.info(f"未导出区域边界: {e}")
+        return []
+
+
+# === 导出 ===
+def export_snapshot(conn, path=None):
+    """导出 alabo_region 到快照目录（先写临时目录再整体替换，读取方不会看到写了一半的快照）"""
+    path = snapshot_dir(path)
+    df = _fetch_frame(conn)
+    wkb_rows = _fetch_wkb_rows(conn)
+
+    names = df["name_en"].fillna("").astype(str).to_numpy()
+    width = max((len(n) for n in names), default=1) or 1
+    arrays = {
+        "region_id": df["region_id"].to_numpy(),
+        "parent_id": df["parent_id"].to_numpy(),
+        "level": df["level"].to_numpy(),
+        "name_en": names.astype(f"<U{width}"),
+        "latitude": df["latitude"].to_numpy(),
+        "longitude": df["longitude"].to_numpy(),
+    }
+    if wkb_rows:
+        blobs = [bytes(wkb) for _, wkb in wkb_rows]
+        arrays["geom_region_id"] = np.array([int(region_id) for region_id, _ in wkb_rows], dtype=np.int64)
+        arrays["geom_wkb"] = np.frombuffer(b"".join(blobs), dtype=np.uint8)
+        arrays["geom_offsets"] = np.concatenate([[0], np.cumsum([len(b) for b in blobs])]).astype(np.int64)
+
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    digest = hashlib.sha256()
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+        digest.update(name.encode())
+        digest.update(np.ascontiguousarray(array).tobytes())
+
+    meta = {
+        "version": SNAPSHOT_VERSION,
+        "exported_at": datetime.now().isoformat(timespec="seconds"),
+        "source": _source_of(conn),
+        "rows": len(df),
+        "levels": {str(k): int(v) for k, v in df["level"].value_counts().sort_index().items()},
+        "geometries": len(wkb_rows),
+        "sha256": digest.hexdigest(),
+    }
+    with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    logger.info(f"✅ 区域快照已导出: {path}（{meta['rows']} 条，边界 {meta['geometries']} 个，层级 {meta['levels']}）")
+    return meta
+
+
+# === 读取 ===
+class RegionSnapshot:
+    def __init__(self, path, meta, arrays):
+        self.path = path
+        self.meta = meta
+        self.arrays = arrays
+
+    @classmethod
+    def open(cls, path=None):
+        """打开快照（各列内存映射），不存在或版本不符时返回 None"""
+        path = snapshot_dir(path)
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != SNAPSHOT_VERSION:
+            logger.warning(f"⚠️ 区域快照版本 {meta.get('version')} 与当前 {SNAPSHOT_VERSION} 不符，请重新导出: {path}")
+            return None
+        arrays = {}
+        for name in COLUMNS + GEOM_FILES:
+            file = os.path.join(path, f"{name}.npy")
+            if os.path.exists(file):
+                arrays[name] = np.load(file, mmap_mode="r")
+        return cls(path, meta, arrays)
+
+    @property
+    def has_geometries(self):
+        return "geom_wkb" in self.arrays
+
+    def to_frame(self):
+        names = pd.Series(self.arrays["name_en"], dtype=object)
+        return pd.DataFrame({
+            "region_id": np.asarray(self.arrays["region_id"]),
+            "parent_id": np.asarray(self.arrays["parent_id"]),
+            "name_en": names.where(names != "", None).astype(object),
+            "level": np.asarray(self.arrays["level"]),
+            "latitude": np.asarray(self.arrays["latitude"]),
+            "longitude": np.asarray(self.arrays["longitude"]),
+        })
+
+    def wkb_rows(self):
+        """逐个产出 (region_id, wkb_bytes)，与 RegionPolygonSampler.from_wkb_rows 的输入一致"""
+        wkb, offsets = self.arrays["geom_wkb"], self.arrays["geom_offsets"]
+        for i, region_id in enumerate(self.arrays["geom_region_id"]):
+            yield int(region_id), wkb[offsets[i]:offsets[i + 1]].tobytes()
+
+
+def _usable_snapshot(conn, path):
+    if path is None and os.environ.get(SNAPSHOT_ENV, "").lower() == "off":
+        return None
+    snapshot = RegionSnapshot.open(path)
+    if snapshot is None:
+        return None
+    if conn is not None and snapshot.meta.get("source") != _source_of(conn):
+        logger.info(f"区域快照来自 {snapshot.meta.get('source')}，与当前库不同，改为查库")
+        return None
+    return snapshot
+
+
+def load_regions(conn=None, path=None):
+    """
+    读取区域表：region_id, parent_id, name_en, level(1/2/3), latitude, longitude
+    conn 可以是 Connection 或 Engine；使用快照时不会连接数据库
+    """
+    snapshot = _usable_snapshot(conn, path)
+    if snapshot is not None:
+        logger.info(f"📦 使用区域快照 {snapshot.path}（导出于 {snapshot.meta['exported_at']}，{snapshot.meta['rows']} 条）")
+        return snapshot.to_frame()
+    if conn is None:
+        raise ValueError("❌ 没有可用的区域快照，需要传入数据库连接")
+    if isinstance(conn, Engine):
+        with conn.connect() as c:
+            return _fetch_frame(c)
+    return _fetch_frame(conn)
+
+
+def load_polygon_sampler(conn=None, path=None):
+    """区域边界采样器：快照中有边界时从快照构建，否则查库"""
+    from region_polygon_sampler import RegionPolygonSampler
+
+    snapshot = _usable_snapshot(conn, path)
+    if snapshot is not None and snapshot.has_geometries:
+        return RegionPolygonSampler.from_wkb_rows(snapshot.wkb_rows())
+    return RegionPolygonSampler.from_db(conn)
+
+
+def export(path=None, config=None):
+    from dbhelp import get_engine, resolve_config
+
+    with get_engine(config or resolve_config()).connect() as conn:
+        return export_snapshot(conn, path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="导出 alabo_region 本地快照")
+    parser.add_argument("--config", help="dbhelp 中的配置名，如 DB_CONFIG4")
+    parser.add_argument("--path", help=f"快照目录（默认 {DEFAULT_SNAPSHOT_DIR}）")
+    args = parser.parse_args()
+
+    from dbhelp import resolve_config
+
+    export(args.path, resolve_config(args.config))
@@ -0,0 +1,137 @@
+"""
+逐行结果输出的安静模式：百万级数据逐行 print / tqdm.write 时终端 I/O 本身就要耗费数分钟
+
+    reporter = RowReporter("省市匹配坐标", write=tqdm.write)
+    reporter.ok(f"✅ 匹配成功 | meter_id: {meter_id}")
+    reporter.fail("城市匹配失败", f"❌ 匹配失败 | meter_id: {meter_id} | 原因: ...")
+    reporter.close()   # 输出按原因汇总的统计
+
+- 环境变量 GENERATEDATA_LOG_MODE=quiet（默认）：成功行按 sample_every 抽样，失败行每种原因先输出 first_failures 条，
+  整体每秒不超过 max_per_sec 行；verbose：与原来一样逐行输出
+- GENERATEDATA_LOG_DETAIL=1：所有逐行信息由后台线程写入 rows_<job>_<时间>.log.gz，不阻塞主循环
+"""
+import gzip
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+LOG_MODE_ENV = "GENERATEDATA_LOG_MODE"
+LOG_DETAIL_ENV = "GENERATEDATA_LOG_DETAIL"
+
+# 原因文本中第一个括号 / 分隔符之前的部分作为分类，如 "区县匹配失败（0.45）| 输入..." -> "区县匹配失败"
+_REASON_CUT_RE = re.compile(r"[（(|:：]")
+
+
+def reason_category(reason):
+    return _REASON_CUT_RE.split(str(reason), 1)[0].strip() or "未知原因"
+
+
+class _DetailWriter(threading.Thread):
+    """后台线程写 gzip 明细文件，主线程只做入队"""
+
+    def __init__(self, path):
+        super().__init__(daemon=True)
+        self.path = path
+        self.queue = queue.Queue(maxsize=100000)
+
+    def run(self):
+        with gzip.open(self.path, "at", encoding="utf-8") as f:
+            while True:
+                line = self.queue.get()
+                if line is None:
+                    return
+                f.write(line + "\n")
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+
+
+class RowReporter:
+    def __init__(self, job, write=print, mode=None, sample_every=1000, first_failures=3,
+                 max_per_sec=5, detail=None):
+        self.job = job
+        self.write = write
+        self.mode = mode or os.environ.get(LOG_MODE_ENV, "quiet")
+        self.sample_every = sample_every
+        self.first_failures = first_failures
+        self.max_per_sec = max_per_sec
+
+        self.outcomes = Counter()
+        self.reasons = Counter()
+        self.suppressed = 0
+        self._window_start = time.monotonic()
+        self._window_lines = 0
+
+        if detail is None:
+            detail = os.environ.get(LOG_DETAIL_ENV, "") not in ("", "0")
+        self._detail = None
+        if detail:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            self._detail = _DetailWriter(f"rows_{job}_{timestamp}.log.gz")
+            self._detail.start()
+
+    @property
+    def verbose(self):
+        return self.mode == "verbose"
+
+    def _rate_ok(self):
+        now = time.monotonic()
+        if now - self._window_start >= 1.0:
+            self._window_start, self._window_lines = now, 0
+        if self._window_lines < self.max_per_sec:
+            self._window_lines += 1
+            return True
+        return False
+
+    def _emit(self, message, wanted):
+        if self._detail is not None:
+            self._detail.queue.put(message)
+        if self.verbose or (wanted and self._rate_ok()):
+            self.write(message)
+        else:
+            self.suppressed += 1
+
+    def ok(self, message, outcome="成功"):
+        self.outcomes[outcome] += 1
+        self._emit(message, self.outcomes[outcome] % self.sample_every == 1)
+
+    def info(self, message):
+        """过程信息（如解析出的地址），只在 verbose 模式或明细文件中出现"""
+        if self._detail is not None:
+            self._detail.queue.put(message)
+        if self.verbose:
+            self.write(message)
+
+    def fail(self, reason, message, outcome="失败"):
+        category = reason_category(reason)
+        self.outcomes[outcome] += 1
+        self.reasons[category] += 1
+        self._emit(message, self.reasons[category] <= self.first_failures)
+
+    def summary(self, top=10):
+        total = sum(self.outcomes.values())
+        logger.info(f"🧾 {self.job} 逐行结果汇总（共 {total} 条，省略输出 {self.suppressed} 条）")
+        for outcome, n in self.outcomes.most_common():
+            logger.info(f"  {outcome:<10}: {n}")
+        for reason, n in self.reasons.most_common(top):
+            logger.info(f"  ❌ {reason}: {n} ({n / max(total, 1) * 100:.1f}%)")
+
+    def close(self):
+        if self._detail is not None:
+            self._detail.close()
+            logger.info(f"📄 逐行明细已写入: {self._detail.path}")
+        self.summary()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,43 @@
+"""
+可复现的数据生成：同一个 seed 得到完全相同的数据，与批大小、进程数无关
+
+    seeded = SeededRows(seed=42)
+    for shard, start, end in seeded.shards(total):
+        rng = seeded.rng(shard)                    # 分片自己的随机数流（numpy Generator）
+        for i in range(start, end):
+            device_id = str(seeded.uuid(i, "device"))   # 由 seed + 行号 + 用途派生
+
+- 行号按固定的 shard_size 划分分片，分片 k 的随机数流来自 SeedSequence(seed, spawn_key=(k,))，
+  即 SeedSequence(seed).spawn(k + 1)[k]；任意进程可直接取得第 k 个分片的流，不依赖其它分片的生成
+- 分片内的随机数按行顺序消耗，所以同一数据集的分片大小必须固定（默认 SHARD_SIZE），写库批大小可以任意
+- UUID 为 uuid5(命名空间, "seed:用途:行号")，与分片、生成顺序无关
+- seed=None 时每个分片使用新的随机种子、uuid() 退回 uuid4()，与未加种子时一致
+"""
+import uuid
+import numpy as np
+
+SHARD_SIZE = 10000
+
+_UUID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "generatedata")
+
+
+class SeededRows:
+    def __init__(self, seed=None, shard_size=SHARD_SIZE):
+        self.seed = seed
+        self.shard_size = shard_size
+
+    def shards(self, total):
+        """按分片大小切分行号区间 [0, total)，依次产出 (分片号, 起始行号, 结束行号)"""
+        for shard, start in enumerate(range(0, total, self.shard_size)):
+            yield shard, start, min(start + self.shard_size, total)
+
+    def rng(self, shard):
+        if self.seed is None:
+            return np.random.default_rng()
+        return np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=(shard,)))
+
+    def uuid(self, index, kind="row"):
+        """第 index 行用于 kind（如 "device"、"asset_bind"）的 UUID"""
+        if self.seed is None:
+            return uuid.uuid4()
+        return uuid.uuid5(_UUID_NAMESPACE, f"{self.seed}:{kind}:{index}")
@@ -2,6 +2,10 @@ import pandas as pd
 import urllib.parse
 from sqlalchemy import create_engine, text
 from difflib import SequenceMatcher
+from batch_controller import AdaptiveBatchController
+from job_metrics import JobMetrics, stage, add_time
+from row_log import RowReporter
+from region_snapshot import normalize_level, LEVEL_PROVINCE, LEVEL_CITY, LEVEL_AREA
 import time
 
 # === 数据库配置 ===
@@ -30,33 +34,106 @@ with engine.connect() as conn:
     current_db = conn.execute(text("SELECT current_database(), current_user")).fetchone()
     print(f"✅ 已连接到数据库: {current_db[0]} 用户: {current_db[1]}")
 
-# === 读取数据 ===
-geo_df = pd.read_sql("SELECT id, province, city, district FROM geo_centers", engine)
-region_df = pd.read_sql("SELECT id, parent_id, name_en, level FROM alabo_region", engine)
+# === 运行配置 ===
+BATCH_MODE = True       # True: 内存批量匹配 + 分块批量更新；False: 逐条匹配、逐条事务
+CHUNK_SIZE = 1000       # 批量模式每块更新的初始记录数（之后自适应调整）
+MATCH_THRESHOLD = 0.5   # 低于该匹配度视为匹配不可靠
+GLOBAL_FALLBACK = True  # 上级范围内匹配度低于阈值时，是否退回该层级全局搜索
 
-print(f"📍 geo_centers 共 {len(geo_df)} 条数据")
-print(f"📍 alabo_region 共 {len(region_df)} 条数据")
 
-# === 构建区域层级 ===
-provinces = region_df[region_df["level"] == 1][["id", "name_en"]]
-cities = region_df[region_df["level"] == 2][["id", "name_en", "parent_id"]]
-districts = region_df[region_df["level"] == 3][["id", "name_en", "parent_id"]]
+# === 模糊匹配函数 ===
+def normalize_name(name):
+    if not isinstance(name, str):
+        return ""
+    return name.strip().lower()
 
 
-# === 模糊匹配函数 ===
 def best_match(name, candidates):
-    """返回最相似的ID和匹配度"""
-    if not isinstance(name, str) or not name.strip():
+    """
+    返回最相似的ID和匹配度
+    candidates: [(id, 规范化名称), ...]，名称完全一致时直接命中
+    """
+    name = normalize_name(name)
+    if not name:
         return None, 0
-    name = name.strip().lower()
     best_score, best_id = 0, None
-    for _, row in candidates.iterrows():
-        score = SequenceMatcher(None, name, str(row["name_en"]).lower()).ratio()
+    for cand_id, cand_name in candidates:
+        if cand_name == name:
+            return cand_id, 1.0
+        score = SequenceMatcher(None, name, cand_name).ratio()
         if score > best_score:
-            best_score, best_id = score, row["id"]
+            best_score, best_id = score, cand_id
     return best_id, best_score
 
 
+class RegionNameIndex:
+    """alabo_region 名称索引：名称预先规范化，并按 parent_id 分组便于逐级约束匹配"""
+
+    def __init__(self, region_df):
+        self.by_level = {}
+        self.children = {}
+        self.parent_of = {}
+        self.names = {}
+        skipped = 0
+        for row in region_df.itertuples(index=False):
+            # level 可能是 1 / '1' / 'province'，统一为 1 省 / 2 市 / 3 区，无法识别的跳过
+            level = normalize_level(row.level)
+            if not level:
+                skipped += 1
+                continue
+            entry = (row.id, normalize_name(str(row.name_en)))
+            self.by_level.setdefault(level, []).append(entry)
+            self.children.setdefault((level, row.parent_id), []).append(entry)
+            self.parent_of[row.id] = row.parent_id
+            self.names[row.id] = entry[1]
+        if skipped:
+            print(f"⚠️ alabo_region 中 {skipped} 条记录的 level 无法识别，已跳过")
+
+    def candidates(self, level, parent_id=None):
+        """有上级时只返回该上级下的子区域，否则返回该层级全部区域"""
+        if parent_id is None:
+            return self.by_level.get(level, [])
+        return self.children.get((level, parent_id), [])
+
+    def match_level(self, name, level, parent_id=None, threshold=MATCH_THRESHOLD, fallback=GLOBAL_FALLBACK):
+        """
+        在上级区域的子区域中匹配；匹配度低于 threshold 且允许 fallback 时，
+        再在该层级全局搜索，取两者中更好的结果
+        """
+        best_id, best_score = best_match(name, self.candidates(level, parent_id))
+        if parent_id is not None and best_score < threshold and fallback:
+            global_id, global_score = best_match(name, self.candidates(level))
+            if global_score > best_score:
+                best_id, best_score = global_id, global_score
+        return best_id, best_score
+
+    def score(self, name, region_id):
+        """输入名称与指定区域名称的匹配度"""
+        name, region_name = normalize_name(name), self.names.get(region_id)
+        if not name or region_name is None:
+            return 0
+        return 1.0 if name == region_name else SequenceMatcher(None, name, region_name).ratio()
+
+    def match(self, province, city, district, threshold=MATCH_THRESHOLD, fallback=GLOBAL_FALLBACK):
+        """
+        省 → 市（仅该省下） → 区（仅该市下）逐级匹配
+        全局退回命中了其它上级下的区域时，上级改为该区域实际的上级（匹配度按输入名称重新计算），
+        保证返回的省 / 市 / 区始终属于同一条层级链
+        """
+        p_id, p_score = self.match_level(province, LEVEL_PROVINCE)
+        c_id, c_score = self.match_level(city, LEVEL_CITY, p_id, threshold, fallback)
+        if c_id is not None and self.parent_of.get(c_id) != p_id:
+            p_id = self.parent_of.get(c_id)
+            p_score = self.score(province, p_id)
+        r_id, r_score = self.match_level(district, LEVEL_AREA, c_id, threshold, fallback)
+        if r_id is not None and self.parent_of.get(r_id) != c_id:
+            c_id = self.parent_of.get(r_id)
+            c_score = self.score(city, c_id)
+            p_id = self.parent_of.get(c_id)
+            p_score = self.score(province, p_id)
+        return p_id, p_score, c_id, c_score, r_id, r_score
+
+
 # === 更新语句 ===
 update_sql = text("""
     UPDATE geo_centers
@@ -66,45 +143,135 @@ update_sql = text("""
     WHERE id = :id
 """)
 
-total = len(geo_df)
-updated_count = 0
-start_time = time.time()
-
-print(f"\n🔄 开始逐条匹配并实时更新（强制更新最相似项）...\n")
-
-# === 修改为每条记录独立事务 ===
-for i, row in geo_df.iterrows():
-    # 为每条记录创建独立连接和事务
-    with engine.begin() as conn:
-        # 匹配省、市、区
-        p_id, p_score = best_match(row["province"], provinces)
-        c_id, c_score = best_match(row["city"], cities)
-        r_id, r_score = best_match(row["district"], districts)
-
-        # 强制更新（取最相似项），None 表示匹配不到
-        conn.execute(update_sql, {
-            "province_id": int(p_id) if p_id else None,
-            "city_id": int(c_id) if c_id else None,
-            "region_id": int(r_id) if r_id else None,
-            "id": int(row["id"])
-        })
-
-    updated_count += 1
-
-    # 匹配度低于 0.5 警告
-    warn_flag = "⚠️" if min(p_score, c_score, r_score) < 0.5 else "✅"
-
-    # 实时日志输出
-    print(
-        f"[{i + 1}/{total}] {warn_flag} 更新ID={row['id']} | "
-        f"省:{row['province']}({p_score:.2f}→{p_id}), "
-        f"市:{row['city']}({c_score:.2f}→{c_id}), "
-        f"区:{row['district']}({r_score:.2f}→{r_id})"
-    )
-
-    # 可选：每 100 条暂停 0.1 秒，降低数据库压力
-    if (i + 1) % 100 == 0:
-        time.sleep(0.1)
-
-elapsed = round(time.time() - start_time, 2)
-print(f"\n🎯 全部匹配并实时更新完成！共更新 {updated_count} 条记录 ✅，耗时 {elapsed} 秒")
\ No newline at end of file
+
+def to_int(value):
+    return int(value) if value else None
+
+
+def bulk_update(conn, rows):
+    """一条 UPDATE ... FROM (VALUES ...) 更新整块记录"""
+    values, params = [], {}
+    for i, row in enumerate(rows):
+        values.append(f"(CAST(:id_{i} AS BIGINT), CAST(:p_{i} AS BIGINT), "
+                      f"CAST(:c_{i} AS BIGINT), CAST(:r_{i} AS BIGINT))")
+        params.update({f"id_{i}": row["id"], f"p_{i}": row["province_id"],
+                       f"c_{i}": row["city_id"], f"r_{i}": row["region_id"]})
+    conn.execute(text(f"""
+        UPDATE geo_centers AS g
+        SET province_id = v.province_id,
+            city_id = v.city_id,
+            region_id = v.region_id
+        FROM (VALUES {", ".join(values)}) AS v(id, province_id, city_id, region_id)
+        WHERE g.id = v.id
+    """), params)
+
+
+def run_row_by_row(geo_df, region_df):
+    """逐条匹配并实时更新，每条记录独立事务"""
+    index = RegionNameIndex(region_df)
+    total = len(geo_df)
+    updated_count = 0
+
+    # 只用于节流：提交耗时出现尖刺或出错时退避，不再每 100 条固定暂停
+    controller = AdaptiveBatchController(initial=1, min_size=1, max_size=1, name="逐条更新")
+
+    print(f"\n🔄 开始逐条匹配并实时更新（强制更新最相似项）...\n")
+
+    reporter = RowReporter("match_geo_centers")
+    for i, row in geo_df.iterrows():
+        # 为每条记录创建独立连接和事务
+        with controller.measure(1), engine.begin() as conn:
+            # 逐级匹配省、市、区
+            p_id, p_score, c_id, c_score, r_id, r_score = index.match(row["province"], row["city"], row["district"])
+
+            # 强制更新（取最相似项），None 表示匹配不到
+            conn.execute(update_sql, {
+                "province_id": to_int(p_id),
+                "city_id": to_int(c_id),
+                "region_id": to_int(r_id),
+                "id": int(row["id"])
+            })
+
+        updated_count += 1
+
+        # 匹配度低于阈值警告（安静模式下抽样输出，低匹配度按层级汇总）
+        low_score = min(p_score, c_score, r_score)
+        warn_flag = "⚠️" if low_score < MATCH_THRESHOLD else "✅"
+        message = (
+            f"[{i + 1}/{total}] {warn_flag} 更新ID={row['id']} | "
+            f"省:{row['province']}({p_score:.2f}→{p_id}), "
+            f"市:{row['city']}({c_score:.2f}→{c_id}), "
+            f"区:{row['district']}({r_score:.2f}→{r_id})"
+        )
+        if low_score < MATCH_THRESHOLD:
+            level = "省" if p_score == low_score else "市" if c_score == low_score else "区"
+            reporter.fail(f"{level}级匹配度低于 {MATCH_THRESHOLD}", message, outcome="低匹配度")
+        else:
+            reporter.ok(message)
+
+    reporter.close()
+    return updated_count
+
+
+def run_batch(geo_df, region_df, chunk_size=CHUNK_SIZE):
+    """
+    批量模式：全部在内存中逐级匹配（相同的省/市/区组合只算一次），每块一条 UPDATE、一个事务
+    chunk_size 为初始块大小，之后按提交耗时自适应调整
+    """
+    index = RegionNameIndex(region_df)
+    cache = {}
+    total = len(geo_df)
+    updated_count = 0
+    low_score_count = 0
+
+    controller = AdaptiveBatchController(initial=chunk_size, max_size=chunk_size * 10, name="批量更新")
+
+    print(f"\n🔄 开始批量匹配（初始每块 {chunk_size} 条，一次更新）...\n")
+
+    for chunk in controller.split(geo_df):
+        match_start = time.perf_counter()
+        rows = []
+        for row in chunk.itertuples(index=False):
+            key = (row.province, row.city, row.district)
+            if key not in cache:
+                cache[key] = index.match(*key)
+            p_id, p_score, c_id, c_score, r_id, r_score = cache[key]
+            if min(p_score, c_score, r_score) < MATCH_THRESHOLD:
+                low_score_count += 1
+            rows.append({"id": int(row.id), "province_id": to_int(p_id),
+                         "city_id": to_int(c_id), "region_id": to_int(r_id)})
+        add_time("match", time.perf_counter() - match_start)
+
+        with controller.measure(len(rows)), engine.begin() as conn:
+            bulk_update(conn, rows)
+
+        updated_count += len(rows)
+        print(f"[{updated_count}/{total}] ✅ 已更新一块 {len(rows)} 条 | 匹配度低于 {MATCH_THRESHOLD}: {low_score_count} 条")
+
+    print(f"📦 不同地址组合: {len(cache)} 个")
+    print(f"📈 {controller.summary()}")
+    return updated_count
+
+
+def main():
+    # === 读取数据 ===
+    with stage("db_read"):
+        geo_df = pd.read_sql("SELECT id, province, city, district FROM geo_centers", engine)
+        region_df = pd.read_sql("SELECT id, parent_id, name_en, level FROM alabo_region", engine)
+
+    print(f"📍 geo_centers 共 {len(geo_df)} 条数据")
+    print(f"📍 alabo_region 共 {len(region_df)} 条数据")
+
+    start_time = time.time()
+    if BATCH_MODE:
+        updated_count = run_batch(geo_df, region_df)
+    else:
+        updated_count = run_row_by_row(geo_df, region_df)
+
+    elapsed = round(time.time() - start_time, 2)
+    print(f"\n🎯 全部匹配并更新完成！共更新 {updated_count} 条记录 ✅，耗时 {elapsed} 秒")
+
+
+if __name__ == "__main__":
+    with JobMetrics("match_geo_centers"):
+        main()
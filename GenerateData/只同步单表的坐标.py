@@ -1,23 +1,26 @@
 import pandas as pd
 import random
 import math
-import re
 from sqlalchemy import text
-from dbhelp import engine
+from dbhelp import engine, stream_mappings, count_rows
+from address_normalizer import clean_string, build_geo_index
+from batch_controller import AdaptiveBatchController
+from batch_retry import write_with_bisect
 from difflib import SequenceMatcher
 from tqdm import tqdm
+import os
 import time
 import logging
+from match_pool import parallel_match
+from job_metrics import JobMetrics, stage, count, tick, timed
+from row_log import RowReporter
 
 # === 日志配置 ===
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-
-def clean_string(s):
-    if not isinstance(s, str):
-        return ""
-    return re.sub(r"[^\w\s]", "", s.strip().lower())
+# === 并行匹配进程数（1 表示在主进程内顺序执行）===
+WORKERS = os.cpu_count()
 
 
 def similarity(a, b):
@@ -35,24 +38,6 @@ def random_point_within_radius(lat_center, lon_center, radius_km):
     return round(lat, 6), round(lon, 6)  # ✅ 保留6位小数
 
 
-def build_geo_index(geo_df):
-    geo_index = {}
-    for _, row in geo_df.iterrows():
-        province = clean_string(row['Region'])
-        city = clean_string(row['City'])
-        district = clean_string(row['district'])
-        lat = row['latitude']
-        lon = row['longitude']
-        if province not in geo_index:
-            geo_index[province] = {}
-        if city not in geo_index[province]:
-            geo_index[province][city] = {}
-        if district not in geo_index[province][city]:
-            geo_index[province][city][district] = []
-        geo_index[province][city][district].append((lat, lon))
-    return geo_index
-
-
 def match_address(province, city, district, geo_index):
     best_province, best_province_score = None, 0
     for prov in geo_index.keys():
@@ -113,53 +98,88 @@ def batch_update_mysql(conn, update_batch):
     conn.execute(text(sql))
 
 
-def main():
-    logger.info("📥 加载地理地址数据...")
-    geo_df = pd.read_csv("GeoAdministrativeUnitsnew.csv")
-    geo_index = build_geo_index(geo_df)
-    logger.info("🌐 地址索引构建完成")
+def match_device(row, geo_index):
+    """在子进程中执行：清洗地址、匹配并生成坐标，返回 (meter_id, 坐标或 None, 匹配信息)"""
+    province = clean_string(row['province_name'])
+    city = clean_string(row['city_name'])
+    district = clean_string(row['region_name'])
+
+    match_result, info = match_address(province, city, district, geo_index)
+    if match_result:
+        return row['meter_id'], random_point_within_radius(match_result[0], match_result[1], radius_km=10), info
+    return row['meter_id'], None, info
 
-    logger.info("📥 读取设备数据...")
+
+def main(workers=WORKERS, batch_size=100):
+    with stage("load_geo"):
+        logger.info("📥 加载地理地址数据...")
+        geo_df = pd.read_csv("GeoAdministrativeUnitsnew.csv")
+        geo_index = build_geo_index(geo_df)
+        logger.info("🌐 地址索引构建完成")
+
+    # 只取匹配需要的列，服务端游标流式读取
+    device_query = text("""
+        SELECT meter_id, province_name, city_name, region_name
+        FROM dev_meter_id
+        WHERE latitude IS NULL OR longitude IS NULL
+    """)
     with engine.connect() as conn:
-        devices = conn.execute(text("SELECT * FROM dev_meter_id where latitude is null or longitude is null")).mappings().all()
-    logger.info(f"📦 总设备数: {len(devices)}")
+        total = count_rows(conn, device_query)
+    logger.info(f"📦 总设备数: {total}")
 
     update_batch = []
-    batch_size = 100
+    controller = AdaptiveBatchController(initial=batch_size, name="坐标回写")
     stats = {
         'matched': 0,
         'match_fail': 0,
         'update_fail': 0,
-        'total': len(devices),
+        'total': total,
         'start_time': time.time()
     }
 
-    logger.info("🚀 开始处理和匹配地址...")
-    with engine.begin() as conn:
-        for idx, row in enumerate(tqdm(devices, desc="处理设备", unit="条"), 1):
-            meter_id = row['meter_id']
-            province = clean_string(row['province_name'])
-            city = clean_string(row['city_name'])
-            district = clean_string(row['region_name'])
-
-            match_result, info = match_address(province, city, district, geo_index)
-            if match_result:
-                lat, lon = random_point_within_radius(match_result[0], match_result[1], radius_km=10)
+    def flush(conn):
+        if not update_batch:
+            return
+
+        def write(batch):
+            try:
+                batch_update_mysql(conn, batch)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+        # 整批失败时对半拆分定位坏行，锁超时/死锁退避重试
+        _, failed = write_with_bisect(write, update_batch, controller=controller)
+        for item, error in failed:
+            stats['update_fail'] += 1
+            logger.error(f"❌ 更新失败 | meter_id: {item['meter_id']} | 错误: {error}")
+        update_batch.clear()
+
+    logger.info(f"🚀 开始处理和匹配地址（{workers} 个进程）...")
+    with engine.connect() as read_conn, engine.connect() as conn, \
+            RowReporter("sync_meter_coords", write=tqdm.write) as reporter:
+        devices = stream_mappings(read_conn, device_query)
+        results = parallel_match((dict(row) for row in devices), match_device, geo_index, workers=workers)
+        for meter_id, point, info in tqdm(timed(results, "read_match"), total=total, desc="处理设备", unit="条"):
+            if point:
+                lat, lon = point
                 update_batch.append({'meter_id': meter_id, 'lat': lat, 'lon': lon})
                 stats['matched'] += 1
-                tqdm.write(f"✅ 匹配成功 | meter_id: {meter_id} | 匹配度: {info['score'] * 100:.1f}% | 坐标: ({lat}, {lon})")
+                count("rows_matched")
+                reporter.ok(f"✅ 匹配成功 | meter_id: {meter_id} | 匹配度: {info['score'] * 100:.1f}% | 坐标: ({lat}, {lon})")
             else:
                 stats['match_fail'] += 1
-                tqdm.write(f"❌ 匹配失败 | meter_id: {meter_id} | 原因: {info['fail_reason']}")
+                count("match_fail")
+                reporter.fail(info['fail_reason'], f"❌ 匹配失败 | meter_id: {meter_id} | 原因: {info['fail_reason']}")
+
+            if len(update_batch) >= controller.size:
+                flush(conn)
+            tick()
 
-            if len(update_batch) >= batch_size or idx == len(devices):
-                try:
-                    batch_update_mysql(conn, update_batch)
-                except Exception as e:
-                    stats['update_fail'] += len(update_batch)
-                    logger.error(f"❌ 批量更新失败: {str(e)}")
-                update_batch = []
+        flush(conn)
 
+    logger.info(controller.summary())
     duration = time.time() - stats['start_time']
     logger.info(f"\n✅ 全部完成，耗时: {duration:.2f} 秒")
     logger.info(f"📊 匹配成功: {stats['matched']}")
@@ -169,4 +189,5 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    with JobMetrics("sync_meter_coords"):
+        main()
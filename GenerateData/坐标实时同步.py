@@ -0,0 +1,333 @@
+"""
+常驻的坐标同步进程：dev_meter_id 的省 / 市 / 区变化后，几秒内把匹配出的坐标同步到
+dev_meter_id、dev_device_instance、device_latest_report_message 三张表
+
+    python 坐标实时同步.py --install      # 首次运行：PostgreSQL 安装触发器；MySQL 增加 updated_at 列与索引
+    python 坐标实时同步.py                # 常驻运行，Ctrl+C 退出
+
+- PostgreSQL：触发器在地址列变化时 pg_notify('meter_address_changed', meter_id)，本进程 LISTEN 接收
+- MySQL：按 (updated_at, meter_id) 轮询。updated_at 是语句执行时间而非提交时间，提交较晚的变更可能落在
+  已扫描过的水位之前，所以每一轮从 最新水位 - overlap_seconds 重新扫描，已产出过的 (meter_id, updated_at) 跳过；
+  从执行到提交超过 overlap_seconds 秒（--overlap，默认 60）的事务仍会漏掉
+- 变更按 meter_id 去重后攒成小批（batch_size 条或最多等待 max_delay 秒），匹配逻辑与三表更新复用
+  重置上报表中的坐标信息.py，并与其增量模式共用 coord_sync_state：地址哈希未变的 meter 直接跳过，
+  本进程自己回写坐标触发的 updated_at 变化因此不会重复匹配；匹配失败的 meter 同样记录（matched = false），
+  地址不变时不再重复匹配
+- 单批同步出错（如连接断开）时记录日志，这批 meter 留到下一轮重试；监听 / 轮询连接断开后等待 RECONNECT_DELAY 秒重连：
+  MySQL 从原水位继续轮询；PostgreSQL 断开期间的通知会丢失，重连后按地址哈希补查一次（同增量模式的条件），
+  补查按 meter_id 分页（每页 batch_size 个），不会一次性加载全部候选
+- 进程未运行期间的变更不会补发，启动前可先执行一次 重置上报表中的坐标信息.py --incremental --limit 0
+"""
+import argparse
+import logging
+import select
+import time
+from contextlib import closing
+from datetime import timedelta
+import pandas as pd
+from sqlalchemy import text, bindparam
+from dbhelp import engine
+from address_normalizer import clean_string, build_geo_index
+from batch_controller import AdaptiveBatchController
+from batch_retry import write_with_bisect
+from job_metrics import JobMetrics, stage, count, tick
+from 重置上报表中的坐标信息 import (
+    ADDRESS_HASH_SQL, batch_update_mysql, ensure_sync_state, match_address, random_point_within_radius,
+    save_sync_state,
+)
+
+# === 日志配置 ===
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "meter_address_changed"
+WATERMARK_COLUMN = "updated_at"
+# MySQL 轮询每轮回看的秒数，应大于 dev_meter_id 更新事务从执行到提交的最长时间
+OVERLAP_SECONDS = 60
+# 连接断开后的重连等待秒数；单批同步失败后同样等待该时长再重试
+RECONNECT_DELAY = 5.0
+
+# === 变更捕获安装 ===
+PG_INSTALL_SQL = [
+    f"""
+    CREATE OR REPLACE FUNCTION notify_meter_address_change() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT'
+           OR NEW.province_name IS DISTINCT FROM OLD.province_name
+           OR NEW.city_name IS DISTINCT FROM OLD.city_name
+           OR NEW.region_name IS DISTINCT FROM OLD.region_name THEN
+            PERFORM pg_notify('{NOTIFY_CHANNEL}', CAST(NEW.meter_id AS TEXT));
+        END IF;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS trg_meter_address_change ON dev_meter_id",
+    """
+    CREATE TRIGGER trg_meter_address_change
+    AFTER INSERT OR UPDATE OF province_name, city_name, region_name ON dev_meter_id
+    FOR EACH ROW EXECUTE PROCEDURE notify_meter_address_change()
+    """,
+]
+
+MYSQL_INSTALL_SQL = [
+    f"""
+    ALTER TABLE dev_meter_id
+    ADD COLUMN {WATERMARK_COLUMN} TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3) ON UPDATE CURRENT_TIMESTAMP(3),
+    ADD INDEX idx_dev_meter_id_{WATERMARK_COLUMN} ({WATERMARK_COLUMN}, meter_id)
+    """,
+]
+
+# 变更 meter 对应的设备，只保留地址哈希与上次同步不同的
+CHANGED_DEVICES_SQL = text(f"""
+    SELECT d.id AS device_id, m.meter_id, m.province_name, m.city_name, m.region_name,
+           {ADDRESS_HASH_SQL} AS address_hash
+    FROM dev_meter_id m
+    JOIN dev_device_instance d ON d.second_id = m.meter_id
+    LEFT JOIN coord_sync_state s ON s.meter_id = m.meter_id
+    WHERE m.meter_id IN :meter_ids
+      AND m.province_name IS NOT NULL
+      AND m.city_name IS NOT NULL
+      AND (s.meter_id IS NULL OR s.address_hash <> {ADDRESS_HASH_SQL})
+""").bindparams(bindparam("meter_ids", expanding=True))
+
+# PostgreSQL 重连后补查：有设备、且地址哈希与上次处理时不同（或从未处理过）的 meter，按 meter_id 分页
+CATCH_UP_SQL = text(f"""
+    SELECT m.meter_id
+    FROM dev_meter_id m
+    LEFT JOIN coord_sync_state s ON s.meter_id = m.meter_id
+    WHERE m.meter_id > :after
+      AND m.province_name IS NOT NULL
+      AND m.city_name IS NOT NULL
+      AND (s.meter_id IS NULL OR s.address_hash <> {ADDRESS_HASH_SQL})
+      AND EXISTS (SELECT 1 FROM dev_device_instance d WHERE d.second_id = m.meter_id)
+    ORDER BY m.meter_id
+    LIMIT :limit
+""")
+
+MYSQL_POLL_SQL = text(f"""
+    SELECT meter_id, {WATERMARK_COLUMN} AS changed_at
+    FROM dev_meter_id
+    WHERE ({WATERMARK_COLUMN} > :ts OR ({WATERMARK_COLUMN} = :ts AND meter_id > :meter_id))
+    ORDER BY {WATERMARK_COLUMN}, meter_id
+    LIMIT :limit
+""")
+
+
+def install(conn):
+    if conn.dialect.name == "postgresql":
+        for sql in PG_INSTALL_SQL:
+            conn.execute(text(sql))
+        logger.info(f"✅ 已安装触发器 trg_meter_address_change（通知频道 {NOTIFY_CHANNEL}）")
+    else:
+        columns = conn.execute(text("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = 'dev_meter_id'
+        """)).scalars().all()
+        if WATERMARK_COLUMN in {c.lower() for c in columns}:
+            logger.info(f"dev_meter_id 已有 {WATERMARK_COLUMN} 列，跳过")
+        else:
+            for sql in MYSQL_INSTALL_SQL:
+                conn.execute(text(sql))
+            logger.info(f"✅ 已为 dev_meter_id 增加 {WATERMARK_COLUMN} 列及索引")
+    conn.commit()
+
+
+# === 变更来源：逐批产出发生变化的 meter_id 列表（空闲时产出空列表，便于调用方重试失败的批次） ===
+def listen_changes(batch_size, max_delay, catch_up=False):
+    """
+    PostgreSQL：LISTEN 通知，同一 meter 的多次通知在一批内去重
+    catch_up=True（断线重连）时，开始监听后先按地址哈希补查断开期间可能漏掉的 meter
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"LISTEN {NOTIFY_CHANNEL}"))
+        pg = conn.connection.driver_connection  # psycopg2 连接：poll() 后从 notifies 取通知
+        logger.info(f"👂 正在监听 {NOTIFY_CHANNEL} ...")
+        if catch_up:
+            missed, after = 0, ""
+            while True:
+                page = conn.execute(CATCH_UP_SQL, {"after": after, "limit": batch_size}).scalars().all()
+                if not page:
+                    break
+                missed += len(page)
+                after = page[-1]
+                yield page
+            logger.info(f"🔎 重连补查完成：{missed} 个 meter 的地址哈希与上次同步不同")
+        pending, first_at = set(), None
+        try:
+            while True:
+                wait = max_delay if first_at is None else max(0.0, first_at + max_delay - time.monotonic())
+                if select.select([pg], [], [], wait)[0]:
+                    pg.poll()
+                    while pg.notifies:
+                        pending.add(pg.notifies.pop(0).payload)
+                        first_at = first_at or time.monotonic()
+                if pending and (len(pending) >= batch_size or time.monotonic() - first_at >= max_delay):
+                    yield sorted(pending)
+                    pending, first_at = set(), None
+                elif not pending:
+                    yield []
+        finally:
+            if not conn.invalidated:
+                conn.execute(text("UNLISTEN *"))
+
+
+def poll_changes(batch_size, poll_interval, overlap_seconds=OVERLAP_SECONDS, state=None):
+    """
+    MySQL：按 (updated_at, meter_id) 分页轮询，从启动时的最新变更之后开始
+    每一轮从 最新水位 - overlap_seconds 重新扫描，补上提交较晚的变更；已产出过的 (meter_id, updated_at) 不重复产出
+    state: 水位与已产出记录，断线重连时传入同一个 dict 即可从原水位继续
+    """
+    overlap = timedelta(seconds=overlap_seconds)
+    state = {} if state is None else state
+    with engine.connect() as conn:
+        if "high_water" not in state:
+            state["high_water"] = conn.execute(text(
+                f"SELECT COALESCE(MAX({WATERMARK_COLUMN}), CURRENT_TIMESTAMP(3)) FROM dev_meter_id")).scalar()
+            state["seen"] = {}  # meter_id -> 已产出的 updated_at，只保留回看窗口内的
+            conn.rollback()
+        logger.info(f"🔁 轮询 dev_meter_id.{WATERMARK_COLUMN}，起始水位 {state['high_water']}，每轮回看 {overlap_seconds} 秒")
+        while True:
+            since = state["high_water"] - overlap
+            seen = state["seen"] = {meter_id: changed_at for meter_id, changed_at in state["seen"].items()
+                                    if changed_at >= since}
+            ts, meter_id = since, ""
+            while True:
+                rows = conn.execute(MYSQL_POLL_SQL, {"ts": ts, "meter_id": meter_id, "limit": batch_size}).fetchall()
+                # 结束读事务，下一次轮询能看到新提交的数据
+                conn.rollback()
+                if rows:
+                    ts, meter_id = rows[-1].changed_at, rows[-1].meter_id
+                    state["high_water"] = max(state["high_water"], ts)
+                changed = [row.meter_id for row in rows if seen.get(row.meter_id) != row.changed_at]
+                seen.update((row.meter_id, row.changed_at) for row in rows)
+                if changed:
+                    yield changed
+                if len(rows) < batch_size:
+                    break
+            yield []
+            time.sleep(poll_interval)
+
+
+# === 同步一批变更 ===
+def resolve(row, geo_index):
+    """与 重置上报表中的坐标信息.py 相同的匹配：成功返回 (lat, lon)，失败返回 None"""
+    province = clean_string(row['province_name'])
+    city = clean_string(row['city_name'])
+    district = clean_string(row['region_name'])
+    result, _, _ = match_address(province, city, district, geo_index)
+    if result:
+        return random_point_within_radius(result[0], result[1], radius_km=10)
+    return None
+
+
+def sync_meters(conn, meter_ids, geo_index, controller):
+    with stage("db_read"):
+        rows = conn.execute(CHANGED_DEVICES_SQL, {"meter_ids": meter_ids}).mappings().all()
+        conn.rollback()
+
+    update_batch, unmatched = [], []
+    with stage("match"):
+        for row in rows:
+            point = resolve(row, geo_index)
+            item = {'device_id': row['device_id'], 'meter_id': row['meter_id'], 'address_hash': row['address_hash']}
+            if point:
+                item['lat'], item['lon'] = point
+                update_batch.append(item)
+            else:
+                unmatched.append(item)
+
+    def write(batch):
+        try:
+            batch_update_mysql(conn, batch)
+            save_sync_state(conn, batch)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    written, failed = write_with_bisect(write, update_batch, controller=controller) if update_batch else (0, [])
+    for item, error in failed:
+        logger.error(f"❌ 更新失败 | meter_id: {item['meter_id']} | 错误: {error}")
+
+    if unmatched:
+        # 匹配失败也记录地址哈希，地址不变时不再重复匹配（重连补查同样跳过）
+        try:
+            save_sync_state(conn, unmatched, matched=False)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    count("meters_changed", len(meter_ids))
+    count("match_fail", len(unmatched))
+    tick()
+    return len(rows), written, len(unmatched), len(failed)
+
+
+def main(batch_size=500, max_delay=1.0, poll_interval=1.0, overlap_seconds=OVERLAP_SECONDS, install_capture=False):
+    with engine.connect() as conn:
+        ensure_sync_state(conn)
+        if install_capture:
+            install(conn)
+        dialect = conn.dialect.name
+
+    with stage("load_geo"):
+        logger.info("⏳ 开始读取地理地址数据...")
+        geo_index = build_geo_index(pd.read_csv('GeoAdministrativeUnitsnew.csv'))
+
+    controller = AdaptiveBatchController(initial=100, name="坐标实时同步")
+    retry = set()     # 同步失败、等待下一轮重试的 meter
+    poll_state = {}   # MySQL 轮询水位，重连后沿用
+    reconnect = False
+    while True:
+        try:
+            if dialect == "postgresql":
+                changes = listen_changes(batch_size, max_delay, catch_up=reconnect)
+            else:
+                changes = poll_changes(batch_size, poll_interval, overlap_seconds, poll_state)
+            with engine.connect() as conn, closing(changes):
+                for meter_ids in changes:
+                    reconnect = False
+                    meter_ids = sorted(retry.union(meter_ids))
+                    if not meter_ids:
+                        continue
+                    start = time.perf_counter()
+                    try:
+                        devices, written, unmatched, failed = sync_meters(conn, meter_ids, geo_index, controller)
+                    except Exception as e:
+                        # 读库、回写或连接出错：这批 meter 留到下一轮重试；回滚后连接在下次使用时自动重连
+                        retry.update(meter_ids)
+                        count("sync_errors")
+                        logger.error(f"❌ {len(meter_ids)} 个 meter 同步失败，{RECONNECT_DELAY:.0f} 秒后重试: {e}")
+                        conn.rollback()
+                        time.sleep(RECONNECT_DELAY)
+                        continue
+                    retry.clear()
+                    logger.info(f"🔄 {len(meter_ids)} 个 meter 地址变化 | 设备 {devices} 条：更新 {written}，"
+                                f"匹配失败 {unmatched}，写入失败 {failed}，跳过 {len(meter_ids) - devices}（地址未变或无设备）"
+                                f" | 耗时 {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            # 监听 / 轮询连接断开：等待后重新建立，PostgreSQL 重连后补查断开期间的变更
+            count("reconnects")
+            logger.error(f"❌ 变更监听中断，{RECONNECT_DELAY:.0f} 秒后重连: {e}")
+            reconnect = True
+            time.sleep(RECONNECT_DELAY)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="监听地址变化，实时同步三张表的坐标")
+    parser.add_argument("--install", action="store_true", help="安装变更捕获（触发器 / updated_at 列）后再启动")
+    parser.add_argument("--batch-size", type=int, default=500, help="每个小批最多的 meter 数")
+    parser.add_argument("--max-delay", type=float, default=1.0, help="PostgreSQL：小批最长等待秒数")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="MySQL：没有新变更时的轮询间隔秒数")
+    parser.add_argument("--overlap", type=float, default=OVERLAP_SECONDS, dest="overlap_seconds",
+                        help="MySQL：每轮回看的秒数，执行到提交超过该时长的事务会被漏掉")
+    args = parser.parse_args()
+
+    try:
+        with JobMetrics("coord_sync_worker"):
+            main(batch_size=args.batch_size, max_delay=args.max_delay, poll_interval=args.poll_interval,
+                 overlap_seconds=args.overlap_seconds, install_capture=args.install)
+    except KeyboardInterrupt:
+        logger.info("用户中断执行")
@@ -1,10 +1,14 @@
+import argparse
 import logging
 import math
-import random
 import time
 import pandas as pd
 from sqlalchemy import text
-from dbhelp import get_engine, DB_CONFIG4
+from dbhelp import get_engine, bulk_insert, resolve_config
+from device_template_helper import sample_template_row, BlockIdAllocator
+from region_snapshot import load_regions, load_polygon_sampler, LEVEL_PROVINCE
+from job_metrics import JobMetrics, stage, add_time, count, tick
+from seeded_rows import SeededRows
 
 # === 日志 ===
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -12,10 +16,10 @@ logger = logging.getLogger(__name__)
 
 
 # === 工具函数 ===
-def random_point(lat_center, lon_center, radius_km=1000):
+def random_point(lat_center, lon_center, rng, radius_km=1000):
     radius_deg = radius_km / 111.0
-    angle = random.uniform(0, 2 * math.pi)
-    r = radius_deg * math.sqrt(random.uniform(0, 1))
+    angle = rng.uniform(0, 2 * math.pi)
+    r = radius_deg * math.sqrt(rng.uniform(0, 1))
     lat = lat_center + r * math.cos(angle)
     lon = lon_center + r * math.sin(angle) / math.cos(math.radians(lat_center))
     return round(lat, 6), round(lon, 6)
@@ -40,7 +44,7 @@ def build_fast_hierarchy(df_region):
     region_dict = df_region.set_index('region_id').to_dict('index')
 
     # 构建层级关系 map: {parent_id: [child_id1, child_id2, ...]}
-    provinces = df_region[df_region['level'].astype(str) == '1']['region_id'].tolist()
+    provinces = df_region[df_region['level'] == LEVEL_PROVINCE]['region_id'].tolist()
 
     # 预先分组，避免在循环中反复筛选 DataFrame
     # group_dict: {parent_id: [child_id_list]}
@@ -53,8 +57,13 @@ def build_fast_hierarchy(df_region):
     }
 
 
+def _choice(rng, items):
+    # 按下标取值，避免 Generator.choice 每次把整个列表转换为数组
+    return items[int(rng.integers(len(items)))]
+
+
 # [优化点2]：使用字典查找代替 Pandas 筛选
-def get_random_location_fast(hierarchy_data):
+def get_random_location_fast(hierarchy_data, rng):
     provinces = hierarchy_data['provinces']
     children_map = hierarchy_data['children_map']
     info = hierarchy_data['info']
@@ -62,19 +71,19 @@ def get_random_location_fast(hierarchy_data):
     if not provinces: return None
 
     # 1. 随机选省
-    prov_id = random.choice(provinces)
+    prov_id = _choice(rng, provinces)
     prov_info = info.get(prov_id)
 
     # 2. 随机选市
     city_ids = children_map.get(prov_id, [])
     if not city_ids: return None
-    city_id = random.choice(city_ids)
+    city_id = _choice(rng, city_ids)
     city_info = info.get(city_id)
 
     # 3. 随机选区
     area_ids = children_map.get(city_id, [])
     if not area_ids: return None
-    area_id = random.choice(area_ids)
+    area_id = _choice(rng, area_ids)
     area_info = info.get(area_id)
 
     # 4. 组合地址
@@ -97,94 +106,121 @@ def get_random_location_fast(hierarchy_data):
     )
 
 
+# === 生成一个分片 ===
+def generate_records(ids, template, hierarchy_data, polygon_sampler, rng):
+    """为给定 ID 依次生成设备记录，所有随机数取自 rng，相同的 rng 状态得到相同的记录"""
+    records = []
+    for new_id_str in ids:
+        loc_data = get_random_location_fast(hierarchy_data, rng)
+
+        # 如果运气不好没随机到有坐标的区域，就重试一次或跳过（这里简单处理为循环直到获取到）
+        while loc_data is None:
+            loc_data = get_random_location_fast(hierarchy_data, rng)
+
+        prov_id, city_id, region_id, addr, lat_c, lon_c = loc_data
+        lat, lon = random_point(lat_c, lon_c, rng, radius_km=100)
+
+        new_row = template.copy()
+        new_row.update({
+            "id": new_id_str,
+            "province_id": prov_id,
+            "city_id": city_id,
+            "region_id": region_id,
+            "install_latitude": lat,
+            "install_longitude": lon,
+            "address": addr,
+            "install_address": addr,
+            "creator_name": "系统生成"
+        })
+        records.append(convert_numpy_types(new_row))
+
+    # 有边界数据的区域，整片在本地多边形内重新取点
+    if polygon_sampler and records:
+        lats, lons = polygon_sampler.sample_many([r["region_id"] for r in records], rng=rng)
+        for record, lat, lon in zip(records, lats, lons):
+            if not math.isnan(lat):
+                record["install_latitude"], record["install_longitude"] = float(lat), float(lon)
+    return records
+
+
 # === 主流程 ===
-def main(add_count=1000000, batch_size=5000):
+def main(add_count=1000000, batch_size=5000, config=None, seed=None):
     logger.info("连接数据库...")
-    engine = get_engine(DB_CONFIG4)
+    engine = get_engine(config or resolve_config())
 
     with engine.connect() as conn:
-        # 1. 获取基础数据
-        max_id = conn.execute(text("SELECT COALESCE(MAX(CAST(id AS BIGINT)), 0) FROM dev_device_instance")).scalar()
-        logger.info(f"当前最大 ID: {max_id}")
-
-        template_row = conn.execute(
-            text("SELECT * FROM dev_device_instance ORDER BY RANDOM() LIMIT 1")).mappings().first()
+        # 1. 获取基础数据（TABLESAMPLE 抽模板行，避免全表排序；ID 按块预留）
+        if seed is not None:
+            # 指定 seed 时固定取主键最小的一行作模板，保证同一 seed 生成的数据一致
+            template_row = conn.execute(text(
+                "SELECT * FROM dev_device_instance ORDER BY id LIMIT 1")).mappings().first()
+        else:
+            template_row = sample_template_row(conn, "dev_device_instance")
         if not template_row:
             return
         template = dict(template_row)
         template.pop("id", None)
 
+        id_allocator = BlockIdAllocator(conn, "dev_device_instance", id_length=len(template_row["id"]),
+                                        block_size=batch_size)
+
         # 2. 加载区域数据并建立索引
+        # 区域按 region_id 排序读取（快照与查库一致），省份列表与子区域列表的顺序固定，同一 seed 选中的区域相同
         logger.info("加载区域数据...")
-        df_region = pd.DataFrame(conn.execute(text(
-            "SELECT region_id, parent_id, name_en, level, latitude, longitude FROM alabo_region")).mappings().all())
+        df_region = load_regions(conn)
 
         # 使用优化后的构建函数
         hierarchy_data = build_fast_hierarchy(df_region)
 
+        # 区域边界（WKB）一次性加载到本地，坐标直接在区边界内生成；库中无 geom 时退回中心点半径随机
+        try:
+            polygon_sampler = load_polygon_sampler(conn)
+        except Exception as e:
+            conn.rollback()
+            logger.warning(f"未加载区域边界，使用中心点半径随机坐标: {e}")
+            polygon_sampler = None
+
         start_time = time.time()
 
-        logger.info(f"开始生成 {add_count} 条数据，分批执行，每批 {batch_size} 条...")
+        # 生成按固定大小的分片进行（指定 seed 时每个分片有独立且可复现的随机数流），写入按 batch_size 分批
+        seeded = SeededRows(seed) if seed is not None else SeededRows(shard_size=batch_size)
+        total_shards = math.ceil(add_count / seeded.shard_size)
+        logger.info(f"开始生成 {add_count} 条数据，共 {total_shards} 个分片，每批写入 {batch_size} 条"
+                    + (f"，seed={seed}" if seed is not None else "") + "...")
 
-        # [优化点3]：外层循环分批，避免内存溢出
         total_inserted = 0
-        id_counter = max_id
-
-        # 计算需要多少个批次
-        total_batches = math.ceil(add_count / batch_size)
-
-        for batch_idx in range(total_batches):
-            batch_start_time = time.time()
-            current_batch_records = []
-
-            # 计算当前批次的大小（最后一批可能不足 batch_size）
-            current_size = min(batch_size, add_count - total_inserted)
-
-            for _ in range(current_size):
-                id_counter += 1
-                id_length = len(template_row["id"])
-                new_id_str = str(id_counter).zfill(id_length)
-
-                loc_data = get_random_location_fast(hierarchy_data)
-
-                # 如果运气不好没随机到有坐标的区域，就重试一次或跳过（这里简单处理为循环直到获取到）
-                while loc_data is None:
-                    loc_data = get_random_location_fast(hierarchy_data)
-
-                prov_id, city_id, region_id, addr, lat_c, lon_c = loc_data
-                lat, lon = random_point(lat_c, lon_c, radius_km=100)
-
-                new_row = template.copy()
-                new_row.update({
-                    "id": new_id_str,
-                    "province_id": prov_id,
-                    "city_id": city_id,
-                    "region_id": region_id,
-                    "install_latitude": lat,
-                    "install_longitude": lon,
-                    "address": addr,
-                    "install_address": addr,
-                    "creator_name": "系统生成"
-                })
-                current_batch_records.append(convert_numpy_types(new_row))
-
-            # [优化点4]：生成一批，插入一批，然后释放内存
-            if current_batch_records:
-                cols = ", ".join(current_batch_records[0].keys())
-                vals = ", ".join([f":{k}" for k in current_batch_records[0].keys()])
-                insert_sql = f"INSERT INTO dev_device_instance ({cols}) VALUES ({vals})"
-
-                conn.execute(text(insert_sql), current_batch_records)
-                conn.commit()
-
-                total_inserted += len(current_batch_records)
-
-                elapsed = time.time() - batch_start_time
-                logger.info(
-                    f"批次 {batch_idx + 1}/{total_batches} 完成: 插入 {len(current_batch_records)} 条, 耗时 {elapsed:.2f}s")
+        for shard, shard_start, shard_end in seeded.shards(add_count):
+            shard_start_time = time.time()
+
+            generate_start = time.perf_counter()
+            ids = [id_allocator.next_id() for _ in range(shard_end - shard_start)]
+            shard_records = generate_records(ids, template, hierarchy_data, polygon_sampler, seeded.rng(shard))
+            add_time("generate", time.perf_counter() - generate_start)
+            count("rows_generated", len(shard_records))
+
+            # [优化点4]：生成一片，分批插入，然后释放内存
+            for batch_start in range(0, len(shard_records), batch_size):
+                batch = shard_records[batch_start:batch_start + batch_size]
+                with stage("db_write"):
+                    bulk_insert(conn, "dev_device_instance", batch)
+                    conn.commit()
+                count("rows_written", len(batch))
+                tick()
+
+            total_inserted += len(shard_records)
+            elapsed = time.time() - shard_start_time
+            logger.info(
+                f"分片 {shard + 1}/{total_shards} 完成: 插入 {len(shard_records)} 条, 耗时 {elapsed:.2f}s")
 
         logger.info(f"全部完成！共插入 {total_inserted} 条，总耗时 {time.time() - start_time:.2f} 秒")
 
 
 if __name__ == "__main__":
-    main(add_count=4000000, batch_size=5000)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="批量新增设备档案")
+    parser.add_argument("--count", type=int, default=4000000, help="新增设备数量")
+    parser.add_argument("--batch-size", type=int, default=5000, help="每批写入条数")
+    parser.add_argument("--seed", type=int, help="随机种子，相同 seed 生成相同的区域、地址与坐标")
+    args = parser.parse_args()
+
+    with JobMetrics("seed_devices"):
+        main(add_count=args.count, batch_size=args.batch_size, seed=args.seed)
\ No newline at end of file
@@ -5,13 +5,14 @@ import random
 import time
 import uuid
 
-# 加载表结构
-metadata = MetaData()
-dev_message = Table('dev_message', metadata, autoload_with=engine)
 
-def generate_dev_messages():
+def generate_dev_messages(device_id="2025042800002", days=90):
+    # 加载表结构（调用时才连接数据库）
+    metadata = MetaData()
+    dev_message = Table('dev_message', metadata, autoload_with=engine)
+
     end_date = datetime.now() - timedelta(days=1)
-    start_date = end_date - timedelta(days=90)
+    start_date = end_date - timedelta(days=days)
     total_accumulate_flow = 0.0
     dev_messages = []
 
@@ -20,8 +21,8 @@ def generate_dev_messages():
         total_accumulate_flow += round(random.uniform(10, 100), 3)
         row_dict = {
             "id": str(uuid.uuid4()),
-            "device_id": "2025042800002",
-            "device_name": "2025042800002",
+            "device_id": device_id,
+            "device_name": device_id,
             "device_type": "watermeter",
             "product_id": "1001",
             "product_name": "U-WR2",
@@ -90,4 +91,6 @@ def generate_dev_messages():
     except Exception as e:
         print(f"❌ 批量插入失败: {e}")
 
-generate_dev_messages()
+
+if __name__ == "__main__":
+    generate_dev_messages()
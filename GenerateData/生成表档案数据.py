@@ -2,20 +2,20 @@ import pandas as pd
 import random
 from sqlalchemy import text
 from dbhelp import engine
+from region_snapshot import load_regions, LEVEL_PROVINCE, LEVEL_CITY, LEVEL_AREA
 from tqdm import tqdm
 
 # 1️⃣ 读取 alabo_region 全部地区数据
-sql_alabo_region = text("SELECT region_id, parent_id, name_en, level FROM alabo_region")
-df_region = pd.read_sql(sql_alabo_region, con=engine)
+df_region = load_regions(engine)
 
 print("alabo_region 总记录数: ", len(df_region))
 print(df_region.head())  # 看前几条数据长啥样
 
 # 2️⃣ 分别筛选出 省、市、区
-# 如果 level 是数字类型，请使用数字比较 (1, 2, 3)，否则保留字符串 "1", "2", "3"
-df_province = df_region[df_region['level'] == "1"]
-df_city = df_region[df_region['level'] == "2"]
-df_area = df_region[df_region['level'] == "3"]  # 修改为 df_area 而不是 df_region3
+# load_regions 已将 level 统一为 1 省 / 2 市 / 3 区，不必再区分数字与字符串
+df_province = df_region[df_region['level'] == LEVEL_PROVINCE]
+df_city = df_region[df_region['level'] == LEVEL_CITY]
+df_area = df_region[df_region['level'] == LEVEL_AREA]  # 修改为 df_area 而不是 df_region3
 
 print("省份数: ", len(df_province))
 print("城市数: ", len(df_city))
@@ -2,10 +2,18 @@ import pandas as pd
 import random
 from sqlalchemy import text
 from dbhelp import engine
+from batch_controller import AdaptiveBatchController
+from batch_retry import write_with_bisect
+from dead_letter import DeadLetterSink, replay_dead_letters
+from job_metrics import JobMetrics, stage, add_time, count
+from region_snapshot import load_regions, LEVEL_PROVINCE, LEVEL_CITY, LEVEL_AREA
 from tqdm import tqdm
 import time
 import logging
-from datetime import datetime
+import argparse
+
+# 失败记录（死信）文件名前缀
+DEAD_LETTER_JOB = "device_region"
 
 # 设置日志
 logging.basicConfig(
@@ -20,15 +28,15 @@ def main():
 
     # 1️⃣ 读取 alabo_region 全部地区数据
     print("📊 读取地区数据...")
-    sql_alabo_region = text("SELECT region_id, parent_id, name_en, level FROM alabo_region")
-    df_region = pd.read_sql(sql_alabo_region, con=engine)
+    with stage("db_read"):
+        df_region = load_regions(engine)
 
     print(f"alabo_region 总记录数: {len(df_region)}")
 
     # 2️⃣ 分别筛选出 省、市、区
-    df_province = df_region[df_region['level'] == "1"]
-    df_city = df_region[df_region['level'] == "2"]
-    df_area = df_region[df_region['level'] == "3"]
+    df_province = df_region[df_region['level'] == LEVEL_PROVINCE]
+    df_city = df_region[df_region['level'] == LEVEL_CITY]
+    df_area = df_region[df_region['level'] == LEVEL_AREA]
 
     print(f"省份数: {len(df_province)}")
     print(f"城市数: {len(df_city)}")
@@ -67,12 +75,14 @@ def main():
     # 4️⃣ 读取 dev_device_instance 需要赋值的数据
     print("📋 读取设备数据...")
     sql_dev_device_instance = text("SELECT id FROM dev_device_instance")
-    df_devices = pd.read_sql(sql_dev_device_instance, con=engine)
+    with stage("db_read"):
+        df_devices = pd.read_sql(sql_dev_device_instance, con=engine)
 
     print(f"📌 需要赋值的设备数: {len(df_devices)}")
 
     # 5️⃣ 为每条设备数据分配随机地址
     print("🎯 分配随机地区...")
+    generate_start = time.perf_counter()
     assigned_data = []
 
     for _, row in tqdm(df_devices.iterrows(), total=df_devices.shape[0], desc="分配地区"):
@@ -90,10 +100,13 @@ def main():
         })
 
     df_assigned = pd.DataFrame(assigned_data)
+    add_time("generate", time.perf_counter() - generate_start)
+    count("rows_generated", len(df_assigned))
 
-    # 6️⃣ 使用修复后的安全更新方法
+    # 6️⃣ 使用修复后的安全更新方法，失败记录统一写入本次运行的死信文件
     print("🚀 开始极安全更新数据库...")
-    success = ultra_safe_single_update_fixed(df_assigned)
+    with DeadLetterSink(DEAD_LETTER_JOB) as sink:
+        success = ultra_safe_single_update_fixed(df_assigned, sink)
 
     if success:
         print("✅ 设备数据地区赋值完成！")
@@ -101,9 +114,49 @@ def main():
         print("❌ 更新过程中出现问题，请检查日志")
 
 
-def ultra_safe_single_update_fixed(df_assigned):
+# === 更新语句 ===
+UPDATE_REGION_SQL = text("""
+    UPDATE dev_device_instance
+    SET province_id = :province_id,
+        province_name = :province_name,
+        city_id = :city_id,
+        city_name = :city_name,
+        region_id = :region_id,
+        region_name = :region_name,
+        address = :address
+    WHERE id = :id
+""")
+
+
+def region_params(row):
+    return {
+        'province_id': row['province_id'],
+        'province_name': row['province_name'],
+        'city_id': row['city_id'],
+        'city_name': row['city_name'],
+        'region_id': row['region_id'],
+        'region_name': row['region_name'],
+        'address': row['address'],
+        'id': row['id']
+    }
+
+
+def _update_regions(params, lock_wait_timeout):
+    """在一个事务内更新一批记录（write_with_bisect 的写入函数）"""
+    with engine.begin() as conn:
+        # 设置较短的锁等待时间
+        conn.execute(text(f"SET innodb_lock_wait_timeout = {lock_wait_timeout}"))
+        result = conn.execute(UPDATE_REGION_SQL, params)
+
+    # 检查是否真的更新了记录（executemany 时 rowcount 为总数，仅单条时可精确判断）
+    if len(params) == 1 and result.rowcount == 0:
+        logger.warning(f"记录 {params[0]['id']} 未找到，可能已被删除")
+
+
+def ultra_safe_single_update_fixed(df_assigned, sink):
     """
     修复后的单条记录更新方法，解决SQLAlchemy 2.0事务问题
+    只对锁超时/死锁/序列化失败退避重试（最多 5 次），数据错误直接记录
     """
     total_records = len(df_assigned)
 
@@ -111,80 +164,24 @@ def ultra_safe_single_update_fixed(df_assigned):
 
     success_count = 0
     fail_count = 0
+    controller = AdaptiveBatchController(initial=1, min_size=1, max_size=1, name="单条更新")
 
     # 创建进度条
     pbar = tqdm(total=total_records, desc="更新进度")
 
-    for index, row in df_assigned.iterrows():
-        # 尝试更新当前记录，最多重试5次
-        record_success = False
-        retry_count = 0
-        max_retries = 5
-
-        while not record_success and retry_count < max_retries:
-            try:
-                # 修复：使用 engine.begin() 而不是 engine.connect() + conn.begin()
-                with engine.begin() as conn:
-                    # 设置很短的锁等待时间
-                    conn.execute(text("SET innodb_lock_wait_timeout = 10"))
-
-                    update_sql = text("""
-                        UPDATE dev_device_instance
-                        SET province_id = :province_id,
-                            province_name = :province_name,
-                            city_id = :city_id,
-                            city_name = :city_name,
-                            region_id = :region_id,
-                            region_name = :region_name,    
-                            address = :address
-                        WHERE id = :id
-                    """)
-                    result = conn.execute(update_sql, {
-                        'province_id': row['province_id'],
-                        'province_name': row['province_name'],
-                        'city_id': row['city_id'],
-                        'city_name': row['city_name'],
-                        'region_id': row['region_id'],
-                        'region_name': row['region_name'],
-                        'address': row['address'],
-                        'id': row['id']
-                    })
-
-                    # 检查是否真的更新了记录
-                    if result.rowcount == 0:
-                        logger.warning(f"记录 {row['id']} 未找到，可能已被删除")
-
-                record_success = True
-                success_count += 1
-
-            except Exception as e:
-                retry_count += 1
-                error_msg = str(e)
-
-                if "Lock wait timeout" in error_msg or "1205" in error_msg:
-                    # 锁超时，等待后重试
-                    wait_time = 5 * retry_count
-                    logger.warning(f"记录 {row['id']} 更新锁超时，第 {retry_count} 次重试，等待 {wait_time} 秒")
-                    time.sleep(wait_time)
-                else:
-                    # 其他错误
-                    wait_time = 2 ** retry_count
-                    logger.warning(f"记录 {row['id']} 更新失败，第 {retry_count} 次重试，错误: {error_msg}")
-                    time.sleep(wait_time)
-
-                if retry_count >= max_retries:
-                    logger.error(f"记录 {row['id']} 更新失败，已达到最大重试次数")
-                    fail_count += 1
-                    save_failed_record(row, index)
+    for _, row in df_assigned.iterrows():
+        written, failed = write_with_bisect(lambda params: _update_regions(params, 10), [region_params(row)],
+                                            controller=controller, max_retries=5)
+        success_count += written
+        for record, error in failed:
+            logger.error(f"记录 {row['id']} 更新失败: {error}")
+            fail_count += 1
+            sink.add(record, error)
 
         # 更新进度条
         pbar.update(1)
         pbar.set_postfix(成功=f"{success_count}", 失败=f"{fail_count}")
 
-        # 每处理一定数量记录后暂停
-        if success_count > 0 and success_count % 100 == 0:
-            time.sleep(0.5)  # 短暂暂停
-
         # 每处理1000条记录后显示一次状态
         if success_count > 0 and success_count % 1000 == 0:
             logger.info(f"已处理 {success_count} 条记录，失败 {fail_count} 条")
@@ -199,89 +196,37 @@ def ultra_safe_single_update_fixed(df_assigned):
     return fail_count == 0
 
 
-def ultra_safe_batch_update(df_assigned):
+def ultra_safe_batch_update(df_assigned, sink):
     """
     备选方案：小批次更新，效率更高
+    批大小从 50 起按提交耗时自适应调整；批次失败时对半拆分定位坏行，
+    只对可重试的错误退避重试，最终只保存真正失败的记录
     """
-    batch_size = 50  # 小批次大小
-    total_batches = (len(df_assigned) + batch_size - 1) // batch_size
+    controller = AdaptiveBatchController(initial=50, name="批次更新")
 
-    print(f"🔄 开始小批次更新，共 {total_batches} 批，每批 {batch_size} 条记录")
+    print(f"🔄 开始小批次更新，共 {len(df_assigned)} 条记录，初始每批 {controller.size} 条")
 
     success_count = 0
     fail_count = 0
 
-    pbar = tqdm(total=total_batches, desc="批次进度")
-
-    for batch_num in range(total_batches):
-        start_idx = batch_num * batch_size
-        end_idx = min((batch_num + 1) * batch_size, len(df_assigned))
-        batch_df = df_assigned.iloc[start_idx:end_idx]
-
-        batch_success = False
-        retry_count = 0
-        max_retries = 3
-
-        while not batch_success and retry_count < max_retries:
-            try:
-                with engine.begin() as conn:
-                    conn.execute(text("SET innodb_lock_wait_timeout = 30"))
-
-                    # 使用 executemany 批量更新
-                    update_sql = text("""
-                        UPDATE dev_device_instance
-                        SET province_id = :province_id,
-                            province_name = :province_name,
-                            city_id = :city_id,
-                            city_name = :city_name,
-                            region_id = :region_id,
-                            region_name = :region_name,    
-                            address = :address
-                        WHERE id = :id
-                    """)
-
-                    params = []
-                    for _, row in batch_df.iterrows():
-                        params.append({
-                            'province_id': row['province_id'],
-                            'province_name': row['province_name'],
-                            'city_id': row['city_id'],
-                            'city_name': row['city_name'],
-                            'region_id': row['region_id'],
-                            'region_name': row['region_name'],
-                            'address': row['address'],
-                            'id': row['id']
-                        })
-
-                    conn.execute(update_sql, params)
-
-                batch_success = True
-                success_count += len(batch_df)
-
-            except Exception as e:
-                retry_count += 1
-                error_msg = str(e)
-
-                if "Lock wait timeout" in error_msg or "1205" in error_msg:
-                    wait_time = 10 * retry_count
-                    logger.warning(f"批次 {batch_num} 更新锁超时，第 {retry_count} 次重试，等待 {wait_time} 秒")
-                else:
-                    wait_time = 5 * retry_count
-                    logger.warning(f"批次 {batch_num} 更新失败，第 {retry_count} 次重试，错误: {error_msg}")
-
-                time.sleep(wait_time)
-
-                if retry_count >= max_retries:
-                    logger.error(f"批次 {batch_num} 更新失败，已达到最大重试次数")
-                    fail_count += len(batch_df)
-                    save_failed_batch(batch_df, batch_num)
+    pbar = tqdm(total=len(df_assigned), desc="更新进度")
 
-        pbar.update(1)
-        pbar.set_postfix(成功=f"{success_count}", 失败=f"{fail_count}")
+    for batch_num, batch_df in enumerate(controller.split(df_assigned)):
+        params = [region_params(row) for _, row in batch_df.iterrows()]
+
+        # 使用 executemany 批量更新
+        written, failed = write_with_bisect(lambda batch: _update_regions(batch, 30), params,
+                                            controller=controller, max_retries=3)
+        success_count += written
+
+        if failed:
+            logger.error(f"批次 {batch_num} 中 {len(failed)} 条记录更新失败")
+            fail_count += len(failed)
+            for record, error in failed:
+                sink.add(record, error)
 
-        # 批次间暂停
-        if batch_success:
-            time.sleep(0.1)
+        pbar.update(len(batch_df))
+        pbar.set_postfix(成功=f"{success_count}", 失败=f"{fail_count}", 批大小=f"{controller.size}")
 
     pbar.close()
 
@@ -289,38 +234,32 @@ def ultra_safe_batch_update(df_assigned):
     print(f"  成功记录: {success_count}")
     print(f"  失败记录: {fail_count}")
     print(f"  成功率: {success_count / len(df_assigned) * 100:.2f}%")
+    logger.info(controller.summary())
 
     return fail_count == 0
 
 
-def save_failed_record(record, index):
-    """保存失败记录到文件"""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"failed_records_{timestamp}.csv"
-
-    # 如果是第一个失败记录，创建文件并写入header
-    if index == 0:
-        pd.DataFrame([record]).to_csv(filename, index=False)
-    else:
-        # 追加到现有文件
-        pd.DataFrame([record]).to_csv(filename, mode='a', header=False, index=False)
-
-    logger.info(f"失败记录已保存到: {filename}")
-
-
-def save_failed_batch(batch_df, batch_num):
-    """保存失败批次到文件"""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"failed_batch_{batch_num}_{timestamp}.csv"
-    batch_df.to_csv(filename, index=False)
-    logger.info(f"失败批次已保存到: {filename}")
+def replay_failed(path):
+    """将死信文件中的记录按批量更新路径重新写入，仍失败的记录写入新的死信文件"""
+    controller = AdaptiveBatchController(initial=50, name="重放失败记录")
+    with DeadLetterSink(f"{DEAD_LETTER_JOB}_replay") as sink:
+        replay_dead_letters(path, lambda batch: _update_regions(batch, 30), controller=controller, sink=sink)
+    return sink.count == 0
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="设备档案随机分配地区")
+    parser.add_argument("--replay", metavar="DEAD_LETTER_FILE", help="重放死信文件中的失败记录")
+    args = parser.parse_args()
+
     start_time = time.time()
 
     try:
-        main()
+        with JobMetrics(f"{DEAD_LETTER_JOB}_replay" if args.replay else DEAD_LETTER_JOB):
+            if args.replay:
+                replay_failed(args.replay)
+            else:
+                main()
     except KeyboardInterrupt:
         logger.info("用户中断执行")
     except Exception as e:
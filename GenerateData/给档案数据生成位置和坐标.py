@@ -5,11 +5,21 @@ import time
 import pandas as pd
 from sqlalchemy import text
 from dbhelp import get_engine, DB_CONFIG
+from batch_controller import AdaptiveBatchController
+from batch_retry import write_with_bisect
+from dead_letter import DeadLetterSink, replay_dead_letters
+from job_metrics import JobMetrics, stage, add_time, count
+from job_estimate import SampleEstimator, estimate_table_rows
+from device_template_helper import sample_rows
+from region_snapshot import load_regions, LEVEL_PROVINCE, LEVEL_CITY, LEVEL_AREA
 
 # === 日志配置 ===
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 失败记录（死信）文件名前缀
+DEAD_LETTER_JOB = "assign_device_locations"
+
 
 # === 工具函数 ===
 def random_point(lat_center, lon_center, radius_km=1000):
@@ -41,46 +51,29 @@ def convert_numpy_types(obj):
 def build_region_hierarchy(df_region):
     """
     构建区域层级关系（保持原始列，包括 latitude/longitude 如果存在）
+    df_region 来自 load_regions，level 已统一为 1 省 / 2 市 / 3 区
     返回 dict，包含 DataFrame 对象和映射
     """
-    level_counts = df_region['level'].value_counts()
-    logger.info(f"区域层级分布: {level_counts.to_dict()}")
+    logger.info(f"区域层级分布: {df_region['level'].value_counts().to_dict()}")
 
     hierarchy = {}
 
-    for prov_level in [1, '1', 'province']:
-        if prov_level in df_region['level'].values:
-            provinces = df_region[df_region['level'] == prov_level]
-            hierarchy['provinces'] = provinces
-            logger.info(f"找到省份层级: {prov_level}, 数量: {len(provinces)}")
-            break
-
-    for city_level in [2, '2', 'city']:
-        if city_level in df_region['level'].values:
-            cities = df_region[df_region['level'] == city_level]
-            hierarchy['cities'] = cities
-            city_to_province = cities.set_index('region_id')['parent_id'].to_dict()
-            hierarchy['city_to_province'] = city_to_province
-            logger.info(f"找到城市层级: {city_level}, 数量: {len(cities)}")
-            break
-
-    for area_level in [3, '3', 'area', 'district']:
-        if area_level in df_region['level'].values:
-            areas = df_region[df_region['level'] == area_level]
-            hierarchy['areas'] = areas
-            area_to_city = areas.set_index('region_id')['parent_id'].to_dict()
-            hierarchy['area_to_city'] = area_to_city
-            logger.info(f"找到区域层级: {area_level}, 数量: {len(areas)}")
-            break
-
-    if not hierarchy:
-        top_levels = level_counts.head(3).index.tolist()
-        if len(top_levels) >= 1:
-            hierarchy['provinces'] = df_region[df_region['level'] == top_levels[0]]
-        if len(top_levels) >= 2:
-            hierarchy['cities'] = df_region[df_region['level'] == top_levels[1]]
-        if len(top_levels) >= 3:
-            hierarchy['areas'] = df_region[df_region['level'] == top_levels[2]]
+    provinces = df_region[df_region['level'] == LEVEL_PROVINCE]
+    if not provinces.empty:
+        hierarchy['provinces'] = provinces
+        logger.info(f"省份数量: {len(provinces)}")
+
+    cities = df_region[df_region['level'] == LEVEL_CITY]
+    if not cities.empty:
+        hierarchy['cities'] = cities
+        hierarchy['city_to_province'] = cities.set_index('region_id')['parent_id'].to_dict()
+        logger.info(f"城市数量: {len(cities)}")
+
+    areas = df_region[df_region['level'] == LEVEL_AREA]
+    if not areas.empty:
+        hierarchy['areas'] = areas
+        hierarchy['area_to_city'] = areas.set_index('region_id')['parent_id'].to_dict()
+        logger.info(f"区域数量: {len(areas)}")
 
     return hierarchy
 
@@ -174,175 +167,272 @@ def get_random_location(hierarchy):
 
 
 # === 主流程 ===
-def main(batch_size=100000):
-    logger.info("🔄 连接数据库...")
-    engine = get_engine(DB_CONFIG)
-    logger.info("✅ 数据库连接成功")
+# 回写事务大小：从 initial 起按提交耗时在 [min_size, max_size] 内自适应调整（预估时按 max_size 估算单个事务的锁占用）
+WRITE_BATCH = {"initial": 10000, "max_size": 50000, "target_latency": 2.0}
+
+# 每条设备在同一次 UPDATE 中整体覆盖，无法生成位置的设备写入 NULL（代替原先单独的全表清空）
+UPDATE_SQL = text("""
+    UPDATE dev_device_instance
+    SET province_id = :province_id,
+        city_id = :city_id,
+        region_id = :region_id,
+        install_latitude = :install_latitude,
+        install_longitude = :install_longitude,
+        address = :address,
+        install_address = :install_address
+    WHERE id = :id
+""")
+
+
+def detect_coord_fields(conn):
+    """查找设备表中的经纬度字段，返回 (lat_field, lon_field, 读取设备时的字段列表)"""
+    logger.info("🔄 检查 dev_device_instance 表结构...")
+    device_columns = conn.execute(text("""
+        SELECT column_name 
+        FROM information_schema.columns 
+        WHERE table_name = 'dev_device_instance'
+        ORDER BY ordinal_position
+    """)).fetchall()
+
+    device_columns = [col[0] for col in device_columns]
+    logger.info(f"设备表字段数量: {len(device_columns)}")
+
+    lat_fields = [col for col in device_columns if 'lat' in col.lower()]
+    lon_fields = [col for col in device_columns if 'lon' in col.lower()]
+
+    logger.info(f"纬度字段: {lat_fields}")
+    logger.info(f"经度字段: {lon_fields}")
+
+    lat_field = lat_fields[0] if lat_fields else None
+    lon_field = lon_fields[0] if lon_fields else None
+
+    if lat_field and lon_field:
+        coord_fields = f"{lat_field}, {lon_field}"
+        logger.info(f"使用坐标字段: {lat_field}, {lon_field}")
+    else:
+        coord_fields = "id"
+        logger.warning("⚠️ 未找到坐标字段，将使用默认坐标")
+    return lat_field, lon_field, coord_fields
 
-    with engine.connect() as conn:
-        # 1️⃣ 检查设备表结构
-        logger.info("🔄 检查 dev_device_instance 表结构...")
-        device_columns = conn.execute(text("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name = 'dev_device_instance'
-            ORDER BY ordinal_position
-        """)).fetchall()
 
-        device_columns = [col[0] for col in device_columns]
-        logger.info(f"设备表字段数量: {len(device_columns)}")
+def load_hierarchy(conn):
+    """读取 alabo_region 并构建区域层级，没有可用的省份数据时返回 None"""
+    logger.info("🔄 读取 alabo_region 区域表...")
+    df_region = load_regions(conn)
 
-        lat_fields = [col for col in device_columns if 'lat' in col.lower()]
-        lon_fields = [col for col in device_columns if 'lon' in col.lower()]
+    if df_region.empty:
+        logger.error("❌ alabo_region 表为空，无法继续执行")
+        return None
 
-        logger.info(f"纬度字段: {lat_fields}")
-        logger.info(f"经度字段: {lon_fields}")
+    logger.info(f"读取到区域数据: {len(df_region)} 条")
 
-        lat_field = lat_fields[0] if lat_fields else None
-        lon_field = lon_fields[0] if lon_fields else None
+    hierarchy = build_region_hierarchy(df_region)
 
-        if lat_field and lon_field:
-            coord_fields = f"{lat_field}, {lon_field}"
-            logger.info(f"使用坐标字段: {lat_field}, {lon_field}")
-        else:
-            coord_fields = "id"
-            logger.warning("⚠️ 未找到坐标字段，将使用默认坐标")
+    if 'provinces' not in hierarchy or hierarchy['provinces'].empty:
+        logger.error("❌ 没有找到省份数据，无法继续")
+        return None
+    return hierarchy
 
-        # 2️⃣ 读取区域数据（包含 latitude/longitude）
-        logger.info("🔄 读取 alabo_region 区域表...")
-        df_region = pd.DataFrame(conn.execute(
-            text("SELECT region_id, parent_id, name_en, level, latitude, longitude FROM alabo_region")
-        ).mappings().all())
-
-        if df_region.empty:
-            logger.error("❌ alabo_region 表为空，无法继续执行")
-            return
-
-        logger.info(f"读取到区域数据: {len(df_region)} 条")
-
-        hierarchy = build_region_hierarchy(df_region)
-
-        if 'provinces' not in hierarchy or hierarchy['provinces'].empty:
-            logger.error("❌ 没有找到省份数据，无法继续")
-            return
-
-        # 3️⃣ 清空关键字段
-        logger.info("🔄 清空 dev_device_instance 的关键字段...")
-        conn.execute(text("""
-            UPDATE dev_device_instance
-            SET province_id=NULL, city_id=NULL, region_id=NULL,
-                install_latitude=NULL, install_longitude=NULL,
-                install_address=NULL, address=NULL
-        """))
+
+def read_device_page(conn, coord_fields, after_id, limit):
+    """按 id 键集分页读取设备（WHERE id > 上一页最后一个 id），每页的扫描量不随页数增加"""
+    where = "" if after_id is None else "WHERE id > :after_id"
+    return pd.DataFrame(conn.execute(
+        text(f"SELECT id, {coord_fields} FROM dev_device_instance {where} ORDER BY id LIMIT :limit"),
+        {"after_id": after_id, "limit": limit}
+    ).mappings().all())
+
+
+def write_updates(conn, batch):
+    """在一个事务内回写一批记录（write_with_bisect 的写入函数），失败时回滚"""
+    try:
+        conn.execute(UPDATE_SQL, batch)
         conn.commit()
-        logger.info("✅ 清空完成")
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def cleared_record(device_id):
+    return {
+        'id': str(device_id),
+        'province_id': None,
+        'city_id': None,
+        'region_id': None,
+        'install_latitude': None,
+        'install_longitude': None,
+        'address': None,
+        'install_address': None
+    }
 
-        # 4️⃣ 处理设备数据分批
+
+def generate_updates(devices, hierarchy, lat_field, lon_field):
+    """
+    为一批设备随机生成区域、地址与坐标，返回可直接执行 UPDATE_SQL 的记录
+    每台设备都有一条记录：生成失败的设备字段置为 NULL
+    """
+    update_records = []
+    for _, row in devices.iterrows():
+        try:
+            province_id, city_id, region_id, address, lat_center, lon_center = get_random_location(hierarchy)
+            if province_id is None:
+                update_records.append(cleared_record(row['id']))
+                continue
+
+            # 优先使用区域中心坐标（area -> city -> province），若不存在则使用设备原始坐标，最后退回到北京
+            if lat_center is None or lon_center is None:
+                # 如果设备表存在坐标字段，尝试使用设备已有坐标
+                if lat_field and lon_field and lat_field in row and lon_field in row and pd.notna(row[lat_field]) and pd.notna(row[lon_field]):
+                    try:
+                        lat_center = float(row[lat_field])
+                        lon_center = float(row[lon_field])
+                    except Exception:
+                        lat_center, lon_center = 39.9042, 116.4074
+                else:
+                    # 退回到北京市中心（仅作为最后的兜底）
+                    lat_center, lon_center = 39.9042, 116.4074
+
+            lat, lon = random_point(lat_center, lon_center, radius_km=100)
+
+            record = {
+                'id': str(row['id']),
+                'province_id': province_id,
+                'city_id': city_id,
+                'region_id': region_id,
+                'install_latitude': float(lat),
+                'install_longitude': float(lon),
+                'address': str(address),
+                'install_address': str(address)
+            }
+
+            update_records.append(convert_numpy_types(record))
+        except Exception as e:
+            logger.error(f"处理设备 {row['id']} 时出错，字段置为 NULL: {e}")
+            update_records.append(cleared_record(row['id']))
+    return update_records
+
+
+def main(batch_size=100000, config=None):
+    logger.info("🔄 连接数据库...")
+    engine = get_engine(config or DB_CONFIG)
+    logger.info("✅ 数据库连接成功")
+
+    with engine.connect() as conn, DeadLetterSink(DEAD_LETTER_JOB) as sink:
+        # 1️⃣ 检查设备表结构
+        lat_field, lon_field, coord_fields = detect_coord_fields(conn)
+
+        # 2️⃣ 读取区域数据（包含 latitude/longitude）
+        hierarchy = load_hierarchy(conn)
+        if hierarchy is None:
+            return False
+
+        # 3️⃣ 处理设备数据分批（按 id 键集分页，每批整体覆盖，不再单独清空全表）
         total_devices = conn.execute(text("SELECT COUNT(*) FROM dev_device_instance")).scalar()
         logger.info(f"📦 dev_device_instance 总记录数: {total_devices}")
 
         estimated_batches = (total_devices + batch_size - 1) // batch_size
         logger.info(f"预计处理批次: {estimated_batches}")
 
-        offset = 0
+        # 写入批大小按提交耗时自适应调整
+        controller = AdaptiveBatchController(**WRITE_BATCH, name="坐标回写")
+
+        last_id = None
         start_time = time.time()
         batch_index = 1
         processed_count = 0
+        failed_count = 0
 
-        while offset < total_devices:
+        while True:
             batch_start_time = time.time()
             logger.info(
-                f"🔄 开始处理第 {batch_index} 批数据 (offset={offset}, 进度: {processed_count}/{total_devices})...")
+                f"🔄 开始处理第 {batch_index} 批数据 (last_id={last_id}, 进度: {processed_count}/{total_devices})...")
 
-            devices = pd.DataFrame(conn.execute(
-                text(
-                    f"SELECT id, {coord_fields} FROM dev_device_instance ORDER BY id LIMIT {batch_size} OFFSET {offset}")
-            ).mappings().all())
+            with stage("db_read"):
+                devices = read_device_page(conn, coord_fields, last_id, batch_size)
+                # 读事务立即结束，避免在整批生成期间持有快照
+                conn.commit()
 
             if devices.empty:
                 break
+            last_id = devices['id'].iloc[-1]
 
-            update_records = []
-            for _, row in devices.iterrows():
-                try:
-                    province_id, city_id, region_id, address, lat_center, lon_center = get_random_location(hierarchy)
-                    if province_id is None:
-                        continue
-
-                    # 优先使用区域中心坐标（area -> city -> province），若不存在则使用设备原始坐标，最后退回到北京
-                    if lat_center is None or lon_center is None:
-                        # 如果设备表存在坐标字段，尝试使用设备已有坐标
-                        if lat_field and lon_field and lat_field in row and lon_field in row and pd.notna(row[lat_field]) and pd.notna(row[lon_field]):
-                            try:
-                                lat_center = float(row[lat_field])
-                                lon_center = float(row[lon_field])
-                            except Exception:
-                                lat_center, lon_center = 39.9042, 116.4074
-                        else:
-                            # 退回到北京市中心（仅作为最后的兜底）
-                            lat_center, lon_center = 39.9042, 116.4074
-
-                    lat, lon = random_point(lat_center, lon_center, radius_km=100)
-
-                    record = {
-                        'id': str(row['id']),
-                        'province_id': province_id,
-                        'city_id': city_id,
-                        'region_id': region_id,
-                        'install_latitude': float(lat),
-                        'install_longitude': float(lon),
-                        'address': str(address),
-                        'install_address': str(address)
-                    }
-
-                    update_records.append(record)
-                except Exception as e:
-                    logger.error(f"处理设备 {row['id']} 时出错: {e}")
-                    continue
+            generate_start = time.perf_counter()
+            update_records = generate_updates(devices, hierarchy, lat_field, lon_field)
+            add_time("generate", time.perf_counter() - generate_start)
+            count("rows_generated", len(update_records))
 
             if not update_records:
                 logger.warning(f"第 {batch_index} 批没有生成更新记录")
-                offset += batch_size
                 batch_index += 1
                 continue
 
-            try:
-                update_sql = """
-                    UPDATE dev_device_instance
-                    SET province_id = :province_id,
-                        city_id = :city_id,
-                        region_id = :region_id,
-                        install_latitude = :install_latitude,
-                        install_longitude = :install_longitude,
-                        address = :address,
-                        install_address = :install_address
-                    WHERE id = :id
-                """
-
-                converted_records = [convert_numpy_types(record) for record in update_records]
-
-                chunk_size = 10000
-                for i in range(0, len(converted_records), chunk_size):
-                    chunk = converted_records[i:i + chunk_size]
-                    conn.execute(text(update_sql), chunk)
-                    conn.commit()
-
-                batch_duration = time.time() - batch_start_time
-                processed_count += len(update_records)
-                logger.info(f"✅ 第 {batch_index} 批完成，更新 {len(update_records)} 条记录，耗时 {batch_duration:.2f} 秒")
-
-            except Exception as e:
-                logger.error(f"批量更新第 {batch_index} 批时出错: {e}")
-                conn.rollback()
-
-            offset += batch_size
+            # 失败的块对半拆分定位坏行，其余行照常写入；仍失败的记录写入死信文件，可用 replay_failed 重放
+            batch_written, batch_failed = 0, 0
+            for chunk in controller.split(update_records):
+                written, failed = write_with_bisect(lambda batch: write_updates(conn, batch), chunk,
+                                                    controller=controller)
+                batch_written += written
+                batch_failed += len(failed)
+                for record, error in failed:
+                    sink.add(record, error)
+
+            processed_count += batch_written
+            failed_count += batch_failed
+            batch_duration = time.time() - batch_start_time
+            if batch_failed:
+                logger.error(f"❌ 第 {batch_index} 批中 {batch_failed} 条记录更新失败，已写入死信文件")
+            logger.info(f"✅ 第 {batch_index} 批完成，更新 {batch_written} 条记录，耗时 {batch_duration:.2f} 秒")
+
             batch_index += 1
 
         total_duration = time.time() - start_time
         logger.info(f"\n🎯 全部完成，耗时 {total_duration:.2f} 秒")
         logger.info(f"⚡ 平均速度: {processed_count / max(total_duration, 0.001):.1f} 条/秒")
-        logger.info(f"📊 总处理记录: {processed_count}/{total_devices}")
+        logger.info(f"📊 总处理记录: {processed_count}/{total_devices}，失败 {failed_count} 条")
+        logger.info(controller.summary())
+    return failed_count == 0
+
+
+def replay_failed(path, config=None):
+    """将死信文件中的记录按批量回写路径重新写入，仍失败的记录写入新的死信文件"""
+    engine = get_engine(config or DB_CONFIG)
+    controller = AdaptiveBatchController(initial=50, name="重放失败记录")
+    with engine.connect() as conn, DeadLetterSink(f"{DEAD_LETTER_JOB}_replay") as sink:
+        replay_dead_letters(path, lambda batch: write_updates(conn, batch), controller=controller, sink=sink)
+    return sink.count == 0
+
+
+# === 执行前预估 ===
+def estimate(sample_size=1000, config=None):
+    """
+    在回滚的事务中对随机抽取的约 sample_size 台设备执行 读取 -> 生成 -> 回写，
+    按全表行数预估耗时、WAL 量与锁占用，不提交任何修改
+    """
+    engine = get_engine(config or DB_CONFIG)
+    with engine.connect() as conn:
+        lat_field, lon_field, coord_fields = detect_coord_fields(conn)
+        hierarchy = load_hierarchy(conn)
+        if hierarchy is None:
+            return None
+        if conn.execute(text("SELECT 1 FROM dev_device_instance LIMIT 1")).first() is None:
+            logger.error("❌ dev_device_instance 表为空，无法预估")
+            return None
+        total_devices = estimate_table_rows(conn, "dev_device_instance")
+
+        with SampleEstimator(conn, "assign_device_locations", total_rows=total_devices) as estimator:
+            with estimator.stage("db_read"):
+                # 随机抽样（TABLESAMPLE / 随机主键），避免只取最早写入的一段设备
+                devices = pd.DataFrame(sample_rows(conn, "dev_device_instance", f"id, {coord_fields}", sample_size))
+            estimator.sample_rows = len(devices)
+
+            with estimator.stage("generate"):
+                update_records = generate_updates(devices, hierarchy, lat_field, lon_field)
+
+            with estimator.stage("write", rows_per_txn=WRITE_BATCH["max_size"]):
+                conn.execute(UPDATE_SQL, update_records)
+        return estimator.report
 
 
 if __name__ == "__main__":
-    main()
+    with JobMetrics("assign_device_locations"):
+        main()
@@ -1,13 +1,18 @@
 import pandas as pd
 import random
 import math
-import re
-from sqlalchemy import text
-from dbhelp import engine
+from sqlalchemy import text, inspect
+from dbhelp import engine, stream_mappings, count_rows
+from address_normalizer import clean_string, clean_cache_info, build_geo_index
+from batch_controller import AdaptiveBatchController
+from batch_retry import write_with_bisect
+from job_metrics import JobMetrics, stage, count, gauge, tick, timed
+from row_log import RowReporter
 from difflib import SequenceMatcher
 from tqdm import tqdm
 import time
 import logging
+import argparse
 
 # === 设置日志 ===
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -16,11 +21,38 @@ logger = logging.getLogger(__name__)
 # === 设置最大查询条数 ===
 LIMIT_COUNT = 100000
 
-
-def clean_string(s):
-    if not isinstance(s, str):
-        return ""
-    return re.sub(r"[^\w\s]", "", s.strip().lower())
+# === 增量同步状态 ===
+# 记录每个 meter 上次处理时的地址哈希及是否匹配成功，增量模式只处理新增或地址变化的 meter
+# 匹配失败同样记录，地址不变时不再重复匹配；GeoAdministrativeUnitsnew.csv 修正或补充后用全量模式重跑
+# 回写失败（锁超时等）的 meter 不记录，下一次增量运行会重试
+SYNC_STATE_DDL = text("""
+    CREATE TABLE IF NOT EXISTS coord_sync_state (
+        meter_id VARCHAR(64) PRIMARY KEY,
+        address_hash CHAR(32) NOT NULL,
+        matched BOOLEAN NOT NULL DEFAULT TRUE,
+        synced_at TIMESTAMP NOT NULL
+    )
+""")
+
+# 早期版本的状态表没有 matched 列（当时只记录匹配成功的 meter，默认值 TRUE 与之一致）
+SYNC_STATE_MIGRATION = text("ALTER TABLE coord_sync_state ADD COLUMN matched BOOLEAN NOT NULL DEFAULT TRUE")
+
+ADDRESS_HASH_SQL = "MD5(CONCAT_WS('|', COALESCE(m.province_name, ''), COALESCE(m.city_name, ''), COALESCE(m.region_name, '')))"
+
+SYNC_STATE_UPSERT = {
+    "postgresql": text("""
+        INSERT INTO coord_sync_state (meter_id, address_hash, matched, synced_at)
+        VALUES (:meter_id, :address_hash, :matched, CURRENT_TIMESTAMP)
+        ON CONFLICT (meter_id) DO UPDATE
+        SET address_hash = EXCLUDED.address_hash, matched = EXCLUDED.matched, synced_at = EXCLUDED.synced_at
+    """),
+    "mysql": text("""
+        INSERT INTO coord_sync_state (meter_id, address_hash, matched, synced_at)
+        VALUES (:meter_id, :address_hash, :matched, CURRENT_TIMESTAMP)
+        ON DUPLICATE KEY UPDATE address_hash = VALUES(address_hash), matched = VALUES(matched),
+                                synced_at = VALUES(synced_at)
+    """),
+}
 
 
 def similarity(a, b):
@@ -36,23 +68,6 @@ def random_point_within_radius(lat_center, lon_center, radius_km):
     return lat_center + lat_offset, lon_center + lon_offset
 
 
-def build_geo_index(geo_df):
-    start_time = time.time()
-    province_index = {}
-
-    for _, row in geo_df.iterrows():
-        province = clean_string(row['Region'])
-        city = clean_string(row['City'])
-        district = clean_string(row['district'])
-        lat = row['latitude']
-        lon = row['longitude']
-
-        province_index.setdefault(province, {}).setdefault(city, {}).setdefault(district, []).append((lat, lon))
-
-    logger.info(f"🌳 地址索引构建完成 | 耗时: {time.time() - start_time:.2f}s")
-    return province_index
-
-
 def match_address(province, city, district, geo_index):
     best_province = None
     best_province_score = 0
@@ -152,29 +167,69 @@ def batch_update_mysql(conn, update_batch):
     conn.execute(text(sql3))
 
 
-def main():
-    logger.info("⏳ 开始读取地理地址数据...")
-    geo_df = pd.read_csv('GeoAdministrativeUnitsnew.csv')
-    geo_index = build_geo_index(geo_df)
+def ensure_sync_state(conn):
+    """创建同步状态表，旧表补上 matched 列"""
+    conn.execute(SYNC_STATE_DDL)
+    if "matched" not in {c["name"] for c in inspect(conn).get_columns("coord_sync_state")}:
+        logger.info("🔧 coord_sync_state 补充 matched 列")
+        conn.execute(SYNC_STATE_MIGRATION)
+    conn.commit()
+
+
+def save_sync_state(conn, items, matched=True):
+    """记录已处理 meter 的地址哈希与匹配结果（匹配成功的与坐标回写在同一事务中提交）"""
+    states = {item['meter_id']: item['address_hash'] for item in items}
+    if states:
+        conn.execute(SYNC_STATE_UPSERT[conn.dialect.name],
+                     [{'meter_id': k, 'address_hash': v, 'matched': matched} for k, v in states.items()])
 
-    logger.info("⏳ 查询数据库设备数据...")
+
+def build_device_query(limit, incremental):
+    """
+    全量模式：最多 limit 台有省市信息的设备
+    增量模式：只取 coord_sync_state 中没有记录、或地址哈希与记录不一致的设备（不论上次是否匹配成功）
+    按 meter_id 排序，增量模式下每次 --limit 运行依次处理下一段
+    """
+    sync_join, sync_where = "", ""
+    if incremental:
+        sync_join = "LEFT JOIN coord_sync_state s ON s.meter_id = m.meter_id"
+        sync_where = f"AND (s.meter_id IS NULL OR s.address_hash <> {ADDRESS_HASH_SQL})"
+    return text(f"""
+        SELECT d.id as device_id, d.second_id, 
+               m.province_name, m.city_name, m.region_name,
+               {ADDRESS_HASH_SQL} AS address_hash
+        FROM dev_device_instance d
+        LEFT JOIN dev_meter_id m ON d.second_id = m.meter_id
+        {sync_join}
+        WHERE d.second_id IS NOT NULL
+          AND m.province_name IS NOT NULL
+          AND m.city_name IS NOT NULL
+          {sync_where}
+        ORDER BY d.second_id, d.id
+        {"LIMIT :limit" if limit else ""}
+    """)
+
+
+def main(limit=LIMIT_COUNT, batch_size=100, incremental=False):
+    with stage("load_geo"):
+        logger.info("⏳ 开始读取地理地址数据...")
+        geo_df = pd.read_csv('GeoAdministrativeUnitsnew.csv')
+        geo_index = build_geo_index(geo_df)
+
+    logger.info("⏳ 查询数据库设备数据" + ("（增量：只处理地址有变化的设备）..." if incremental else "..."))
+    device_query = build_device_query(limit, incremental)
     with engine.connect() as conn:
-        device_query = text("""
-            SELECT d.id as device_id, d.second_id, 
-                   m.province_name, m.city_name, m.region_name
-            FROM dev_device_instance d
-            LEFT JOIN dev_meter_id m ON d.second_id = m.meter_id
-            WHERE d.second_id IS NOT NULL
-              AND m.province_name IS NOT NULL
-              AND m.city_name IS NOT NULL
-            LIMIT :limit
-        """)
-        devices = conn.execute(device_query, {'limit': LIMIT_COUNT}).mappings().all()
-
-    logger.info(f"🔍 共查询到 {len(devices)} 条有效设备（未设置安装坐标）")
+        if incremental:
+            ensure_sync_state(conn)
+        total = count_rows(conn, device_query, {'limit': limit})
+
+    logger.info(f"🔍 共查询到 {total} 条有效设备" + ("（地址新增或变化）" if incremental else ""))
+    if not total:
+        logger.info("✅ 没有需要同步的设备")
+        return
 
     stats = {
-        'total': len(devices),
+        'total': total,
         'matched': 0,
         'matched_lvl2': 0,
         'matched_lvl3': 0,
@@ -184,36 +239,76 @@ def main():
     }
 
     update_batch = []
-    batch_size = 100
+    unmatched = []
+    controller = AdaptiveBatchController(initial=batch_size, name="坐标回写")
+
+    def flush(conn):
+        if incremental and unmatched:
+            # 匹配失败的也记录地址哈希，地址不变时下次增量运行跳过
+            try:
+                save_sync_state(conn, unmatched, matched=False)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"❌ 记录匹配失败状态出错（下次增量运行会重新匹配）: {e}")
+            unmatched.clear()
+        if not update_batch:
+            return
+
+        def write(batch):
+            try:
+                batch_update_mysql(conn, batch)
+                if incremental:
+                    save_sync_state(conn, batch)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+        # 整批失败时对半拆分定位坏行，锁超时/死锁退避重试
+        _, failed = write_with_bisect(write, update_batch, controller=controller)
+        for item, error in failed:
+            stats['update_fail'] += 1
+            logger.error(f"❌ 更新失败 | meter_id: {item['meter_id']} | 错误: {error}")
+        update_batch.clear()
 
     logger.info("🚀 开始处理设备数据...")
-    with engine.begin() as conn:
-        for idx, row in enumerate(tqdm(devices, desc="处理设备", unit="条"), 1):
+    with engine.connect() as read_conn, engine.connect() as conn, \
+            RowReporter("reset_report_coords", write=tqdm.write) as reporter:
+        devices = stream_mappings(read_conn, device_query, {'limit': limit})
+        for row in tqdm(timed(devices, "db_read"), total=total, desc="处理设备", unit="条"):
             device_id = row['device_id']
             meter_id = row['second_id']
-            province = clean_string(row['province_name'])
-            city = clean_string(row['city_name'])
-            district = clean_string(row['region_name'])
+            with stage("match"):
+                province = clean_string(row['province_name'])
+                city = clean_string(row['city_name'])
+                district = clean_string(row['region_name'])
 
-            result, score, match_info = match_address(province, city, district, geo_index)
+                result, score, match_info = match_address(province, city, district, geo_index)
 
             if result:
                 lat, lon = random_point_within_radius(result[0], result[1], radius_km=10)
                 update_batch.append({
                     'device_id': device_id,
                     'meter_id': meter_id,
+                    'address_hash': row['address_hash'],
                     'lat': lat,
                     'lon': lon
                 })
                 stats['matched'] += 1
+                count("rows_matched")
                 if not district:
                     stats['matched_lvl2'] += 1
                 else:
                     stats['matched_lvl3'] += 1
             else:
                 stats['match_fail'] += 1
+                count("match_fail")
+                unmatched.append({'meter_id': meter_id, 'address_hash': row['address_hash']})
                 matched_prov, prov_score, matched_city, city_score, matched_dist, dist_score = match_info
-                tqdm.write(
+                failed_level = "省份" if city_score is None else "城市" if dist_score is None else "区县"
+                reporter.fail(
+                    f"{failed_level}匹配失败",
                     f"❌ 匹配失败 | 设备ID: {device_id} | "
                     f"原始地址: ({province}, {city}, {district}) | "
                     f"最相似匹配: ({matched_prov or '-'}:{prov_score:.2f}, "
@@ -221,14 +316,14 @@ def main():
                     f"{matched_dist or '-'}:{dist_score or 0:.2f})"
                 )
 
-            if len(update_batch) >= batch_size or idx == len(devices):
-                try:
-                    batch_update_mysql(conn, update_batch)
-                except Exception as e:
-                    stats['update_fail'] += len(update_batch)
-                    logger.error(f"❌ 批量更新失败 | 错误: {str(e)}")
-                update_batch = []
+            if len(update_batch) >= controller.size or len(unmatched) >= controller.size:
+                flush(conn)
+            tick()
+
+        flush(conn)
 
+    gauge("clean_cache_hits", clean_cache_info().hits)
+    logger.info(controller.summary())
     duration = time.time() - stats['start_time']
     logger.info(f"\n✅ 处理完成! 总耗时: {duration:.2f}秒")
     logger.info(f"📊 处理统计结果:")
@@ -242,4 +337,10 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="重新匹配设备坐标并同步到上报表")
+    parser.add_argument("--limit", type=int, default=LIMIT_COUNT, help="最多处理的设备数，0 表示不限")
+    parser.add_argument("--incremental", action="store_true", help="只处理上次同步后地址有变化的设备")
+    args = parser.parse_args()
+
+    with JobMetrics("reset_report_coords"):
+        main(limit=args.limit, incremental=args.incremental)